@@ -1,17 +1,160 @@
-from flask import Flask, request, jsonify
-from db import TextDB
+from flask import (
+    Flask,
+    Response,
+    g,
+    jsonify,
+    make_response,
+    request,
+    stream_with_context,
+)
+import atexit
+import collections
+import functools
+import sqlite3
+import time
+import numpy as np
+from db import EMBEDDING_SCOPES, AnswerWriter, TextDB
+from ingest import DocumentIngest, IngestError, detect_format
+from pointcloud import PointGrid
+from vectorindex import VectorIndex, from_blobs, from_rows, to_blob
 from topicmodel import TopicModel
 from qa import QAProcessor
+from contentencoding import compress, compress_chunks, negotiate
+from responsecache import ResponseCache, make_etag
+from tracing import (
+    PROFILER,
+    REGISTRY,
+    begin_request,
+    observe_request,
+    server_timing,
+    span,
+)
 from sentence_transformers import SentenceTransformer
-import pandas as pd
-import os, random
-from config import EMBEDDING_MODEL
+import os
+from config import (
+    EMBEDDING_MODEL,
+    LIST_PAGE_SIZE,
+    RESPONSE_COMPRESSION_MIN_BYTES,
+    SERVER_TIMING,
+)
+
+
+def list_response(db: TextDB, name: str, error: str):
+    """Responds with the rows of a list endpoint
+
+    With a `limit` query parameter a single page of rows with an id greater than
+    `after_id` is returned, and the X-Next-After-Id header holds the cursor for the
+    next page if there may be more rows. Pages hold at most LIST_PAGE_SIZE rows.
+    Without `limit` all rows are streamed page by page, as a JSON array or, with
+    `format=ndjson` or an Accept header of application/x-ndjson, as one JSON object
+    per line. Rows are rendered as JSON by SQLite, see `TextDB.get_json_rows`.
+    Only a list without any rows is answered with 404, there are no rows after the
+    last one.
+
+    Args:
+        db: the database
+        name: the list in LISTS, e.g. "documents"
+        error: error message if there are no rows at all
+
+    Returns:
+        the response
+    """
+    after_id = request.args.get("after_id", default=0, type=int)
+    limit = request.args.get("limit", type=int)
+
+    if limit is not None:
+        if limit < 1:
+            return jsonify({"error": "limit must be a positive integer"}), 400
+        limit = min(limit, LIST_PAGE_SIZE)
+        objects, count, last_id = db.get_json_rows(name, after_id=after_id, limit=limit)
+        if count == 0 and after_id == 0:
+            return jsonify({"error": error}), 404
+        response = Response("[" + objects + "]", mimetype="application/json")
+        if count > 0 and count == limit:
+            response.headers["X-Next-After-Id"] = str(last_id)
+        return response, 200
+
+    ndjson = (
+        request.args.get("format") == "ndjson"
+        or request.accept_mimetypes.best == "application/x-ndjson"
+    )
+    pages = db.iter_json_rows(
+        name,
+        after_id=after_id,
+        batch_size=LIST_PAGE_SIZE,
+        separator="\n" if ndjson else ",",
+    )
+    first = next(pages, None)
+    if first is None:
+        if after_id == 0:
+            return jsonify({"error": error}), 404
+        if ndjson:
+            return Response("", mimetype="application/x-ndjson"), 200
+        return Response("[]", mimetype="application/json"), 200
+
+    if ndjson:
+
+        def generate():
+            yield first + "\n"
+            for page in pages:
+                yield page + "\n"
+
+        return Response(
+            stream_with_context(generate()), mimetype="application/x-ndjson"
+        )
+
+    def generate():
+        yield "[" + first
+        for page in pages:
+            yield "," + page
+        yield "]"
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
+
+
+def compress_response(response: Response) -> Response:
+    """Compresses a response with the content coding the client prefers
+
+    Streamed responses are compressed chunk by chunk, others only if they have at
+    least RESPONSE_COMPRESSION_MIN_BYTES. Responses that are not successful or
+    already compressed are returned unchanged.
+
+    Args:
+        response: the response, compressed in place
+
+    Returns:
+        the response
+    """
+    if (
+        not 200 <= response.status_code < 300
+        or response.status_code == 204
+        or response.direct_passthrough
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate(request.accept_encodings)
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = compress_chunks(response.response, encoding)
+        response.headers.pop("Content-Length", None)
+    else:
+        body = response.get_data()
+        if len(body) < RESPONSE_COMPRESSION_MIN_BYTES:
+            return response
+        response.set_data(compress(body, encoding))
+    response.headers["Content-Encoding"] = encoding
+    return response
 
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__, instance_relative_config=True)
-    app.config.from_mapping(DATABASE=os.path.join(app.instance_path, "demo.sqlite"))
+    app.config.from_mapping(
+        DATABASE=os.path.join(app.instance_path, "demo.sqlite"),
+        SERVER_TIMING=SERVER_TIMING,
+    )
     sentence_transformer = SentenceTransformer(EMBEDDING_MODEL)
     question_answer = QAProcessor(embedding_model=sentence_transformer)
 
@@ -25,6 +168,143 @@ def create_app(test_config=None):
         pass
 
     db = TextDB(app.config["DATABASE"])
+    app.teardown_appcontext(lambda exception: db.release_connection())
+    answer_writer = AnswerWriter(db)
+    atexit.register(answer_writer.close)
+    # shared with the async routes of asgi.py
+    app.extensions["easytopics"] = {
+        "db": db,
+        "answer_writer": answer_writer,
+        "question_answer": question_answer,
+    }
+    point_grid = {"version": None, "grid": None}
+    vector_indexes = {}
+    response_cache = ResponseCache()
+
+    @app.before_request
+    def start_timing():
+        g.request_start = time.perf_counter()
+        g.request_timings = begin_request()
+
+    @app.after_request
+    def record_timing(response: Response) -> Response:
+        """Counts the request in /metrics and adds the Server-Timing header if enabled"""
+        seconds = time.perf_counter() - g.request_start
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        observe_request(request.method, route, response.status_code, seconds)
+        if app.config["SERVER_TIMING"]:
+            response.headers["Server-Timing"] = server_timing(
+                g.request_timings, seconds
+            )
+        return response
+
+    # registered last, so it runs before record_timing
+    app.after_request(compress_response)
+    # most recent uploads, running ones report their progress while they ingest
+    ingests = collections.deque(maxlen=16)
+
+    def get_point_grid() -> PointGrid:
+        """Returns the grid index of the topic map, rebuilt if coordinates or topics changed"""
+        version = db.get_generations(["Documents", "Coordinates"])
+        if point_grid["version"] != version:
+            points = np.array(db.get_points(), dtype=np.float64).reshape(-1, 4)
+            point_grid["grid"] = PointGrid(
+                xy=points[:, 1:3], doc_ids=points[:, 0], topic_ids=points[:, 3]
+            )
+            point_grid["version"] = version
+        return point_grid["grid"]
+
+    def get_vector_index(scope: str) -> VectorIndex:
+        """Returns the vector index of a scope, rebuilt if embeddings changed"""
+        version = db.get_generations(["Embeddings"])
+        cached = vector_indexes.get(scope)
+        if cached is None or cached["version"] != version:
+            ids, vectors = from_rows(db.iter_embeddings(scope))
+            cached = {"version": version, "index": VectorIndex(ids, vectors)}
+            vector_indexes[scope] = cached
+        return cached["index"]
+
+    def cached(*tables: str):
+        """Caches the responses of a GET view until one of the tables it reads changes
+
+        Responses carry a weak ETag derived from the URL, the negotiated media type and
+        content coding and the generations of the tables, see
+        `TextDB.get_generations`. A request whose If-None-Match matches gets an empty
+        304 response, otherwise the cached body is sent if the tables are unchanged.
+        Only successful responses are cached, compressed, and streamed ones once they
+        were sent completely.
+        """
+
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                key = (
+                    request.full_path,
+                    request.accept_mimetypes.best,
+                    negotiate(request.accept_encodings),
+                )
+                version = tuple(db.get_generations(list(tables)).values())
+                etag = make_etag(key, version)
+                if request.if_none_match.contains_weak(etag):
+                    response = Response(status=304)
+                else:
+                    cached_response = response_cache.get(key, version)
+                    if cached_response is not None:
+                        body, headers = cached_response
+                        response = Response(body, status=200, headers=headers)
+                    else:
+                        response = app.make_response(view(*args, **kwargs))
+                        if response.status_code != 200:
+                            return response
+                        compress_response(response)
+                        headers = {
+                            name: value
+                            for name, value in response.headers.items()
+                            if name != "Content-Length"
+                        }
+                        if response.is_streamed:
+                            response.response = response_cache.tee(
+                                key, version, response.response, headers
+                            )
+                        else:
+                            response_cache.put(
+                                key, version, response.get_data(), headers
+                            )
+                response.set_etag(etag, weak=True)
+                response.headers["Cache-Control"] = "no-cache"
+                response.vary.update(["Accept", "Accept-Encoding"])
+                return response
+
+            return wrapper
+
+        return decorator
+
+    def similar_response(scope: str, vector: np.ndarray, exclude_id: int | None = None):
+        """Responds with the items of a scope most similar to a vector
+
+        Query parameter k sets the number of hits, default 10. Every hit has id,
+        score (cosine similarity) and text.
+        """
+        k = max(0, request.args.get("k", default=10, type=int))
+        index = get_vector_index(scope)
+        if len(index) == 0:
+            return jsonify({"error": "No embeddings found"}), 404
+        ids, scores = index.search(vector, k=k + (exclude_id is not None))
+        hits = [
+            (int(item_id), float(score))
+            for item_id, score in zip(ids[0], scores[0])
+            if item_id != -1 and item_id != exclude_id
+        ][:k]
+        texts = db.get_texts(scope, [item_id for item_id, _ in hits])
+        return (
+            jsonify(
+                [
+                    {"id": item_id, "score": score, "text": texts.get(item_id)}
+                    for item_id, score in hits
+                ]
+            ),
+            200,
+        )
 
     @app.route("/documents", methods=["POST"])
     def upload_csv():
@@ -36,39 +316,174 @@ def create_app(test_config=None):
         if file.filename == "":
             return jsonify({"error": "No selected file"}), 400
 
-        if file and file.filename.endswith(".csv"):
-            docs = pd.read_csv(
-                file, sep=",", usecols=["text"], dtype={"text": str}, encoding="utf-8"
-            )["text"].to_list()
+        file_format = detect_format(file.filename)
+        if file_format is None:
+            return jsonify({"error": "Invalid file type"}), 400
 
-            db.insert_documents(docs)
+        ingest = DocumentIngest(db)
+        ingests.append(ingest)
+        try:
+            progress = ingest.run(file.stream, file_format, filename=file.filename)
+        except IngestError as error:
+            return jsonify({"error": str(error), **ingest.progress()}), 400
+        app.logger.info("Ingest: %s", progress)
+        return jsonify({"message": "file uploaded successfully", **progress}), 200
 
-            return jsonify({"message": "file uploaded successfully"}), 200
-
-        return jsonify({"error": "Invalid file type"}), 400
+    @app.route("/documents/ingests", methods=["GET"])
+    def get_ingests():
+        """Returns the progress of the most recent uploads, newest first"""
+        return jsonify([ingest.progress() for ingest in reversed(ingests)]), 200
 
     @app.route("/documents", methods=["GET"])
+    @cached("Documents")
     def get_documents():
-        documents = db.get_documents()
-        if len(documents) == 0:
-            return jsonify({"error": "No documents found"}), 404
-        return jsonify(documents), 200
+        return list_response(db, "documents", "No documents found")
 
     @app.route("/documents/<int:doc_id>", methods=["GET"])
+    @cached("Documents")
     def get_document(doc_id: int):
         document = db.get_document(doc_id)
         if document is None:
             return jsonify({"error": "Document not found"}), 404
         return jsonify(document), 200
 
+    @app.route("/documents/<int:doc_id>/similar", methods=["GET"])
+    def get_similar_documents(doc_id: int):
+        """Returns the documents, or answers with scope=answers, most similar to a document"""
+        scope = request.args.get("scope", default="documents")
+        if scope not in EMBEDDING_SCOPES:
+            return jsonify({"error": f"Unknown scope: {scope}"}), 400
+        vector = db.get_embedding("documents", doc_id)
+        if vector is None:
+            return jsonify({"error": "Document has no embedding"}), 404
+        exclude_id = doc_id if scope == "documents" else None
+        return similar_response(scope, from_blobs([vector]), exclude_id=exclude_id)
+
+    @app.route("/similar", methods=["GET"])
+    def get_similar():
+        """Returns the documents, or answers with scope=answers, most similar to the text q"""
+        query = request.args.get("q", default="")
+        if not query.strip():
+            return jsonify({"error": "No query"}), 400
+        scope = request.args.get("scope", default="documents")
+        if scope not in EMBEDDING_SCOPES:
+            return jsonify({"error": f"Unknown scope: {scope}"}), 400
+        with span("embedding.encode"):
+            vector = sentence_transformer.encode([query], normalize_embeddings=True)
+        return similar_response(scope, vector)
+
+    @app.route("/embeddings", methods=["POST"])
+    def compute_embeddings():
+        """Embeds all documents, or answers with {"scope": "answers"}, that have no embedding yet"""
+        params = request.get_json(silent=True) or {}
+        scope = params.get("scope", "documents")
+        batch_size = params.get("batch_size", 256)
+        if scope not in EMBEDDING_SCOPES:
+            return jsonify({"error": f"Unknown scope: {scope}"}), 400
+        # bool is a subclass of int
+        if type(batch_size) is not int or batch_size <= 0:
+            return jsonify({"error": "batch_size must be a positive integer"}), 400
+        count = 0
+        while True:
+            items = db.get_texts_without_embedding(scope, limit=batch_size)
+            if not items:
+                break
+            with span("embedding.encode"):
+                vectors = sentence_transformer.encode(
+                    [item["text"] for item in items], normalize_embeddings=True
+                )
+            db.insert_embeddings(
+                scope,
+                [(item["id"], to_blob(vector)) for item, vector in zip(items, vectors)],
+            )
+            count += len(items)
+        return (
+            jsonify({"message": "Embeddings computed successfully", "count": count}),
+            200,
+        )
+
     @app.route("/documents/<int:doc_id>/<int:topic_id>", methods=["POST"])
     def add_topic_to_document(doc_id: int, topic_id: int):
-        document = db.get_document(doc_id)
-        if document is None:
+        try:
+            updated = db.insert_topic_for_document(doc_id, topic_id)
+        except sqlite3.IntegrityError:
+            return jsonify({"error": "Topic not found"}), 404
+        if not updated:
             return jsonify({"error": "Document not found"}), 404
-        db.insert_topic_for_document(doc_id, topic_id)
         return jsonify({"message": "Topic added successfully"}), 200
 
+    @app.route("/documents/topics", methods=["POST"])
+    def add_topics_to_documents():
+        """Sets the topics of many documents, the body holds {"doc_topics": [[doc_id, topic_id], ...]}"""
+        doc_topics = request.json["doc_topics"]
+        try:
+            updated = db.insert_topics_for_documents(
+                [(doc_id, topic_id) for doc_id, topic_id in doc_topics]
+            )
+        except sqlite3.IntegrityError:
+            return jsonify({"error": "Topic not found"}), 404
+        return (
+            jsonify({"message": "Topics added successfully", "updated": updated}),
+            200,
+        )
+
+    @app.route("/search", methods=["GET"])
+    def search():
+        """Returns the documents or answers matching the keywords in q, best matches first
+
+        Query parameters: scope ("documents" or "answers"), limit, offset and raw to
+        pass q to FTS5 unchanged, see `TextDB.search`. If there may be more hits, the
+        X-Next-Offset header holds the offset of the next page.
+        """
+        query = request.args.get("q", default="")
+        if not query.strip():
+            return jsonify({"error": "No query"}), 400
+        limit = max(0, request.args.get("limit", default=20, type=int))
+        offset = max(0, request.args.get("offset", default=0, type=int))
+        try:
+            hits = db.search(
+                query,
+                scope=request.args.get("scope", default="documents"),
+                limit=limit,
+                offset=offset,
+                raw=request.args.get("raw", default="false").lower() == "true",
+            )
+        except ValueError as error:
+            return jsonify({"error": str(error)}), 400
+        response = jsonify(hits)
+        if len(hits) > 0 and len(hits) == limit:
+            response.headers["X-Next-Offset"] = str(offset + limit)
+        return response, 200
+
+    @app.route("/points", methods=["GET"])
+    def get_points():
+        """Returns the documents of the topic map in a viewport as a packed binary buffer
+
+        The body holds float32 coordinates (x, y per point), followed by int32
+        document ids and int32 topic ids (-1 for no topic), all little-endian.
+        Query parameters x_min, y_min, x_max, y_max restrict the viewport and zoom
+        selects the level of detail, see `PointGrid.query`.
+        """
+        grid = get_point_grid()
+        if len(grid) == 0:
+            return jsonify({"error": "No points found"}), 404
+
+        indices = grid.query(
+            x_min=request.args.get("x_min", type=float),
+            y_min=request.args.get("y_min", type=float),
+            x_max=request.args.get("x_max", type=float),
+            y_max=request.args.get("y_max", type=float),
+            zoom=request.args.get("zoom", default=0, type=int),
+        )
+        response = make_response(grid.pack(indices), 200)
+        response.headers["Content-Type"] = "application/octet-stream"
+        response.headers["X-Point-Count"] = str(len(indices))
+        response.headers["X-Point-Levels"] = str(grid.levels)
+        response.headers["X-Point-Bounds"] = ",".join(
+            str(float(bound)) for bound in (*grid.lower, *grid.upper)
+        )
+        return response
+
     @app.route("/questions", methods=["POST"])
     def add_question():
         question = request.json["question"]
@@ -76,11 +491,9 @@ def create_app(test_config=None):
         return jsonify({"message": "Question added successfully", "id": rowid}), 200
 
     @app.route("/questions", methods=["GET"])
+    @cached("Questions")
     def get_questions():
-        questions = db.get_questions()
-        if len(questions) == 0:
-            return jsonify({"error": "No questions found"}), 404
-        return jsonify(questions), 200
+        return list_response(db, "questions", "No questions found")
 
     @app.route("/questions/<int:question_id>", methods=["DELETE"])
     def remove_question(question_id: int):
@@ -91,11 +504,20 @@ def create_app(test_config=None):
     def ask_question():
         try_questions = request.json["tryout"]
         if try_questions == True:
-            documents = db.get_documents()
             question = request.json["question"]
             k = request.json["k"]
-            # randomly sample 5 documents or less
-            documents = random.sample(documents, k=2)
+            if type(k) is not int or k <= 0:
+                return jsonify({"error": "k must be a positive integer"}), 400
+            # randomly sample k documents or less, optionally stratified by "topic" or
+            # by "answered" status for the question stratify_question_id
+            try:
+                documents = db.sample_documents(
+                    k,
+                    stratify=request.json.get("stratify"),
+                    question_id=request.json.get("stratify_question_id"),
+                )
+            except ValueError as error:
+                return jsonify({"error": str(error)}), 400
 
             texts = [doc["text"] for doc in documents]
             answers = question_answer.ask_question_to_texts(question, texts=texts)
@@ -108,7 +530,8 @@ def create_app(test_config=None):
 
             # insert answers into db
             for doc in documents:
-                db.insert_answer(doc["id"], question_id, doc["answer"])
+                answer_writer.add(doc["id"], question_id, doc["answer"])
+            answer_writer.flush()
 
             return jsonify(documents), 200
 
@@ -127,15 +550,21 @@ def create_app(test_config=None):
                     doc["question"] = question_text
                     doc["answer"] = answer
                 for doc in documents:
-                    db.insert_answer(doc["id"], question_id, doc["answer"])
+                    answer_writer.add(doc["id"], question_id, doc["answer"])
+            answer_writer.flush()
+            app.logger.info("Answer writer: %s", answer_writer.stats())
             return jsonify(documents), 200
 
     @app.route("/answers", methods=["GET"])
+    @cached("Answers", "Documents", "Questions")
     def get_answers():
-        answers = db.get_answers()
-        if len(answers) == 0:
-            return jsonify({"error": "No answers found"}), 404
-        return jsonify(answers), 200
+        return list_response(db, "answers", "No answers found")
+
+    @app.route("/topics/stats", methods=["GET"])
+    @cached("Topics", "Documents", "Answers", "Questions")
+    def get_topic_stats():
+        """Returns document counts and per-question answer statistics of all topics"""
+        return jsonify(db.get_topic_stats()), 200
 
     @app.route("/topics", methods=["POST"])
     def add_topics():
@@ -143,6 +572,84 @@ def create_app(test_config=None):
         rowid = db.insert_topics(topics)
         return jsonify({"message": "Topics added successfully"}), 200
 
+    @app.route("/metrics", methods=["GET"])
+    def get_metrics():
+        """Returns span and request durations and cache statistics for Prometheus"""
+        cache_stats = response_cache.stats()
+        writer_stats = answer_writer.stats()
+        extra = [
+            (
+                "easytopics_response_cache_entries",
+                "gauge",
+                "Responses in the response cache",
+                cache_stats["entries"],
+            ),
+            (
+                "easytopics_response_cache_bytes",
+                "gauge",
+                "Size of the responses in the response cache",
+                cache_stats["bytes"],
+            ),
+        ]
+        for name in ["hits", "misses", "evictions"]:
+            extra.append(
+                (
+                    f"easytopics_response_cache_{name}_total",
+                    "counter",
+                    f"Response cache {name}",
+                    cache_stats[name],
+                )
+            )
+        extra.append(
+            (
+                "easytopics_answers_written_total",
+                "counter",
+                "Answers written by the answer writer",
+                writer_stats["rows_written"],
+            )
+        )
+        extra.append(
+            (
+                "easytopics_answers_dropped_total",
+                "counter",
+                "Answers dropped by the answer writer for violating a constraint",
+                writer_stats["rows_dropped"],
+            )
+        )
+        extra.append(
+            (
+                "easytopics_profiler_samples_total",
+                "counter",
+                "Samples taken by the sampling profiler",
+                PROFILER.samples,
+            )
+        )
+        return Response(REGISTRY.render(extra), mimetype="text/plain; version=0.0.4")
+
+    @app.route("/profiler", methods=["GET"])
+    def get_profile():
+        """Returns the samples of the sampling profiler as collapsed stacks
+
+        The output can be rendered with flamegraph.pl or speedscope.
+        """
+        return Response(PROFILER.collapsed(), mimetype="text/plain")
+
+    @app.route("/profiler", methods=["POST"])
+    def set_profiler():
+        """Starts the sampling profiler with {"enabled": true} and stops it with false
+
+        With {"reset": true} the samples taken so far are removed.
+        """
+        params = request.get_json(silent=True) or {}
+        if params.get("reset"):
+            PROFILER.reset()
+        if "enabled" in params:
+            if params["enabled"]:
+                PROFILER.start()
+            else:
+                PROFILER.stop()
+        return jsonify({"running": PROFILER.running, "samples": PROFILER.samples}), 200
+
     return app
 
 
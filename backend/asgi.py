@@ -0,0 +1,169 @@
+"""ASGI entry point that serves LLM-bound requests without a thread per request
+
+POST /ask_question with "tryout": true, the interactive questions of the frontend,
+is handled on the event loop: the LLM is asked about the sampled documents
+concurrently with `QAProcessor.aask_question_to_texts` and the database calls run on
+the threads of `AsyncTextDB`, so requests waiting on the LLM hold no thread. All
+other requests are passed to the Flask app of api.py, which runs on
+ASGI_WSGI_WORKERS threads.
+
+Usage (from backend/):
+    uvicorn --factory asgi:create_asgi_app --port 5000
+"""
+import json
+import time
+from a2wsgi import WSGIMiddleware
+from flask import Flask
+from api import create_app
+from config import ASGI_WSGI_WORKERS
+from db import AsyncTextDB
+from tracing import begin_request, observe_request, server_timing
+
+
+async def read_body(receive) -> bytes | None:
+    """Reads the body of an HTTP request, None if the client disconnected"""
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+def replay(body: bytes, receive):
+    """Returns a receive callable that yields an already read body once more"""
+    pending = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def replayed():
+        if pending:
+            return pending.pop()
+        return await receive()
+
+    return replayed
+
+
+class AsyncApp:
+    """ASGI app serving the async routes and passing all others to the Flask app"""
+
+    def __init__(self, flask_app: Flask, workers: int = ASGI_WSGI_WORKERS) -> None:
+        """Initializes the AsyncApp class
+
+        Args:
+            flask_app (Flask): the app of `api.create_app`
+            workers (int): number of threads running Flask requests
+
+        Returns:
+            None
+        """
+        self.flask_app = flask_app
+        self.wsgi = WSGIMiddleware(flask_app, workers=workers)
+        state = flask_app.extensions["easytopics"]
+        self.db = AsyncTextDB(state["db"])
+        self.answer_writer = state["answer_writer"]
+        self.question_answer = state["question_answer"]
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        if (
+            scope["type"] == "http"
+            and scope["method"] == "POST"
+            and scope["path"] == "/ask_question"
+        ):
+            body = await read_body(receive)
+            if body is None:
+                return
+            try:
+                params = json.loads(body)
+            except ValueError:
+                params = None
+            if isinstance(params, dict) and params.get("tryout") is True:
+                start = time.perf_counter()
+                timings = begin_request()
+                status, data = await self.ask_question(params)
+                seconds = time.perf_counter() - start
+                observe_request("POST", "/ask_question", status, seconds)
+                headers = []
+                if self.flask_app.config["SERVER_TIMING"]:
+                    value = server_timing(timings, seconds)
+                    headers.append((b"server-timing", value.encode("ascii")))
+                await self.send_json(send, status, data, headers)
+                return
+            receive = replay(body, receive)
+        await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send) -> None:
+        """Writes the buffered answers and stops the database threads on shutdown"""
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.db.run(self.answer_writer.flush)
+                self.db.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def ask_question(self, params: dict) -> tuple[int, object]:
+        """Asks a question about a sample of documents, see POST /ask_question in api.py
+
+        Args:
+            params (dict): the JSON body of the request
+
+        Returns:
+            tuple[int, object]: the status code and the JSON body of the response
+        """
+        try:
+            question, k = params["question"], params["k"]
+        except KeyError as error:
+            return 400, {"error": f"Missing parameter: {error.args[0]}"}
+        if type(k) is not int or k <= 0:
+            return 400, {"error": "k must be a positive integer"}
+        try:
+            documents = await self.db.sample_documents(
+                k,
+                stratify=params.get("stratify"),
+                question_id=params.get("stratify_question_id"),
+            )
+        except ValueError as error:
+            return 400, {"error": str(error)}
+
+        texts = [doc["text"] for doc in documents]
+        answers = await self.question_answer.aask_question_to_texts(question, texts)
+        for answer, doc in zip(answers, documents):
+            doc["question"] = question
+            doc["answer"] = answer
+
+        question_id = await self.db.insert_question(question)
+        await self.db.run(self.write_answers, question_id, documents)
+        return 200, documents
+
+    def write_answers(self, question_id: int, documents: list[dict]) -> None:
+        """Writes the answers of documents with the answer writer of the Flask app"""
+        for doc in documents:
+            self.answer_writer.add(doc["id"], question_id, doc["answer"])
+        self.answer_writer.flush()
+
+    async def send_json(self, send, status: int, data, headers: list = ()) -> None:
+        """Sends a JSON response, serialized like the responses of the Flask app"""
+        body = self.flask_app.json.dumps(data).encode("utf-8")
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode("ascii")),
+                    *headers,
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
+
+
+def create_asgi_app(test_config=None) -> AsyncApp:
+    """Creates the Flask app of api.py and wraps it in an `AsyncApp`"""
+    return AsyncApp(create_app(test_config))
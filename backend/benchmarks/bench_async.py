@@ -0,0 +1,182 @@
+"""Concurrent LLM-bound requests: threaded Flask against the ASGI app of asgi.py
+
+Both servers run in this process against a fake LLM that answers after --latency
+seconds, like a remote LLM does. --requests tryout questions of --k documents
+each are sent over HTTP, at most --concurrency at once:
+
+    wsgi  the Flask app on a server with --threads worker threads, every request
+          holds a thread while it waits on the LLM, one document after another
+    asgi  `AsyncApp` served by uvicorn, requests wait on the event loop and the
+          LLM is asked about the documents of a request concurrently
+
+Reports the throughput, the latency percentiles and the largest number of LLM
+requests in flight at once.
+
+Usage (from backend/):
+    python -m benchmarks.bench_async --requests 1000 --concurrency 500 --latency 1
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import os
+import tempfile
+import threading
+import time
+import types
+import numpy as np
+import uvicorn
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+from asgi import create_asgi_app
+from db import TextDB
+
+
+class FakeLLM:
+    """Stands in for the chat model, answers after `latency` seconds like a remote LLM"""
+
+    def __init__(self, latency: float) -> None:
+        self.latency = latency
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def _enter(self) -> None:
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def _exit(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+
+    def __call__(self, messages):
+        self._enter()
+        time.sleep(self.latency)
+        self._exit()
+        return types.SimpleNamespace(content="answer")
+
+    async def apredict_messages(self, messages):
+        self._enter()
+        await asyncio.sleep(self.latency)
+        self._exit()
+        return types.SimpleNamespace(content="answer")
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args) -> None:
+        pass
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """WSGI server handling requests on a fixed number of threads, like gunicorn --threads"""
+
+    request_queue_size = 4096
+
+    def __init__(self, host: str, port: int, app, threads: int) -> None:
+        super().__init__(host, port, app, handler=QuietRequestHandler)
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+
+    def process_request(self, request, client_address) -> None:
+        self.pool.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address) -> None:
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+async def post(port: int, path: str, payload: dict) -> int:
+    """Sends a POST request with a JSON body, returns the status code"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = json.dumps(payload).encode("utf-8")
+    writer.write(
+        f"POST {path} HTTP/1.1\r\nHost: localhost\r\n"
+        f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+        "Connection: close\r\n\r\n".encode("ascii") + body
+    )
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    await writer.wait_closed()
+    return int(response.split(b" ", 2)[1])
+
+
+async def load(port: int, args) -> dict:
+    """Sends the questions, at most args.concurrency at once"""
+    slots = asyncio.Semaphore(args.concurrency)
+    latencies, errors = [], 0
+
+    async def ask(i: int) -> None:
+        nonlocal errors
+        async with slots:
+            start = time.perf_counter()
+            payload = {"tryout": True, "question": f"Question {i}?", "k": args.k}
+            if await post(port, "/ask_question", payload) != 200:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(ask(i) for i in range(args.requests)))
+    seconds = time.perf_counter() - start
+    p50, p99 = np.percentile(latencies, [50, 99])
+    return {
+        "requests_s": args.requests / seconds,
+        "p50": p50,
+        "p99": p99,
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=1.0)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--port", type=int, default=5050)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_name = os.path.join(tmpdir, "bench.sqlite3")
+        db = TextDB(db_name)
+        db.insert_documents([f"Document {i}" for i in range(10_000)])
+        app = create_asgi_app({"TESTING": True, "DATABASE": db_name})
+
+        print("server\trequests_s\tp50_s\tp99_s\tmax_llm_in_flight\terrors")
+        for name in ["wsgi", "asgi"]:
+            llm = FakeLLM(args.latency)
+            app.question_answer.llm = llm
+            if name == "wsgi":
+                server = PooledWSGIServer(
+                    "127.0.0.1", args.port, app.flask_app, args.threads
+                )
+                thread = threading.Thread(target=server.serve_forever)
+            else:
+                server = uvicorn.Server(
+                    uvicorn.Config(
+                        app, port=args.port, log_level="warning", backlog=4096
+                    )
+                )
+                thread = threading.Thread(target=server.run)
+            thread.start()
+            time.sleep(1)
+            result = asyncio.run(load(args.port, args))
+            if name == "wsgi":
+                server.shutdown()
+                server.server_close()
+            else:
+                server.should_exit = True
+            thread.join()
+            print(
+                f"{name}\t{result['requests_s']:.1f}\t{result['p50']:.2f}\t"
+                f"{result['p99']:.2f}\t{llm.max_in_flight}\t{result['errors']}"
+            )
+        db.close_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Size and read throughput of compressed texts
+
+Fills a database with --docs synthetic forum posts, or the text column of --csv, and
+measures the stored size of the texts, the file size after VACUUM and the read
+throughput of a full scan with iter_documents and of random get_document lookups,
+first uncompressed, then after TextDB.compress_texts for every --level. The page
+cache of SQLite is limited to --cache-mb, so reads of large corpora are served by
+the file system cache as in production.
+
+Usage (from backend/):
+    python -m benchmarks.bench_compression --docs 200000 --level 3 9 19
+    python -m benchmarks.bench_compression --csv ../data/posts.csv
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from db import TextDB
+
+WORDS = """
+the be to of and a in that have i it for not on with he as you do at this but his by
+from they we say her she or an will my one all would there their what so up out if
+about who get which go me when make can like time no just him know take people into
+year your good some could them see other than then now look only come its over think
+also back after use two how our work first well way even new want because any these
+give day most us is are was were has had been price order shipping battery screen
+driver update install error problem issue fixed thanks please help question answer
+email phone support ticket account password server network card memory disk windows
+linux version release bug report log file setting option default works broken again
+""".split()
+
+
+def make_posts(args, rng: np.random.Generator):
+    """Yields chunks of forum posts with headers, quotes of earlier posts and signatures"""
+    weights = 1 / np.arange(1, len(WORDS) + 1)
+    weights /= weights.sum()
+    words = np.array(WORDS)
+    posts = []
+    for start in range(0, args.docs, 10_000):
+        n = min(10_000, args.docs - start)
+        # words of all sentences of the chunk drawn at once, split at random lengths
+        pool = iter(words[rng.choice(len(WORDS), size=n * 160, p=weights)].tolist())
+        chunk = []
+        for _ in range(n):
+            sentences = []
+            for _ in range(rng.integers(2, 12)):
+                sentence = " ".join(next(pool) for _ in range(rng.integers(5, 15)))
+                sentences.append(sentence.capitalize() + ".")
+            sender, recipient = rng.integers(1_000, size=2)
+            lines = [
+                f"From: user{sender}@example.com",
+                f"Subject: Re: {' '.join(next(pool) for _ in range(4))}",
+                f"Date: 2023-{rng.integers(1, 13):02d}-{rng.integers(1, 29):02d}",
+                "",
+                f"Hi user{recipient},",
+                "",
+            ]
+            if posts and rng.random() < 0.5:
+                quoted = posts[rng.integers(len(posts))].splitlines()[6:9]
+                lines += [f"> {line}" for line in quoted] + [""]
+            lines += [" ".join(sentences), "", "Best regards,", f"user{sender}"]
+            lines += ["-- ", "Sent from my phone"]
+            post = "\n".join(lines)
+            chunk.append(post)
+            posts = posts[-99:] + [post]
+        yield chunk
+
+
+def measure(db: TextDB, db_name: str, args, rng: np.random.Generator) -> str:
+    """Returns a result row: stored text size, file size, scan and lookup throughput"""
+    storage = db.get_text_storage("documents")
+    db.conn.execute("VACUUM")
+    file_size = os.path.getsize(db_name)
+
+    start = time.perf_counter()
+    text_bytes = sum(len(doc["text"]) for doc in db.iter_documents(batch_size=10_000))
+    scan = time.perf_counter() - start
+
+    ids = rng.integers(1, storage["n_texts"] + 1, size=args.lookups)
+    start = time.perf_counter()
+    for doc_id in ids:
+        db.get_document(int(doc_id))
+    lookup = time.perf_counter() - start
+    return (
+        f"{storage['stored_bytes'] / 2**20:.1f}\t{file_size / 2**20:.1f}\t"
+        f"{text_bytes / 2**20 / scan:.0f}\t{args.lookups / lookup:.0f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=200_000)
+    parser.add_argument(
+        "--csv", help="CSV file with a text column instead of synthetic posts"
+    )
+    parser.add_argument("--level", type=int, nargs="+", default=[3, 9, 19])
+    parser.add_argument("--lookups", type=int, default=20_000)
+    parser.add_argument("--cache-mb", type=int, default=16)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    pragmas = {
+        "journal_mode": "WAL",
+        "cache_size": -args.cache_mb * 1024,
+        "mmap_size": 0,
+    }
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_name = os.path.join(tmpdir, "bench.sqlite3")
+        db = TextDB(db_name, pragmas=pragmas)
+        start = time.perf_counter()
+        if args.csv:
+            for chunk in pd.read_csv(args.csv, usecols=["text"], chunksize=10_000):
+                db.insert_documents(chunk["text"].dropna().astype(str).to_list())
+        else:
+            for posts in make_posts(args, rng):
+                db.insert_documents(posts)
+        print(f"inserted documents in {time.perf_counter() - start:.1f} s")
+
+        print("mode\ttexts_mib\tfile_mib\tscan_mib_s\tlookups_s")
+        print(f"plain\t{measure(db, db_name, args, rng)}")
+        for level in args.level:
+            db.codec.level = level
+            start = time.perf_counter()
+            db.compress_texts("documents")
+            seconds = time.perf_counter() - start
+            print(
+                f"zstd-{level}\t{measure(db, db_name, args, rng)}\t(compressed in {seconds:.1f} s)"
+            )
+        db.close_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""TextDB ingest and query timings at up to a million documents, tracked over time
+
+Fills a database per size in --sizes with synthetic forum posts, see
+bench_compression, --topics topics and --questions questions, each answered for a
+fraction --answered of the documents, --non-answers of them with the
+NON_ANSWER_TOKEN, and times:
+
+    insert_documents            all documents, in batches of --batch
+    insert_topics_for_documents the topic of every document
+    insert_answers              all answers, in batches of --batch
+    get_documents               all documents, and a page of --page documents
+    get_document                a single document
+    get_documents_without_answer  the unanswered documents of a question
+    get_answers                 all answers, and a page of --page answers
+    get_answers_by_doc          the answers of a document
+    get_docs_with_answers_and_topic_ids  the document/answer/topic join
+    get_topic_stats             the per topic and question statistics
+
+Inserts run once, reads --repeat times with the median reported, together with
+the rows per second. Every run is appended to --history, a JSON line with the git
+commit, the SQLite version, the pragmas and the settings, and compared with the
+most recent earlier run of the same size and settings, so the effect of index,
+pragma and query changes can be read off. --pragma overrides SQLITE_PRAGMAS, e.g.
+--pragma synchronous=FULL, and --label names a run.
+
+Usage (from backend/):
+    python -m benchmarks.bench_db --sizes 10000 100000 1000000
+    python -m benchmarks.bench_db --sizes 100000 --pragma mmap_size=0 --label no-mmap
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import time
+import numpy as np
+from benchmarks.bench_compression import make_posts
+from config import NON_ANSWER_TOKEN, SQLITE_PRAGMAS
+from db import TextDB
+
+HISTORY = os.path.join(os.path.dirname(__file__), "results", "bench_db.jsonl")
+# settings that must match for two runs to be compared
+SETTINGS = [
+    "questions",
+    "answered",
+    "non_answers",
+    "topics",
+    "batch",
+    "page",
+    "pragmas",
+]
+
+
+def timed(func, *args, repeat: int = 1) -> tuple[float, object]:
+    """Returns the median wall time of `repeat` calls and the last result"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+
+def git_commit() -> str | None:
+    """Returns the current commit, with "-dirty" if there are uncommitted changes"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-dirty" if dirty else "")
+
+
+def run_size(db: TextDB, n_docs: int, args) -> dict:
+    """Fills the database with n_docs documents and times all operations"""
+    rng = random.Random(0)
+    results = {}
+
+    def record(name: str, seconds: float, rows: int) -> None:
+        results[name] = {"seconds": seconds, "rows": rows}
+        print(
+            f"{n_docs}\t{name}\t{rows}\t{seconds * 1000:.2f}\t"
+            f"{rows / seconds if seconds > 0 else float('inf'):.0f}",
+            flush=True,
+        )
+
+    seconds = 0.0
+    for chunk in make_posts(argparse.Namespace(docs=n_docs), np.random.default_rng(0)):
+        for start in range(0, len(chunk), args.batch):
+            seconds += timed(db.insert_documents, chunk[start : start + args.batch])[0]
+    record("insert_documents", seconds, n_docs)
+
+    topic_ids = db.upsert_topics(
+        [(topic, f"topic {topic} keywords") for topic in range(args.topics)]
+    )
+    doc_topics = [
+        (doc_id, topic_ids[rng.randrange(args.topics)])
+        for doc_id in range(1, n_docs + 1)
+    ]
+    seconds = timed(db.insert_topics_for_documents, doc_topics)[0]
+    record("insert_topics_for_documents", seconds, n_docs)
+    del doc_topics
+
+    question_ids = [
+        db.insert_question(f"What does post {i} say about the topic?")
+        for i in range(args.questions)
+    ]
+    seconds, n_answers = 0.0, 0
+    for question_id in question_ids:
+        doc_ids = rng.sample(range(1, n_docs + 1), int(n_docs * args.answered))
+        for start in range(0, len(doc_ids), args.batch):
+            answers = [
+                (
+                    doc_id,
+                    question_id,
+                    NON_ANSWER_TOKEN
+                    if rng.random() < args.non_answers
+                    else f"Post {doc_id} answers question {question_id} like this.",
+                )
+                for doc_id in doc_ids[start : start + args.batch]
+            ]
+            seconds += timed(db.insert_answers, answers)[0]
+            n_answers += len(answers)
+    record("insert_answers", seconds, n_answers)
+
+    repeat = args.repeat
+    after_id = n_docs // 2
+    reads = [
+        ("get_documents", db.get_documents, ()),
+        ("get_documents_page", db.get_documents, (after_id, args.page)),
+        ("get_document", db.get_document, (after_id,)),
+        (
+            "get_documents_without_answer",
+            db.get_documents_without_answer,
+            (question_ids[0],),
+        ),
+        ("get_answers", db.get_answers, ()),
+        ("get_answers_page", db.get_answers, (n_answers // 2, args.page)),
+        ("get_answers_by_doc", db.get_answers_by_doc, (doc_ids[0],)),
+        (
+            "get_docs_with_answers_and_topic_ids",
+            db.get_docs_with_answers_and_topic_ids,
+            (),
+        ),
+        ("get_topic_stats", db.get_topic_stats, ()),
+    ]
+    for name, func, func_args in reads:
+        seconds, rows = timed(func, *func_args, repeat=repeat)
+        record(name, seconds, len(rows) if isinstance(rows, list) else 1)
+    return results
+
+
+def load_history(path: str) -> list[dict]:
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare(run: dict, history: list[dict]) -> None:
+    """Prints the change of every timing against the latest comparable earlier run"""
+    for previous in reversed(history):
+        if previous["n_docs"] == run["n_docs"] and all(
+            previous["settings"].get(key) == run["settings"][key] for key in SETTINGS
+        ):
+            break
+    else:
+        print(f"{run['n_docs']}: no earlier run with the same settings")
+        return
+    print(
+        f"{run['n_docs']}: against {previous['commit']} {previous['label'] or ''} "
+        f"of {previous['time']}"
+    )
+    for name, result in run["results"].items():
+        old = previous["results"].get(name)
+        if old is None or old["seconds"] == 0:
+            continue
+        change = result["seconds"] / old["seconds"] - 1
+        print(
+            f"  {name}\t{old['seconds'] * 1000:.2f} -> "
+            f"{result['seconds'] * 1000:.2f} ms\t{change:+.0%}"
+        )
+
+
+def parse_pragma(value: str) -> tuple[str, int | str]:
+    name, sep, setting = value.partition("=")
+    if not sep:
+        raise argparse.ArgumentTypeError(f"Expected name=value: {value}")
+    try:
+        return name, int(setting)
+    except ValueError:
+        return name, setting
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--questions", type=int, default=5)
+    parser.add_argument("--answered", type=float, default=0.5)
+    parser.add_argument("--non-answers", type=float, default=0.2)
+    parser.add_argument("--topics", type=int, default=50)
+    parser.add_argument("--batch", type=int, default=10_000)
+    parser.add_argument("--page", type=int, default=1_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--pragma", type=parse_pragma, action="append", default=[])
+    parser.add_argument("--label")
+    parser.add_argument("--history", default=HISTORY)
+    args = parser.parse_args()
+
+    pragmas = {**SQLITE_PRAGMAS, **dict(args.pragma)}
+    settings = {key: getattr(args, key, None) for key in SETTINGS}
+    settings["pragmas"] = pragmas
+    history = load_history(args.history)
+    commit = git_commit()
+
+    print("n_docs\toperation\trows\tms\trows_s")
+    runs = []
+    for n_docs in args.sizes:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db = TextDB(os.path.join(tmpdir, "bench.sqlite3"), pragmas=pragmas)
+            results = run_size(db, n_docs, args)
+            db.close_connection()
+        runs.append(
+            {
+                "time": datetime.datetime.now().isoformat(timespec="seconds"),
+                "commit": commit,
+                "label": args.label,
+                "sqlite": sqlite3.sqlite_version,
+                "n_docs": n_docs,
+                "settings": settings,
+                "results": results,
+            }
+        )
+
+    for run in runs:
+        compare(run, history)
+    os.makedirs(os.path.dirname(args.history), exist_ok=True)
+    with open(args.history, "a") as f:
+        for run in runs:
+            f.write(json.dumps(run) + "\n")
+
+
+if __name__ == "__main__":
+    main()
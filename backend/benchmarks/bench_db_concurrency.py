@@ -0,0 +1,116 @@
+"""Reader latency while a writer ingests answers
+
+A writer thread inserts answers in transactions of --batch rows, as a long
+answer-ingest run does, while reader threads look up documents and questions. Each connection setup is run for --seconds and the reader latency
+percentiles and throughput of readers and writer are reported:
+
+    shared  a single connection shared by all threads with default pragmas (the old TextDB)
+    delete  one connection per thread with a rollback journal
+    wal     one connection per thread in WAL mode (the default SQLITE_PRAGMAS)
+
+Usage (from backend/):
+    python -m benchmarks.bench_db_concurrency --docs 50000 --readers 4
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+import numpy as np
+from config import SQLITE_PRAGMAS
+from db import TextDB
+
+
+class SharedTextDB(TextDB):
+    """TextDB with a single connection shared by all threads"""
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._shared is None:
+            self._shared = self._connect()
+        return self._shared
+
+
+def run(db: TextDB, args) -> dict:
+    question_id = db.insert_question("What is discussed?")
+    stop = threading.Event()
+    latencies = [[] for _ in range(args.readers)]
+    written = [0]
+
+    def writer():
+        doc_id = 1
+        while not stop.is_set():
+            rows = []
+            for _ in range(args.batch):
+                rows.append((doc_id, question_id, "An answer " * 20))
+                doc_id = doc_id % args.docs + 1
+            with db.conn as conn:
+                conn.executemany(
+                    "INSERT INTO Answers (doc_id, question_id, answer) VALUES (?, ?, ?)",
+                    rows,
+                )
+            written[0] += args.batch
+
+    def reader(i: int):
+        rng = random.Random(i)
+        while not stop.is_set():
+            start = time.perf_counter()
+            if rng.random() < 0.8:
+                db.get_document(rng.randint(1, args.docs))
+            else:
+                db.get_questions()
+            latencies[i].append(time.perf_counter() - start)
+        db.release_connection()
+
+    threads = [threading.Thread(target=writer)] + [
+        threading.Thread(target=reader, args=(i,)) for i in range(args.readers)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    latencies = np.concatenate([np.array(values) for values in latencies]) * 1000
+    return {
+        "reads_per_s": len(latencies) / args.seconds,
+        "read_p50_ms": np.percentile(latencies, 50),
+        "read_p99_ms": np.percentile(latencies, 99),
+        "read_max_ms": latencies.max(),
+        "writes_per_s": written[0] / args.seconds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=50_000)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--batch", type=int, default=5_000)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    args = parser.parse_args()
+
+    setups = {
+        "shared": (SharedTextDB, {}),
+        "delete": (TextDB, {**SQLITE_PRAGMAS, "journal_mode": "DELETE"}),
+        "wal": (TextDB, SQLITE_PRAGMAS),
+    }
+
+    print("setup\treads/s\tp50_ms\tp99_ms\tmax_ms\twrites/s")
+    for name, (cls, pragmas) in setups.items():
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db = cls(os.path.join(tmpdir, "bench.sqlite3"), pragmas=pragmas)
+            db.insert_documents(f"Document number {i}" for i in range(args.docs))
+            result = run(db, args)
+            db.close_connection()
+        print(
+            f"{name}\t{result['reads_per_s']:.0f}\t{result['read_p50_ms']:.2f}\t"
+            f"{result['read_p99_ms']:.2f}\t{result['read_max_ms']:.1f}\t"
+            f"{result['writes_per_s']:.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
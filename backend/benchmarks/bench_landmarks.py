@@ -0,0 +1,62 @@
+"""Label agreement of landmark mode with full fits
+
+Fits the topic model once on all documents and once on landmarks only and
+reports the adjusted rand index (ARI) between both labelings and against the
+true clusters, together with the wall time of both runs.
+
+Usage (from backend/):
+    python -m benchmarks.bench_landmarks --sizes 20000 50000 --landmarks 5000
+"""
+import argparse
+import time
+import numpy as np
+import optuna
+from sklearn.metrics import adjusted_rand_score
+from benchmarks.synthetic import load_clustered_embeddings
+from topicmodel import TopicModel
+
+
+def fit_labels(embeddings: np.ndarray, args, **kwargs) -> tuple[np.ndarray, float]:
+    tm = TopicModel(
+        min_cluster=args.min_cluster,
+        max_cluster=args.max_cluster,
+        max_evals=args.max_evals,
+        storage=None,
+        **kwargs,
+    )
+    tm.embeddings = embeddings
+    start = time.perf_counter()
+    tm.optimize_umap_hdbscan()
+    return tm.get_labels(), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[20_000, 50_000])
+    parser.add_argument("--dims", type=int, default=384)
+    parser.add_argument("--landmarks", type=int, default=5_000)
+    parser.add_argument("--method", default="stratified")
+    parser.add_argument("--max-evals", type=int, default=5)
+    parser.add_argument("--min-cluster", type=int, default=5)
+    parser.add_argument("--max-cluster", type=int, default=40)
+    args = parser.parse_args()
+
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+
+    print("n_docs\tfull_s\tlandmark_s\tari_full_vs_landmark\tari_full\tari_landmark")
+    for n_docs in args.sizes:
+        embeddings, truth = load_clustered_embeddings(n_docs, dims=args.dims)
+        full, full_time = fit_labels(embeddings, args)
+        landmark, landmark_time = fit_labels(
+            embeddings, args, landmarks=args.landmarks, landmark_method=args.method
+        )
+        print(
+            f"{n_docs}\t{full_time:.1f}\t{landmark_time:.1f}\t"
+            f"{adjusted_rand_score(full, landmark):.3f}\t"
+            f"{adjusted_rand_score(truth, full):.3f}\t"
+            f"{adjusted_rand_score(truth, landmark):.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
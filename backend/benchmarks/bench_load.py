@@ -0,0 +1,393 @@
+"""End-to-end load test of the API against a fake OpenAI-compatible LLM server
+
+Starts the app of `create_app` on a temporary database, served over HTTP by a
+threaded WSGI server or, with --server asgi, by uvicorn with the app of asgi.py, and
+a local fake of the OpenAI chat completions API that answers after --latency
+seconds plus --token-latency per completion token and fails with status 500 at
+--error-rate. The LLM client of qa.py is pointed at it through OPENAI_API_BASE,
+so requests go through langchain and openai, retries included. Then:
+
+    upload  --upload-workers clients upload JSONL files of --batch forum posts, see
+            bench_compression, until --docs documents are stored
+    full    POST /ask_question in full mode answers --questions new questions about
+            all documents, while --workers clients send the mixed requests
+    mixed   --workers clients send requests for --seconds, drawn by the weights of
+            --mix from documents (a page of GET /documents), document (GET
+            /documents/<id>), answers (a page of GET /answers), tryout (POST
+            /ask_question in tryout mode with --k documents) and upload
+
+Reported per phase and operation: requests/s, documents/s, latency percentiles,
+errors and, from the Server-Timing headers, the mean time spent in the database,
+which grows with contention for SQLite. The fake LLM reports its requests, errors
+and tokens.
+
+Usage (from backend/):
+    python -m benchmarks.bench_load --docs 5000 --workers 16 --latency 0.5
+    python -m benchmarks.bench_load --server asgi --mix tryout=1 --workers 200
+"""
+import argparse
+import collections
+import json
+import logging
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import requests
+import uvicorn
+from werkzeug.serving import WSGIRequestHandler, make_server
+from benchmarks.bench_compression import make_posts
+
+OPERATIONS = ["documents", "document", "answers", "tryout", "upload"]
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    """Answers POST /v1/chat/completions like the OpenAI API, on a thread per request"""
+
+    daemon_threads = True
+    request_queue_size = 4096
+
+    def __init__(self, port: int, args) -> None:
+        super().__init__(("127.0.0.1", port), FakeOpenAIHandler)
+        self.latency = args.latency
+        self.token_latency = args.token_latency
+        self.completion_tokens = args.completion_tokens
+        self.error_rate = args.error_rate
+        self.stats = collections.Counter()
+        self.lock = threading.Lock()
+
+    def count(self, **counts) -> None:
+        with self.lock:
+            self.stats.update(counts)
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        # roughly 4 characters per token, like the tokenizers of OpenAI models
+        prompt_tokens = sum(len(m["content"]) for m in body["messages"]) // 4
+        completion_tokens = min(server.completion_tokens, body.get("max_tokens") or 256)
+        time.sleep(server.latency + completion_tokens * server.token_latency)
+
+        if random.random() < server.error_rate:
+            server.count(requests=1, errors=1)
+            status = 500
+            payload = {"error": {"message": "Fake error", "type": "server_error"}}
+        else:
+            server.count(
+                requests=1,
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+            )
+            status = 200
+            payload = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "gpt-3.5-turbo"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {
+                            "role": "assistant",
+                            "content": " ".join(["answer"] * completion_tokens),
+                        },
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            }
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args) -> None:
+        pass
+
+
+class Recorder:
+    """Collects the latency, documents and database time of requests per operation"""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.latencies = collections.defaultdict(list)
+        self.db_seconds = collections.defaultdict(float)
+        self.documents = collections.Counter()
+        self.errors = collections.Counter()
+
+    def add(self, operation: str, seconds: float, response, documents: int = 0):
+        db_ms = re.search(r"db;dur=([\d.]+)", response.headers.get("Server-Timing", ""))
+        with self.lock:
+            self.latencies[operation].append(seconds)
+            if db_ms:
+                self.db_seconds[operation] += float(db_ms.group(1)) / 1000
+            if response.status_code >= 400:
+                self.errors[operation] += 1
+            else:
+                self.documents[operation] += documents
+
+    def report(self, phase: str, seconds: float) -> None:
+        for operation, latencies in sorted(self.latencies.items()):
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+            print(
+                f"{phase}\t{operation}\t{len(latencies)}\t"
+                f"{len(latencies) / seconds:.1f}\t"
+                f"{self.documents[operation] / seconds:.1f}\t{p50:.1f}\t{p95:.1f}\t"
+                f"{p99:.1f}\t{self.db_seconds[operation] / len(latencies) * 1000:.2f}\t"
+                f"{self.errors[operation]}",
+                flush=True,
+            )
+
+
+class Client:
+    """Sends the requests of one simulated user over a keep-alive connection"""
+
+    def __init__(
+        self, base_url: str, recorder: Recorder, args, posts: list[str], seed: int
+    ) -> None:
+        self.base_url = base_url
+        self.recorder = recorder
+        self.args = args
+        self.posts = posts
+        self.session = requests.Session()
+        self.rng = random.Random(seed)
+        self.seed = seed
+        self.uploaded = 0
+
+    def request(self, operation: str, method: str, path: str, documents=0, **kwargs):
+        start = time.perf_counter()
+        response = self.session.request(method, self.base_url + path, **kwargs)
+        self.recorder.add(operation, time.perf_counter() - start, response, documents)
+        return response
+
+    def upload(self, posts: list[str]) -> None:
+        body = "".join(json.dumps({"text": post}) + "\n" for post in posts)
+        self.uploaded += 1
+        self.request(
+            "upload",
+            "POST",
+            "/documents",
+            documents=len(posts),
+            files={"file": (f"upload{self.uploaded}.jsonl", body.encode("utf-8"))},
+        )
+
+    def run_mixed(self, stop: threading.Event, weights: dict) -> None:
+        operations, cum_weights = zip(*weights.items())
+        n_docs = self.args.docs
+        while not stop.is_set():
+            operation = self.rng.choices(operations, weights=cum_weights)[0]
+            after_id = self.rng.randint(0, max(0, n_docs - self.args.page))
+            if operation == "documents":
+                path = f"/documents?limit={self.args.page}&after_id={after_id}"
+                self.request(operation, "GET", path, documents=self.args.page)
+            elif operation == "document":
+                path = f"/documents/{self.rng.randint(1, n_docs)}"
+                self.request(operation, "GET", path, documents=1)
+            elif operation == "answers":
+                path = f"/answers?limit={self.args.page}&after_id={after_id}"
+                self.request(operation, "GET", path, documents=self.args.page)
+            elif operation == "tryout":
+                question = f"What is question {self.rng.randrange(10**6)} about?"
+                payload = {"tryout": True, "question": question, "k": self.args.k}
+                self.request(
+                    operation,
+                    "POST",
+                    "/ask_question",
+                    documents=self.args.k,
+                    json=payload,
+                )
+            else:
+                # posts of the corpus again, signed so they are no duplicates
+                posts = self.rng.sample(self.posts, min(self.args.batch, n_docs))
+                sign = f"\n{self.seed}-{self.uploaded}"
+                self.upload([post + sign for post in posts])
+
+
+def run_clients(clients: list[Client], target, seconds: float | None = None) -> float:
+    """Runs target(client, stop) on a thread per client, returns the wall time"""
+    stop = threading.Event()
+    threads = [threading.Thread(target=target, args=(c, stop)) for c in clients]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    if seconds is not None:
+        time.sleep(seconds)
+        stop.set()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def start_app(db_name: str, llm_url: str, args):
+    """Starts the app server in a thread, returns a function that stops it"""
+    # qa.py reads the OpenAI settings from the environment on import, and so do
+    # langchain and openai
+    os.environ["OPENAI_KEY"] = "fake"
+    os.environ["OPENAI_API_BASE"] = llm_url
+    from asgi import create_asgi_app
+
+    config = {"TESTING": True, "DATABASE": db_name, "SERVER_TIMING": True}
+    app = create_asgi_app(config)
+    if args.server == "wsgi":
+        server = make_server(
+            "127.0.0.1",
+            args.port,
+            app.flask_app,
+            threaded=True,
+            request_handler=QuietRequestHandler,
+        )
+        thread = threading.Thread(target=server.serve_forever)
+        stop = server.shutdown
+    else:
+        server = uvicorn.Server(
+            uvicorn.Config(app, port=args.port, log_level="warning", backlog=4096)
+        )
+        thread = threading.Thread(target=server.run)
+
+        def stop():
+            server.should_exit = True
+
+    thread.start()
+    time.sleep(1)
+
+    def shutdown():
+        stop()
+        thread.join()
+
+    return shutdown
+
+
+def parse_mix(value: str) -> dict:
+    weights = {}
+    for item in value.split(","):
+        operation, _, weight = item.partition("=")
+        if operation not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"Unknown operation: {operation}")
+        weights[operation] = float(weight or 1)
+    return weights
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--server", choices=["wsgi", "asgi"], default="wsgi")
+    parser.add_argument("--docs", type=int, default=5_000)
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--upload-workers", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=30)
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default="documents=4,document=4,answers=1,tryout=1",
+    )
+    parser.add_argument("--page", type=int, default=100)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--questions", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--token-latency", type=float, default=0.0)
+    parser.add_argument("--completion-tokens", type=int, default=32)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--port", type=int, default=5050)
+    parser.add_argument("--llm-port", type=int, default=5051)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    posts = [post for chunk in make_posts(args, rng) for post in chunk]
+    # retries after errors of the fake LLM show in the latencies, not in the output
+    logging.getLogger("langchain.chat_models.openai").setLevel(logging.ERROR)
+    llm = FakeOpenAIServer(args.llm_port, args)
+    threading.Thread(target=llm.serve_forever, daemon=True).start()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        shutdown = start_app(
+            os.path.join(tmpdir, "bench.sqlite3"),
+            f"http://127.0.0.1:{args.llm_port}/v1",
+            args,
+        )
+        base_url = f"http://127.0.0.1:{args.port}"
+        print(
+            "phase\toperation\trequests\trequests_s\tdocs_s\tp50_ms\tp95_ms\tp99_ms\tdb_ms\terrors"
+        )
+
+        recorder = Recorder()
+        clients = [
+            Client(base_url, recorder, args, posts, seed=i)
+            for i in range(args.upload_workers)
+        ]
+        batches = iter(range(0, args.docs, args.batch))
+
+        def upload(client: Client, stop: threading.Event) -> None:
+            for start in batches:
+                client.upload(posts[start : start + args.batch])
+
+        recorder.report("upload", run_clients(clients, upload))
+
+        # full mode answers all questions, so it runs before tryout questions exist
+        recorder = Recorder()
+        full = Client(base_url, recorder, args, posts, seed=-1)
+        for i in range(args.questions):
+            payload = {"question": f"What is the topic of post {i}?"}
+            full.request("questions", "POST", "/questions", json=payload)
+        clients = [
+            Client(base_url, recorder, args, posts, seed=1000 + i)
+            for i in range(args.workers)
+        ]
+
+        def mixed(client: Client, stop: threading.Event) -> None:
+            client.run_mixed(stop, args.mix)
+
+        stop = threading.Event()
+        readers = [
+            threading.Thread(target=mixed, args=(client, stop)) for client in clients
+        ]
+        for thread in readers:
+            thread.start()
+        start = time.perf_counter()
+        full.request(
+            "full",
+            "POST",
+            "/ask_question",
+            documents=args.docs * args.questions,
+            json={"tryout": False},
+        )
+        seconds = time.perf_counter() - start
+        stop.set()
+        for thread in readers:
+            thread.join()
+        recorder.report("full", seconds)
+
+        recorder = Recorder()
+        for client in clients:
+            client.recorder = recorder
+        recorder.report("mixed", run_clients(clients, mixed, args.seconds))
+
+        shutdown()
+    llm.shutdown()
+    stats = llm.stats
+    print(
+        f"llm: {stats['requests']} requests, {stats['errors']} errors, "
+        f"{stats['prompt_tokens']} prompt and {stats['completion_tokens']} "
+        "completion tokens"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Payload size and latency of large list responses per content coding
+
+Fills a database with --docs synthetic forum posts, see bench_compression, and
+requests GET /documents, all of them streamed as one JSON array, --repeat times per
+content coding, at its default level and the levels in --level, through the
+Flask test client, i.e. without network. Every request has a distinct dummy query
+parameter, so none is served from the response cache. Reports the payload size and
+the median and p99 time until the last byte was received.
+
+Usage (from backend/):
+    python -m benchmarks.bench_responses --docs 100000 --repeat 50 --level 1 3
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+from api import create_app
+from benchmarks.bench_compression import make_posts
+from config import RESPONSE_COMPRESSION_LEVELS
+from contentencoding import ENCODINGS
+from db import TextDB
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--level", type=int, nargs="*", default=[])
+    parser.add_argument("--path", default="/documents")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_name = os.path.join(tmpdir, "bench.sqlite3")
+        db = TextDB(db_name)
+        for posts in make_posts(args, rng):
+            db.insert_documents(posts)
+        client = create_app({"TESTING": True, "DATABASE": db_name}).test_client()
+
+        runs = [("identity", None)] + [
+            (encoding, level)
+            for encoding in ENCODINGS
+            for level in [RESPONSE_COMPRESSION_LEVELS[encoding], *args.level]
+        ]
+        print("encoding\tlevel\tpayload_mib\tp50_ms\tp99_ms")
+        n_requests = 0
+        for encoding, level in runs:
+            if level is not None:
+                RESPONSE_COMPRESSION_LEVELS[encoding] = level
+            times, size = [], 0
+            for _ in range(args.repeat):
+                n_requests += 1
+                start = time.perf_counter()
+                response = client.get(
+                    f"{args.path}?_={n_requests}", headers={"Accept-Encoding": encoding}
+                )
+                size = len(response.get_data())
+                times.append(time.perf_counter() - start)
+            p50, p99 = np.percentile(times, [50, 99]) * 1000
+            print(f"{encoding}\t{level}\t{size / 2**20:.1f}\t{p50:.0f}\t{p99:.0f}")
+        db.close_connection()
+
+
+if __name__ == "__main__":
+    main()
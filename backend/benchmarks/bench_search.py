@@ -0,0 +1,70 @@
+"""Latency of full-text search over a synthetic corpus
+
+Fills a database with --docs documents of --words words drawn from a Zipf
+distribution over a vocabulary of --vocabulary words, then runs TextDB.search for
+rare, medium and frequent single terms and for two-term queries and reports the
+latency percentiles per query kind.
+
+Usage (from backend/):
+    python -m benchmarks.bench_search --docs 1000000
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+from db import TextDB
+
+
+def make_docs(args, rng: np.random.Generator):
+    """Yields documents in chunks of random words, word i has frequency ~ 1 / (i + 1)"""
+    weights = 1 / np.arange(1, args.vocabulary + 1)
+    weights /= weights.sum()
+    for start in range(0, args.docs, 10_000):
+        n = min(10_000, args.docs - start)
+        words = rng.choice(args.vocabulary, size=(n, args.words), p=weights)
+        yield [" ".join(f"w{word}" for word in row) for row in words]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=1_000_000)
+    parser.add_argument("--words", type=int, default=50)
+    parser.add_argument("--vocabulary", type=int, default=50_000)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    queries = {
+        "frequent": lambda: f"w{rng.integers(0, 10)}",
+        "medium": lambda: f"w{rng.integers(100, 1_000)}",
+        "rare": lambda: f"w{rng.integers(10_000, args.vocabulary)}",
+        "two terms": lambda: f"w{rng.integers(10, 100)} w{rng.integers(100, 1_000)}",
+        "prefix": lambda: f"w{rng.integers(100, 1_000)}*",
+    }
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = TextDB(os.path.join(tmpdir, "bench.sqlite3"))
+        start = time.perf_counter()
+        for docs in make_docs(args, rng):
+            db.insert_documents(docs)
+        print(f"inserted {args.docs} documents in {time.perf_counter() - start:.1f} s")
+
+        print("query\thits\tp50_ms\tp99_ms\tmax_ms")
+        for name, make_query in queries.items():
+            latencies, hits = [], 0
+            for _ in range(args.queries):
+                query = make_query()
+                start = time.perf_counter()
+                hits += len(db.search(query, limit=args.limit))
+                latencies.append((time.perf_counter() - start) * 1000)
+            print(
+                f"{name}\t{hits / args.queries:.1f}\t{np.percentile(latencies, 50):.2f}\t"
+                f"{np.percentile(latencies, 99):.2f}\t{max(latencies):.1f}"
+            )
+        db.close_connection()
+
+
+if __name__ == "__main__":
+    main()
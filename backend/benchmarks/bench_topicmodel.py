@@ -0,0 +1,218 @@
+"""Topic model pipeline on synthetic corpora, compared against a stored baseline
+
+Runs `embed_docs`, `optimize_umap_hdbscan` and `_compute_2d_embeddings` of
+`TopicModel` on corpora of clustered Gaussians from benchmarks/synthetic.py. The
+embeddings are precomputed, `embed_docs` gets them from `PrecomputedEncoder`, so
+the suite runs offline and measures the pipeline, not the embedding model. Every
+size runs in a fresh process, so the peak RSS is that of the size alone.
+
+Reported per size: the wall time of every stage, the mean wall time per trial and
+of its UMAP fit, UMAP transform and HDBSCAN fit (from the spans of tracing.py),
+the peak RSS, the number of topics found and the adjusted rand index (ARI) of the
+labels against the true clusters. Corpora larger than --landmarks are fit in
+landmark mode.
+
+With --save-baseline the results are written to --baseline, otherwise they are
+compared with it if it exists: a size regresses if a time or the peak RSS grew by
+more than --tolerance or the ARI dropped by more than --ari-tolerance, and the
+exit status is 1.
+
+Usage (from backend/):
+    python -m benchmarks.bench_topicmodel --sizes 10000 100000 1000000
+    python -m benchmarks.bench_topicmodel --sizes 10000 --save-baseline
+"""
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+import numpy as np
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baselines", "bench_topicmodel.json")
+# results compared with the baseline: (better, slack), times and the RSS regress if
+# they grow by more than --tolerance and the slack, the ARI if it drops
+METRICS = {
+    "embed_s": ("lower", 0.1),
+    "optimize_s": ("lower", 0.1),
+    "layout_s": ("lower", 0.1),
+    "trial_s": ("lower", 0.1),
+    "peak_rss_mb": ("lower", 16),
+    "ari": ("higher", 0.0),
+}
+
+
+class PrecomputedEncoder:
+    """Stands in for the SentenceTransformer, looks up precomputed embeddings
+
+    Documents are the row numbers of the embeddings as strings, see `run_size`.
+    """
+
+    def __init__(self, embeddings: np.ndarray) -> None:
+        self.embeddings = embeddings
+
+    def encode(self, docs: list[str]) -> np.ndarray:
+        return np.asarray(self.embeddings[[int(doc) for doc in docs]])
+
+
+def warm_up() -> None:
+    """Fits UMAP and HDBSCAN on a few points, so numba compiles them before timing"""
+    from hdbscan import HDBSCAN
+    from umap import UMAP
+
+    X = np.random.default_rng(0).normal(size=(300, 8)).astype(np.float32)
+    reduced = UMAP(n_components=2, metric="cosine", random_state=1).fit_transform(X)
+    HDBSCAN(min_cluster_size=5).fit(reduced)
+
+
+def run_size(n_docs: int, args: argparse.Namespace) -> dict:
+    """Runs the pipeline on one corpus size, in a process of its own"""
+    import optuna
+    from sklearn.metrics import adjusted_rand_score
+    from benchmarks.synthetic import load_clustered_embeddings
+    from topicmodel import TopicModel
+    import tracing
+
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+    warm_up()
+    embeddings, truth = load_clustered_embeddings(
+        n_docs, dims=args.dims, n_clusters=args.clusters
+    )
+    trial_seconds = []
+
+    class TimedTopicModel(TopicModel):
+        def _objective(self, trial, X):
+            start = time.perf_counter()
+            try:
+                return super()._objective(trial, X)
+            finally:
+                trial_seconds.append(time.perf_counter() - start)
+
+    tm = TimedTopicModel(
+        min_cluster=args.min_cluster,
+        max_cluster=args.max_cluster,
+        embedding_model=PrecomputedEncoder(embeddings),
+        max_evals=args.max_evals,
+        storage=None,
+        landmarks=args.landmarks if 0 < args.landmarks < n_docs else None,
+    )
+    tracing.REGISTRY.clear()
+
+    start = time.perf_counter()
+    tm.embed_docs([str(i) for i in range(n_docs)])
+    embed_s = time.perf_counter() - start
+    start = time.perf_counter()
+    tm.optimize_umap_hdbscan()
+    optimize_s = time.perf_counter() - start
+    start = time.perf_counter()
+    tm._compute_2d_embeddings()
+    layout_s = time.perf_counter() - start
+
+    labels = tm.get_labels()
+    stages = {}
+    for (metric, labels_), (counts, total) in tracing.REGISTRY.snapshot().items():
+        name = dict(labels_).get("span", "")
+        if name.startswith("topicmodel."):
+            stages[name.split(".", 1)[1] + "_s"] = total / sum(counts)
+    return {
+        "n_docs": n_docs,
+        "landmarks": tm.landmarks,
+        "embed_s": embed_s,
+        "optimize_s": optimize_s,
+        "layout_s": layout_s,
+        "trials": len(trial_seconds),
+        "trial_s": float(np.mean(trial_seconds)),
+        **stages,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "topics": int(len(np.unique(labels[labels >= 0]))),
+        "ari": float(adjusted_rand_score(truth, labels)),
+    }
+
+
+def compare(results: dict, baseline: dict, args: argparse.Namespace) -> list[str]:
+    """Returns the regressions of the results against the baseline"""
+    regressions = []
+    for size, result in results.items():
+        previous = baseline.get(size)
+        if previous is None:
+            continue
+        for metric, (better, slack) in METRICS.items():
+            if metric not in previous:
+                continue
+            old, new = previous[metric], result[metric]
+            if better == "lower" and new > old * (1 + args.tolerance) + slack:
+                regressions.append(f"{size}: {metric} {old:.3g} -> {new:.3g}")
+            if better == "higher" and new < old - args.ari_tolerance:
+                regressions.append(f"{size}: {metric} {old:.3f} -> {new:.3f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--dims", type=int, default=384)
+    parser.add_argument("--clusters", type=int, default=20)
+    parser.add_argument("--landmarks", type=int, default=50_000)
+    parser.add_argument("--max-evals", type=int, default=5)
+    parser.add_argument("--min-cluster", type=int, default=5)
+    parser.add_argument("--max-cluster", type=int, default=40)
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--ari-tolerance", type=float, default=0.05)
+    args = parser.parse_args()
+
+    results = {}
+    print(
+        "n_docs\tlandmarks\tembed_s\toptimize_s\tlayout_s\ttrial_s\tumap_fit_s\t"
+        "umap_transform_s\thdbscan_fit_s\tpeak_rss_mb\ttopics\tari"
+    )
+    for n_docs in args.sizes:
+        spawn = multiprocessing.get_context("spawn")
+        with concurrent.futures.ProcessPoolExecutor(1, mp_context=spawn) as pool:
+            result = pool.submit(run_size, n_docs, args).result()
+        results[str(n_docs)] = result
+        print(
+            f"{n_docs}\t{result['landmarks']}\t{result['embed_s']:.2f}\t"
+            f"{result['optimize_s']:.1f}\t{result['layout_s']:.1f}\t"
+            f"{result['trial_s']:.1f}\t{result.get('umap_fit_s', 0):.1f}\t"
+            f"{result.get('umap_transform_s', 0):.1f}\t"
+            f"{result.get('hdbscan_fit_s', 0):.1f}\t{result['peak_rss_mb']:.0f}\t"
+            f"{result['topics']}\t{result['ari']:.3f}",
+            flush=True,
+        )
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline["machine"] = {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+        }
+        baseline["results"] = {**baseline.get("results", {}), **results}
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline["results"], args)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Latency and recall of the vector index
+
+Builds a VectorIndex over a synthetic clustered corpus and reports the build time
+and, per n_probe, the single-query latency percentiles and the recall@k against
+exact search. Queries are perturbed corpus vectors.
+
+Usage (from backend/):
+    python -m benchmarks.bench_vector_search --docs 1000000 --n-probe 8 16 32
+"""
+import argparse
+import time
+import numpy as np
+from benchmarks.synthetic import load_clustered_embeddings
+from vectorindex import VectorIndex, normalize
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=1_000_000)
+    parser.add_argument("--dims", type=int, default=384)
+    parser.add_argument("--clusters", type=int, default=2_000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--n-probe", type=int, nargs="+", default=[8, 16, 32])
+    args = parser.parse_args()
+
+    embeddings, _ = load_clustered_embeddings(args.docs, args.dims, args.clusters)
+    rng = np.random.default_rng(0)
+    queries = embeddings[rng.choice(args.docs, args.queries, replace=False)]
+    queries = normalize(queries + rng.normal(scale=0.02, size=queries.shape))
+
+    start = time.perf_counter()
+    # copied into memory, the index normalizes in place
+    index = VectorIndex(np.arange(args.docs), np.array(embeddings), exact_max=0)
+    print(
+        f"built IVF index with {len(index.centroids)} lists in {time.perf_counter() - start:.1f} s"
+    )
+
+    # exact neighbours, scored in blocks against all vectors at once
+    truth = np.concatenate(
+        [
+            np.argpartition(-(index.vectors @ block.T), args.k, axis=0)[: args.k].T
+            for block in np.array_split(queries, max(1, args.queries // 10))
+        ]
+    )
+    truth = [set(index.ids[row]) for row in truth]
+
+    print("n_probe\tp50_ms\tp99_ms\trecall")
+    for n_probe in args.n_probe:
+        index.n_probe = n_probe
+        latencies, recall = [], []
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            ids, _ = index.search(query, k=args.k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            recall.append(len(expected & set(ids[0])) / args.k)
+        print(
+            f"{n_probe}\t{np.percentile(latencies, 50):.2f}\t"
+            f"{np.percentile(latencies, 99):.2f}\t{np.mean(recall):.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import os
+import numpy as np
+
+CACHE_DIR = os.path.join(os.path.dirname(__file__), "data")
+
+
+def make_clustered_embeddings(
+    n_docs: int,
+    dims: int = 384,
+    n_clusters: int = 20,
+    noise: float = 0.1,
+    seed: int = 42423,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Generates a synthetic embedding corpus of clustered Gaussians
+
+    Cluster centers are drawn on the unit sphere, like the normalized sentence
+    embeddings the topic model is usually fit on. A fraction `noise` of the
+    documents is drawn uniformly and labelled -1.
+
+    Args:
+        n_docs (int): number of documents
+        dims (int): embedding dimensions
+        n_clusters (int): number of clusters
+        noise (float): fraction of documents not belonging to any cluster
+        seed (int): random seed
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: float32 embeddings and the true cluster labels
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_clusters, dims))
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+
+    labels = rng.integers(0, n_clusters, size=n_docs)
+    labels[rng.random(n_docs) < noise] = -1
+
+    embeddings = np.empty((n_docs, dims), dtype=np.float32)
+    # generate in chunks to keep the float64 temporaries small
+    for start in range(0, n_docs, 100_000):
+        chunk = labels[start : start + 100_000]
+        points = rng.normal(scale=0.25 / np.sqrt(dims), size=(len(chunk), dims))
+        is_noise = chunk == -1
+        points[~is_noise] += centers[chunk[~is_noise]]
+        points[is_noise] = rng.normal(size=(is_noise.sum(), dims))
+        points /= np.linalg.norm(points, axis=1, keepdims=True)
+        embeddings[start : start + len(chunk)] = points
+
+    return embeddings, labels
+
+
+def load_clustered_embeddings(
+    n_docs: int, dims: int = 384, n_clusters: int = 20, seed: int = 42423
+) -> tuple[np.ndarray, np.ndarray]:
+    """Loads a synthetic corpus from `CACHE_DIR`, generating it on first use
+
+    Embeddings are memory-mapped, so corpora larger than memory can be used.
+
+    Args:
+        n_docs (int): number of documents
+        dims (int): embedding dimensions
+        n_clusters (int): number of clusters
+        seed (int): random seed
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: float32 embeddings and the true cluster labels
+    """
+    name = f"clustered_{n_docs}x{dims}_{n_clusters}_{seed}"
+    embeddings_path = os.path.join(CACHE_DIR, f"{name}.npy")
+    labels_path = os.path.join(CACHE_DIR, f"{name}_labels.npy")
+
+    if not os.path.exists(embeddings_path):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        embeddings, labels = make_clustered_embeddings(
+            n_docs, dims=dims, n_clusters=n_clusters, seed=seed
+        )
+        np.save(embeddings_path, embeddings)
+        np.save(labels_path, labels)
+
+    return np.load(embeddings_path, mmap_mode="r"), np.load(labels_path)
@@ -0,0 +1,66 @@
+"""Compresses the texts of an existing database, see TextDB.compress_texts
+
+Migrates the database to the current schema, trains a zstd dictionary per scope on a
+sample of its texts and rewrites the texts with it, batch by batch. The backend can
+keep running meanwhile, it decompresses texts on read and compresses new texts once
+it is restarted. With --decompress the texts are stored uncompressed again. Freed
+pages are only reused by later inserts, --vacuum also returns them to the file
+system, which needs exclusive access to the database for a while.
+
+Usage (from backend/):
+    python compress_db.py instance/demo.sqlite --scope documents answers --vacuum
+"""
+import argparse
+import os
+import time
+from config import TEXT_COMPRESSION_DICT_SIZE, TEXT_COMPRESSION_SAMPLES
+from db import TEXT_SCOPES, TextDB
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("database")
+    parser.add_argument(
+        "--scope", nargs="+", choices=list(TEXT_SCOPES), default=list(TEXT_SCOPES)
+    )
+    parser.add_argument("--dict-size", type=int, default=TEXT_COMPRESSION_DICT_SIZE)
+    parser.add_argument("--samples", type=int, default=TEXT_COMPRESSION_SAMPLES)
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument("--decompress", action="store_true")
+    parser.add_argument("--vacuum", action="store_true")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        parser.error(f"{args.database} does not exist")
+    db = TextDB(args.database)
+    for scope in args.scope:
+        start = time.perf_counter()
+        if args.decompress:
+            result = db.decompress_texts(scope, batch_size=args.batch_size)
+        else:
+            result = db.compress_texts(
+                scope,
+                dict_size=args.dict_size,
+                n_samples=args.samples,
+                batch_size=args.batch_size,
+            )
+        before, after = result["before"], result["after"]
+        print(
+            f"{scope}: {after['n_compressed']} of {after['n_texts']} texts compressed, "
+            f"{before['stored_bytes'] / 2**20:.1f} MiB -> "
+            f"{after['stored_bytes'] / 2**20:.1f} MiB "
+            f"in {time.perf_counter() - start:.1f} s"
+        )
+
+    if args.vacuum:
+        size = os.path.getsize(args.database)
+        db.conn.execute("VACUUM")
+        print(
+            f"vacuum: {size / 2**20:.1f} MiB -> "
+            f"{os.path.getsize(args.database) / 2**20:.1f} MiB"
+        )
+    db.close_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,10 @@ EMBEDDING_MODEL = "all-MiniLM-L6-v2"
 # model_name: either "gpt-4" or "gpt-3.5-turbo"
 OPENAI_PARAMS = {"model_name": "gpt-3.5-turbo", "temperature": 0, "max_tokens": 256}
 
+# Maximum number of LLM requests in flight at once per process with the async
+# methods of QAProcessor
+LLM_MAX_CONCURRENCY = 256
+
 # Token the LLM shall return if given context does not contain answer to the question,
 # used in non_answer_handling.py and PROMPTS
 NON_ANSWER_TOKEN = "<NOT FOUND>"
@@ -23,3 +27,137 @@ PROMPTS = {
     "SYSTEM": f"You are a highly intelligent question answering bot. You take Question and Context as input and return the answer from the Paragraph. Retain as much information as needed to answer the question at a later time. The answer must only address the question. Use a descriptive and objective tone. If Context lacks the answer you must only return '{NON_ANSWER_TOKEN}', nothing else.",
     "HUMAN": "Question: \n```{question}```\n\nContext: \n```{context}```",
 }
+
+# Optuna storage for the UMAP/HDBSCAN search of the topic pipeline, see pipeline.py,
+# studies are resumed after a crash. Set to None to keep studies in memory. TopicModel
+# keeps studies in memory unless it is given a storage
+OPTUNA_STORAGE = "sqlite:///instance/optuna.sqlite3"
+
+# New studies are seeded with the best parameters of up to OPTUNA_WARM_START_TRIALS
+# previous studies whose corpus size differs at most by a factor of OPTUNA_WARM_START_SIZE_RATIO
+OPTUNA_WARM_START_TRIALS = 3
+OPTUNA_WARM_START_SIZE_RATIO = 2.0
+
+# The search stops early once the cost has not improved for OPTUNA_EARLY_STOPPING_TRIALS
+# completed trials, None runs all trials
+OPTUNA_EARLY_STOPPING_TRIALS = None
+
+# Memory budget of the topic model for batched processing, e.g. assigning documents
+# to the topics found on the landmarks, in MB
+TOPICMODEL_MAX_MEMORY_MB = 1024
+
+# Memory budget of the whole topic model in MB, None for no budget. With a budget the
+# documents and embeddings are spilled to files in a temporary directory under
+# TOPICMODEL_SPILL_DIR (the system default if None) and memory-mapped, the models of
+# trials that are not the best are freed right away and batch sizes are reduced to
+# the memory left under the budget
+TOPICMODEL_MEMORY_BUDGET_MB = None
+TOPICMODEL_SPILL_DIR = None
+
+# Incremental topic pipeline, see pipeline.py. The model fitted on the answers to a
+# question is stored in PIPELINE_MODEL_DIR and answers that are new or changed since the
+# last run are embedded and assigned to its topics, PIPELINE_BATCH_SIZE at a time. The
+# model is refit once the share of assigned answers that fit it poorly, with a low
+# probability or far from all topics, exceeds the share at the fit by
+# PIPELINE_DRIFT_TOLERANCE, over at least PIPELINE_MIN_DRIFT_ANSWERS answers, or once
+# PIPELINE_REFIT_GROWTH times as many answers were assigned as fitted
+PIPELINE_MODEL_DIR = "instance/pipeline"
+PIPELINE_BATCH_SIZE = 1000
+PIPELINE_DRIFT_TOLERANCE = 0.1
+PIPELINE_MIN_DRIFT_ANSWERS = 20
+PIPELINE_REFIT_GROWTH = 1.0
+
+# Level-of-detail grid of the topic map: number of levels below the root cell
+# and maximum number of points returned per grid cell and zoom level
+POINT_GRID_LEVELS = 8
+POINTS_PER_CELL = 64
+
+# Pragmas applied to every SQLite connection. WAL lets readers proceed while a write
+# transaction is open, cache_size is in KiB if negative, mmap_size in bytes
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -65536,
+    "mmap_size": 268435456,
+    "busy_timeout": 5000,
+}
+
+# Maximum number of idle SQLite connections kept for reuse by request threads
+SQLITE_POOL_SIZE = 8
+
+# Buffered answers are written in one transaction once ANSWER_WRITER_MAX_ROWS are
+# collected or the oldest one has waited ANSWER_WRITER_MAX_DELAY seconds
+ANSWER_WRITER_MAX_ROWS = 500
+ANSWER_WRITER_MAX_DELAY = 1.0
+
+# Number of rows read, validated and inserted per transaction when ingesting uploaded
+# CSV, JSONL or Parquet files, bounds the memory use of an upload
+INGEST_BATCH_SIZE = 10_000
+
+# Number of rows fetched per query while streaming a list endpoint without a limit,
+# e.g. GET /documents, and the maximum limit of a page, bounds the memory use per
+# request
+LIST_PAGE_SIZE = 5_000
+
+# Full-text search ranks at most the SEARCH_MAX_RANKED most recently inserted matches
+# of a query by BM25, which bounds the latency of queries for very frequent terms.
+# Set to None to always rank all matches
+SEARCH_MAX_RANKED = 5_000
+
+# Vector search: up to VECTOR_INDEX_EXACT_MAX embeddings are searched exactly, larger
+# collections use an IVF index that scores the VECTOR_INDEX_N_PROBE closest lists only
+VECTOR_INDEX_EXACT_MAX = 50_000
+VECTOR_INDEX_N_PROBE = 16
+
+# Optional zstd compression of document and answer texts, enabled per database with
+# compress_db.py. Dictionaries of at most TEXT_COMPRESSION_DICT_SIZE bytes are trained
+# on TEXT_COMPRESSION_SAMPLES random texts, texts shorter than
+# TEXT_COMPRESSION_MIN_BYTES in UTF-8 are stored uncompressed
+TEXT_COMPRESSION_LEVEL = 3
+TEXT_COMPRESSION_DICT_SIZE = 112_640
+TEXT_COMPRESSION_SAMPLES = 20_000
+TEXT_COMPRESSION_MIN_BYTES = 32
+
+# Bodies of cached GET responses, see responsecache.py, take up to
+# RESPONSE_CACHE_MAX_BYTES in total. Larger responses than
+# RESPONSE_CACHE_MAX_ENTRY_BYTES are rendered on every request
+RESPONSE_CACHE_MAX_BYTES = 256 * 2**20
+RESPONSE_CACHE_MAX_ENTRY_BYTES = 64 * 2**20
+
+# Responses of at least RESPONSE_COMPRESSION_MIN_BYTES, and all streamed responses,
+# are compressed with the content coding the client prefers, see contentencoding.py.
+# zstd and br are only offered if the zstandard and brotli packages are installed
+RESPONSE_COMPRESSION_MIN_BYTES = 1024
+RESPONSE_COMPRESSION_LEVELS = {"zstd": 1, "br": 1, "gzip": 1}
+
+# Async serving with asgi.py: the Flask routes run on ASGI_WSGI_WORKERS threads and
+# database calls of async routes on SQLITE_POOL_SIZE threads, while requests waiting
+# on the LLM hold no thread
+ASGI_WSGI_WORKERS = 16
+
+# Tracing, see tracing.py: durations of spans and requests are counted in histograms
+# with these bucket upper bounds in seconds and exposed at GET /metrics. With
+# SERVER_TIMING every response carries a Server-Timing header with the time spent per
+# span category, e.g. db or llm. The sampling profiler, started with POST /profiler,
+# records up to PROFILER_MAX_DEPTH frames of every thread every PROFILER_INTERVAL
+# seconds
+TRACING_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    300,
+)
+SERVER_TIMING = False
+PROFILER_INTERVAL = 0.01
+PROFILER_MAX_DEPTH = 64
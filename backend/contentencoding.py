@@ -0,0 +1,118 @@
+import zlib
+from config import RESPONSE_COMPRESSION_LEVELS
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Content codings the server can produce, most preferred first. zstd and br need the
+# optional zstandard and brotli packages, gzip is always available
+ENCODINGS = [
+    encoding
+    for encoding, available in [
+        ("zstd", zstandard is not None),
+        ("br", brotli is not None),
+        ("gzip", True),
+    ]
+    if available
+]
+
+
+def negotiate(accept_encodings) -> str | None:
+    """Returns the content coding to respond with, None for an uncompressed response
+
+    Args:
+        accept_encodings: the Accept-Encoding header of the request as parsed by
+            werkzeug, `request.accept_encodings`
+
+    Returns:
+        str | None: the coding with the highest quality for the client, ties are
+        broken by the order of ENCODINGS
+    """
+    return accept_encodings.best_match(ENCODINGS)
+
+
+class _Compressor:
+    """Incremental compressor of a content coding with a common interface"""
+
+    def __init__(self, encoding: str, level: int | None = None) -> None:
+        """Initializes the compressor
+
+        Args:
+            encoding (str): a content coding in ENCODINGS
+            level (int | None): compression level, RESPONSE_COMPRESSION_LEVELS if None
+
+        Returns:
+            None
+        """
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unsupported content coding: {encoding}")
+        if level is None:
+            level = RESPONSE_COMPRESSION_LEVELS[encoding]
+        self.encoding = encoding
+        if encoding == "gzip":
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        elif encoding == "zstd":
+            self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        else:
+            self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data: bytes) -> bytes:
+        """Compresses data, output may be held back until `flush` or `finish`"""
+        if self.encoding == "br":
+            return self._compressor.process(data)
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        """Returns all output so far, so the client can decode everything sent"""
+        if self.encoding == "gzip":
+            return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        if self.encoding == "zstd":
+            return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        return self._compressor.flush()
+
+    def finish(self) -> bytes:
+        """Returns the remaining output and ends the stream"""
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+def compress(body: bytes, encoding: str, level: int | None = None) -> bytes:
+    """Compresses a response body with a content coding in ENCODINGS"""
+    compressor = _Compressor(encoding, level)
+    return compressor.compress(body) + compressor.finish()
+
+
+def compress_chunks(chunks, encoding: str, level: int | None = None):
+    """Compresses a streamed response body chunk by chunk
+
+    Every chunk is flushed, so the client receives data as soon as it is produced.
+    Closing the generator closes `chunks`.
+
+    Args:
+        chunks: iterable of str (encoded as UTF-8) or bytes
+        encoding (str): a content coding in ENCODINGS
+        level (int | None): compression level, RESPONSE_COMPRESSION_LEVELS if None
+
+    Yields:
+        bytes: the compressed chunks
+    """
+    compressor = _Compressor(encoding, level)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            data = compressor.compress(chunk) + compressor.flush()
+            if data:
+                yield data
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+    yield compressor.finish()
@@ -0,0 +1,132 @@
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer
+
+
+class ClassTfidf:
+    """Sparse class-based TF-IDF (c-TF-IDF) for topic representations
+
+    All documents of a topic are treated as one document, the weight of term t in
+    topic c is
+
+        W(t, c) = tf(t, c) * log(1 + A / f(t))
+
+    with tf(t, c) the L1-normalized frequency of t in c, f(t) the frequency of t
+    over all topics and A the average number of words per topic, as in BERTopic.
+    Term counts are kept per topic in a sparse matrix that grows with the
+    vocabulary, so documents can be added without refitting and no dense
+    document-term or topic-term matrix is ever built.
+    """
+
+    def __init__(self, top_n: int = 10, stop_words: str | None = "english") -> None:
+        """Initializes the ClassTfidf class
+
+        Args:
+            top_n (int): number of keywords per topic
+            stop_words (str | None): stop words passed to the sklearn CountVectorizer
+
+        Returns:
+            None
+        """
+        assert top_n > 0, "top_n must be greater than 0"
+        self.top_n = top_n
+        self.stop_words = stop_words
+        self.vocabulary = {}
+        self.topics = {}
+        self.counts = sparse.csr_matrix((0, 0), dtype=np.int64)
+
+    def fit(self, docs: list[str], labels: np.ndarray) -> "ClassTfidf":
+        """Computes the term counts per topic from scratch
+
+        Args:
+            docs (list[str]): documents
+            labels (np.ndarray): topic label of each document
+
+        Returns:
+            ClassTfidf: the fitted instance
+        """
+        self.vocabulary = {}
+        self.topics = {}
+        self.counts = sparse.csr_matrix((0, 0), dtype=np.int64)
+        return self.partial_fit(docs, labels)
+
+    def partial_fit(self, docs: list[str], labels: np.ndarray) -> "ClassTfidf":
+        """Adds documents to the term counts per topic
+
+        Args:
+            docs (list[str]): new documents
+            labels (np.ndarray): topic label of each new document
+
+        Returns:
+            ClassTfidf: the updated instance
+        """
+        assert len(docs) == len(labels), "docs and labels must have the same length"
+        if len(docs) == 0:
+            return self
+
+        vectorizer = CountVectorizer(stop_words=self.stop_words)
+        try:
+            doc_terms = vectorizer.fit_transform(docs)
+        except ValueError:
+            # only stop words or empty documents
+            return self
+
+        term_ids = np.array(
+            [
+                self.vocabulary.setdefault(term, len(self.vocabulary))
+                for term in vectorizer.get_feature_names_out()
+            ]
+        )
+        topic_ids = np.array(
+            [self.topics.setdefault(int(label), len(self.topics)) for label in labels]
+        )
+
+        shape = (len(self.topics), len(self.vocabulary))
+        membership = sparse.csr_matrix(
+            (np.ones(len(docs), dtype=np.int64), (topic_ids, np.arange(len(docs)))),
+            shape=(shape[0], len(docs)),
+        )
+        batch_counts = (membership @ doc_terms).tocoo()
+        batch_counts = sparse.csr_matrix(
+            (batch_counts.data, (batch_counts.row, term_ids[batch_counts.col])),
+            shape=shape,
+        )
+
+        self.counts.resize(shape)
+        self.counts = self.counts + batch_counts
+        return self
+
+    def transform(self) -> sparse.csr_matrix:
+        """Computes the c-TF-IDF weights
+
+        Returns:
+            sparse.csr_matrix: weights of shape (number of topics, vocabulary size),
+                rows are ordered like `topics`
+        """
+        counts = self.counts.astype(np.float64)
+        words_per_topic = np.asarray(counts.sum(axis=1)).ravel()
+        term_frequency = np.asarray(counts.sum(axis=0)).ravel()
+
+        average_words = words_per_topic.mean() if len(words_per_topic) else 0.0
+        idf = np.log(1 + average_words / np.maximum(term_frequency, 1))
+        tf = sparse.diags(1 / np.maximum(words_per_topic, 1)) @ counts
+        return (tf @ sparse.diags(idf)).tocsr()
+
+    def get_topic_words(self) -> dict[int, list[tuple[str, float]]]:
+        """Returns the `top_n` keywords of each topic
+
+        Returns:
+            dict[int, list[tuple[str, float]]]: keywords and their weights per topic label
+        """
+        weights = self.transform()
+        terms = np.empty(len(self.vocabulary), dtype=object)
+        for term, term_id in self.vocabulary.items():
+            terms[term_id] = term
+
+        topic_words = {}
+        for label, row in self.topics.items():
+            start, end = weights.indptr[row], weights.indptr[row + 1]
+            data, indices = weights.data[start:end], weights.indices[start:end]
+            top = np.argsort(-data, kind="stable")[: self.top_n]
+            topic_words[label] = [(terms[indices[i]], float(data[i])) for i in top]
+        return topic_words
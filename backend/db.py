@@ -1,35 +1,925 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import hashlib
+import json
+import logging
+import math
+import queue
+import random
 import sqlite3
-
-
+import threading
+import time
+import weakref
+from config import (
+    ANSWER_WRITER_MAX_DELAY,
+    ANSWER_WRITER_MAX_ROWS,
+    NON_ANSWER_TOKEN,
+    SQLITE_PRAGMAS,
+    SEARCH_MAX_RANKED,
+    SQLITE_POOL_SIZE,
+    TEXT_COMPRESSION_DICT_SIZE,
+    TEXT_COMPRESSION_SAMPLES,
+)
+from textcodec import TextCodec, UnknownDictionaryError, train_dictionary
+from tracing import trace_methods
+
+logger = logging.getLogger(__name__)
+
+
+def _non_answer_sql(answer: str, compressed: bool = False) -> str:
+    """SQL expression that is 1 if an answer contains the NON_ANSWER_TOKEN, else 0
+
+    The token is copied into the triggers of migration 5, changing it later does not
+    change how stored answers are counted. With `compressed` the answer may be
+    compressed, see `_text_sql`.
+    """
+    token = NON_ANSWER_TOKEN.lower().replace("'", "''")
+    if compressed:
+        answer = _text_sql(answer)
+    return f"(instr(lower({answer}), '{token}') > 0)"
+
+
+def _text_sql(column: str) -> str:
+    """SQL expression reading a text column that may hold compressed texts
+
+    Only compressed texts, stored as BLOBs, are passed to decompress_text, calling the
+    Python function for every text would slow down reads of uncompressed texts.
+    decompress_text is only registered on the connections of `TextDB`, so views and
+    triggers only use it once a scope is compressed, see `_text_schema`.
+    """
+    return f"iif(typeof({column}) = 'blob', decompress_text({column}), {column})"
+
+
+def _topic_stats_add(topic: str) -> str:
+    """Trigger statement counting a document of a topic in TopicStats"""
+    return f"""
+    INSERT INTO TopicStats (topic_id, n_documents) VALUES ({topic}, 1)
+    ON CONFLICT (topic_id) DO UPDATE SET n_documents = n_documents + 1;
+    """
+
+
+def _topic_stats_remove(topic: str) -> str:
+    """Trigger statements removing a document of a topic from TopicStats"""
+    return f"""
+    UPDATE TopicStats SET n_documents = n_documents - 1 WHERE topic_id = {topic};
+    DELETE FROM TopicStats WHERE topic_id = {topic} AND n_documents = 0;
+    """
+
+
+def _exemplar_sql(exclude_doc_id: str, compressed: bool = False) -> str:
+    """Subquery of TopicQuestionStats finding a new exemplar for its topic and question
+
+    The exemplar is any document of the topic whose answer to the question is not a
+    non-answer, other than `exclude_doc_id`. With `compressed` the answers may be
+    compressed.
+    """
+    return f"""
+      SELECT d.id FROM Documents d
+      WHERE d.topic_id IS NULLIF(TopicQuestionStats.topic_id, -1)
+        AND d.id != {exclude_doc_id}
+        AND EXISTS (
+          SELECT 1 FROM Answers a
+          WHERE a.doc_id = d.id AND a.question_id = TopicQuestionStats.question_id
+            AND NOT {_non_answer_sql("a.answer", compressed)}
+        )
+      LIMIT 1
+    """
+
+
+def _question_stats_add(where: str, compressed: bool = False) -> str:
+    """Trigger statement counting the answers matching `where` in TopicQuestionStats
+
+    Args:
+      where: condition on the answers `a` joined with their documents `d`
+      compressed: whether the answers may be compressed
+    """
+    non_answer = _non_answer_sql("a.answer", compressed)
+    return f"""
+    INSERT INTO TopicQuestionStats (
+      topic_id, question_id, n_answers, n_non_answers, exemplar_doc_id
+    )
+    SELECT COALESCE(d.topic_id, -1), a.question_id, 1, {non_answer},
+      CASE WHEN {non_answer} THEN NULL ELSE a.doc_id END
+    FROM Answers a JOIN Documents d ON d.id = a.doc_id
+    WHERE {where}
+    ON CONFLICT (topic_id, question_id) DO UPDATE SET
+      n_answers = n_answers + 1,
+      n_non_answers = n_non_answers + excluded.n_non_answers,
+      exemplar_doc_id = COALESCE(exemplar_doc_id, excluded.exemplar_doc_id);
+    """
+
+
+def _question_stats_remove(
+    topic: str, doc_id: str, answers: str, compressed: bool = False
+) -> str:
+    """Trigger statements removing answers of a document from TopicQuestionStats
+
+    If the document was the exemplar of a topic and question, another document of
+    the topic with an answer that is not a non-answer becomes the exemplar.
+
+    Args:
+      topic: the topic id of the document, -1 for none
+      doc_id: the id of the document
+      answers: query of the removed answers with columns question_id and answer
+      compressed: whether the answers may be compressed
+    """
+    return f"""
+    UPDATE TopicQuestionStats SET
+      n_answers = n_answers - 1,
+      n_non_answers = n_non_answers - {_non_answer_sql("r.answer", compressed)}
+    FROM ({answers}) r
+    WHERE TopicQuestionStats.topic_id = {topic}
+      AND TopicQuestionStats.question_id = r.question_id;
+    UPDATE TopicQuestionStats SET exemplar_doc_id = ({_exemplar_sql(doc_id, compressed)})
+    WHERE topic_id = {topic} AND exemplar_doc_id = {doc_id}
+      AND question_id IN (SELECT question_id FROM ({answers}));
+    DELETE FROM TopicQuestionStats WHERE topic_id = {topic} AND n_answers = 0;
+    """
+
+
+def _fts_triggers(index: str, table: str, column: str, compressed: bool) -> list[str]:
+    """Statements creating the view a full-text index reads the texts of a column from
+    and the triggers keeping the index in sync
+
+    The view is {table}Text. The update trigger can be suspended, see
+    `TextDB.compress_texts`.
+
+    Args:
+      index: the name of the index
+      table: the table holding the texts
+      column: the text column
+      compressed: whether the texts may be compressed, see `_text_sql`
+    """
+    view, prefix = f"{table}Text", f"{table.lower()}_fts"
+
+    def text(column: str) -> str:
+        return _text_sql(column) if compressed else column
+
+    return [
+        f"""
+        CREATE VIEW IF NOT EXISTS {view} AS
+        SELECT id, {text(column)} AS {column} FROM {table}
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {prefix}_insert AFTER INSERT ON {table} BEGIN
+          INSERT INTO {index} (rowid, {column}) VALUES (new.id, {text(f"new.{column}")});
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {prefix}_delete AFTER DELETE ON {table} BEGIN
+          INSERT INTO {index} ({index}, rowid, {column})
+          VALUES ('delete', old.id, {text(f"old.{column}")});
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {prefix}_update AFTER UPDATE OF {column} ON {table}
+        WHEN NOT EXISTS (SELECT 1 FROM SuspendedTriggers WHERE name = '{prefix}_update') BEGIN
+          INSERT INTO {index} ({index}, rowid, {column})
+          VALUES ('delete', old.id, {text(f"old.{column}")});
+          INSERT INTO {index} (rowid, {column}) VALUES (new.id, {text(f"new.{column}")});
+        END
+        """,
+    ]
+
+
+def _fts_index(index: str, table: str, column: str) -> list[str]:
+    """Statements creating a full-text index of a text column
+
+    The index is an external content table over the view {table}Text, kept in sync by
+    triggers, see `_fts_triggers`. Once the texts are compressed, the view and the
+    triggers are replaced by ones that decompress them, the index itself is unchanged.
+
+    Args:
+      index: the name of the index
+      table: the table holding the texts
+      column: the text column
+    """
+    return [
+        *_fts_triggers(index, table, column, compressed=False),
+        f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {index} USING fts5(
+          {column}, content='{table}Text', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+        )
+        """,
+        f"INSERT INTO {index} ({index}) VALUES ('rebuild')",
+    ]
+
+
+def _stats_triggers(compressed: bool) -> dict[str, str]:
+    """Triggers maintaining TopicStats and TopicQuestionStats by name
+
+    Created by migration 5, recreated by migration 6 to be suspendable while texts are
+    recompressed and again once the answers are compressed, see `_text_schema`.
+
+    Args:
+      compressed: whether the answers may be compressed, see `_text_sql`
+    """
+    return {
+        "documents_stats_insert": f"""
+        CREATE TRIGGER IF NOT EXISTS documents_stats_insert AFTER INSERT ON Documents BEGIN
+          {_topic_stats_add("COALESCE(new.topic_id, -1)")}
+        END
+        """,
+        # before the delete, the answers are still there and their cascaded deletes
+        # are skipped by answers_stats_delete
+        "documents_stats_delete": f"""
+        CREATE TRIGGER IF NOT EXISTS documents_stats_delete BEFORE DELETE ON Documents BEGIN
+          {_topic_stats_remove("COALESCE(old.topic_id, -1)")}
+          {_question_stats_remove(
+              "COALESCE(old.topic_id, -1)",
+              "old.id",
+              "SELECT question_id, answer FROM Answers WHERE doc_id = old.id",
+              compressed,
+          )}
+        END
+        """,
+        "documents_stats_update": f"""
+        CREATE TRIGGER IF NOT EXISTS documents_stats_update AFTER UPDATE OF topic_id ON Documents
+        WHEN old.topic_id IS NOT new.topic_id AND NOT EXISTS (
+          SELECT 1 FROM SuspendedTriggers WHERE name = 'documents_stats_update'
+        ) BEGIN
+          {_topic_stats_remove("COALESCE(old.topic_id, -1)")}
+          {_topic_stats_add("COALESCE(new.topic_id, -1)")}
+          {_question_stats_remove(
+              "COALESCE(old.topic_id, -1)",
+              "old.id",
+              "SELECT question_id, answer FROM Answers WHERE doc_id = old.id",
+              compressed,
+          )}
+          {_question_stats_add("a.doc_id = new.id", compressed)}
+        END
+        """,
+        "answers_stats_insert": f"""
+        CREATE TRIGGER IF NOT EXISTS answers_stats_insert AFTER INSERT ON Answers BEGIN
+          {_question_stats_add("a.id = new.id", compressed)}
+        END
+        """,
+        "answers_stats_delete": f"""
+        CREATE TRIGGER IF NOT EXISTS answers_stats_delete AFTER DELETE ON Answers
+        WHEN EXISTS (SELECT 1 FROM Documents WHERE id = old.doc_id) BEGIN
+          {_question_stats_remove(
+              "(SELECT COALESCE(topic_id, -1) FROM Documents WHERE id = old.doc_id)",
+              "old.doc_id",
+              "SELECT old.question_id AS question_id, old.answer AS answer",
+              compressed,
+          )}
+        END
+        """,
+        "answers_stats_update": f"""
+        CREATE TRIGGER IF NOT EXISTS answers_stats_update AFTER UPDATE OF answer ON Answers
+        WHEN NOT EXISTS (
+          SELECT 1 FROM SuspendedTriggers WHERE name = 'answers_stats_update'
+        ) BEGIN
+          {_question_stats_remove(
+              "(SELECT COALESCE(topic_id, -1) FROM Documents WHERE id = old.doc_id)",
+              "old.doc_id",
+              "SELECT old.question_id AS question_id, old.answer AS answer",
+              compressed,
+          )}
+          {_question_stats_add("a.id = new.id", compressed)}
+        END
+        """,
+        "questions_stats_delete": """
+        CREATE TRIGGER IF NOT EXISTS questions_stats_delete AFTER DELETE ON Questions BEGIN
+          DELETE FROM TopicQuestionStats WHERE question_id = old.id;
+        END
+        """,
+    }
+
+
+# Tables with a generation counter, see `TextDB.get_generations`. Tables added here
+# need a migration creating their counter and triggers
+GENERATION_TABLES = [
+    "Documents",
+    "Questions",
+    "Answers",
+    "Topics",
+    "Coordinates",
+    "Embeddings",
+]
+
+
+# Schema migrations, applied in order by `TextDB.migrate`. Entry i migrates the
+# schema to version i + 1. Applied migrations must not be changed, append new ones.
+MIGRATIONS = [
+    # 1: one answer per document and question, indexes for the anti-join in
+    # get_documents_without_answer, answers by document and documents by topic
+    [
+        """
+        DELETE FROM Answers WHERE id NOT IN (
+          SELECT MAX(id) FROM Answers GROUP BY question_id, doc_id
+        )
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_answers_question_doc ON Answers(question_id, doc_id)",
+        "CREATE INDEX IF NOT EXISTS idx_answers_doc ON Answers(doc_id)",
+        "CREATE INDEX IF NOT EXISTS idx_documents_topic ON Documents(topic_id)",
+    ],
+    # 2: content hash of documents to skip duplicates on ingest, only the first copy
+    # of documents that are already duplicated gets a hash
+    [
+        "ALTER TABLE Documents ADD COLUMN doc_hash BLOB",
+        """
+        UPDATE Documents SET doc_hash = document_hash(doc) WHERE id IN (
+          SELECT MIN(id) FROM Documents GROUP BY doc
+        )
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_documents_hash ON Documents(doc_hash)",
+    ],
+    # 3: full-text indexes of documents and answers, external content tables kept in
+    # sync by triggers, see `TextDB.search`
+    [
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS DocumentsFts USING fts5(
+          doc, content='Documents', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS documents_fts_insert AFTER INSERT ON Documents BEGIN
+          INSERT INTO DocumentsFts (rowid, doc) VALUES (new.id, new.doc);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS documents_fts_delete AFTER DELETE ON Documents BEGIN
+          INSERT INTO DocumentsFts (DocumentsFts, rowid, doc) VALUES ('delete', old.id, old.doc);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS documents_fts_update AFTER UPDATE OF doc ON Documents BEGIN
+          INSERT INTO DocumentsFts (DocumentsFts, rowid, doc) VALUES ('delete', old.id, old.doc);
+          INSERT INTO DocumentsFts (rowid, doc) VALUES (new.id, new.doc);
+        END
+        """,
+        "INSERT INTO DocumentsFts (DocumentsFts) VALUES ('rebuild')",
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS AnswersFts USING fts5(
+          answer, content='Answers', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS answers_fts_insert AFTER INSERT ON Answers BEGIN
+          INSERT INTO AnswersFts (rowid, answer) VALUES (new.id, new.answer);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS answers_fts_delete AFTER DELETE ON Answers BEGIN
+          INSERT INTO AnswersFts (AnswersFts, rowid, answer) VALUES ('delete', old.id, old.answer);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS answers_fts_update AFTER UPDATE OF answer ON Answers BEGIN
+          INSERT INTO AnswersFts (AnswersFts, rowid, answer) VALUES ('delete', old.id, old.answer);
+          INSERT INTO AnswersFts (rowid, answer) VALUES (new.id, new.answer);
+        END
+        """,
+        "INSERT INTO AnswersFts (AnswersFts) VALUES ('rebuild')",
+    ],
+    # 4: embeddings of documents and answers for vector search, removed with their item
+    [
+        """
+        CREATE TABLE IF NOT EXISTS Embeddings (
+          id INTEGER PRIMARY KEY,
+          scope TEXT NOT NULL,
+          item_id INTEGER NOT NULL,
+          vector BLOB NOT NULL,
+          UNIQUE (scope, item_id)
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS documents_embeddings_delete AFTER DELETE ON Documents BEGIN
+          DELETE FROM Embeddings WHERE scope = 'documents' AND item_id = old.id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS answers_embeddings_delete AFTER DELETE ON Answers BEGIN
+          DELETE FROM Embeddings WHERE scope = 'answers' AND item_id = old.id;
+        END
+        """,
+    ],
+    # 5: summary statistics per topic and per topic and question, kept up to date by
+    # triggers so that overviews never aggregate over Documents or Answers. Documents
+    # without topic are counted under topic -1
+    [
+        # names of triggers whose work is done in bulk by the current transaction,
+        # see `TextDB.insert_topics_for_documents`
+        "CREATE TABLE IF NOT EXISTS SuspendedTriggers (name TEXT PRIMARY KEY)",
+        """
+        CREATE TABLE IF NOT EXISTS TopicStats (
+          topic_id INTEGER PRIMARY KEY,
+          n_documents INTEGER NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS TopicQuestionStats (
+          topic_id INTEGER NOT NULL,
+          question_id INTEGER NOT NULL,
+          n_answers INTEGER NOT NULL,
+          n_non_answers INTEGER NOT NULL,
+          exemplar_doc_id INTEGER,
+          PRIMARY KEY (topic_id, question_id)
+        ) WITHOUT ROWID
+        """,
+        """
+        INSERT INTO TopicStats (topic_id, n_documents)
+        SELECT COALESCE(topic_id, -1), COUNT(*) FROM Documents GROUP BY 1
+        """,
+        f"""
+        INSERT INTO TopicQuestionStats (
+          topic_id, question_id, n_answers, n_non_answers, exemplar_doc_id
+        )
+        SELECT COALESCE(d.topic_id, -1), a.question_id, COUNT(*),
+          SUM({_non_answer_sql("a.answer")}),
+          MIN(CASE WHEN {_non_answer_sql("a.answer")} THEN NULL ELSE a.doc_id END)
+        FROM Answers a JOIN Documents d ON d.id = a.doc_id
+        GROUP BY 1, 2
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS documents_stats_insert AFTER INSERT ON Documents BEGIN
+          {_topic_stats_add("COALESCE(new.topic_id, -1)")}
+        END
+        """,
+        # before the delete, the answers are still there and their cascaded deletes
+        # are skipped by answers_stats_delete
+        f"""
+        CREATE TRIGGER IF NOT EXISTS documents_stats_delete BEFORE DELETE ON Documents BEGIN
+          {_topic_stats_remove("COALESCE(old.topic_id, -1)")}
+          {_question_stats_remove(
+              "COALESCE(old.topic_id, -1)",
+              "old.id",
+              "SELECT question_id, answer FROM Answers WHERE doc_id = old.id",
+          )}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS documents_stats_update AFTER UPDATE OF topic_id ON Documents
+        WHEN old.topic_id IS NOT new.topic_id AND NOT EXISTS (
+          SELECT 1 FROM SuspendedTriggers WHERE name = 'documents_stats_update'
+        ) BEGIN
+          {_topic_stats_remove("COALESCE(old.topic_id, -1)")}
+          {_topic_stats_add("COALESCE(new.topic_id, -1)")}
+          {_question_stats_remove(
+              "COALESCE(old.topic_id, -1)",
+              "old.id",
+              "SELECT question_id, answer FROM Answers WHERE doc_id = old.id",
+          )}
+          {_question_stats_add("a.doc_id = new.id")}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS answers_stats_insert AFTER INSERT ON Answers BEGIN
+          {_question_stats_add("a.id = new.id")}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS answers_stats_delete AFTER DELETE ON Answers
+        WHEN EXISTS (SELECT 1 FROM Documents WHERE id = old.doc_id) BEGIN
+          {_question_stats_remove(
+              "(SELECT COALESCE(topic_id, -1) FROM Documents WHERE id = old.doc_id)",
+              "old.doc_id",
+              "SELECT old.question_id AS question_id, old.answer AS answer",
+          )}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS answers_stats_update AFTER UPDATE OF answer ON Answers
+        BEGIN
+          {_question_stats_remove(
+              "(SELECT COALESCE(topic_id, -1) FROM Documents WHERE id = old.doc_id)",
+              "old.doc_id",
+              "SELECT old.question_id AS question_id, old.answer AS answer",
+          )}
+          {_question_stats_add("a.id = new.id")}
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS questions_stats_delete AFTER DELETE ON Questions BEGIN
+          DELETE FROM TopicQuestionStats WHERE question_id = old.id;
+        END
+        """,
+    ],
+    # 6: texts of documents and answers may be zstd compressed, see
+    # `TextDB.compress_texts`. The dictionaries are stored in the database and the
+    # full-text indexes are rebuilt over views of the texts. The views and the
+    # triggers reading the texts only decompress them once a scope is compressed,
+    # see `_text_schema`. The statistics triggers become suspendable
+    [
+        """
+        CREATE TABLE IF NOT EXISTS TextDictionaries (
+          dict_id INTEGER PRIMARY KEY,
+          scope TEXT NOT NULL,
+          dictionary BLOB NOT NULL,
+          active INTEGER NOT NULL DEFAULT 1,
+          created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        *(
+            f"DROP TRIGGER IF EXISTS {table}_fts_{event}"
+            for table in ["documents", "answers"]
+            for event in ["insert", "delete", "update"]
+        ),
+        "DROP TABLE IF EXISTS DocumentsFts",
+        "DROP TABLE IF EXISTS AnswersFts",
+        *_fts_index("DocumentsFts", "Documents", "doc"),
+        *_fts_index("AnswersFts", "Answers", "answer"),
+        *(f"DROP TRIGGER IF EXISTS {name}" for name in _stats_triggers(False)),
+        *_stats_triggers(False).values(),
+    ],
+    # 7: a generation counter per table, bumped by every write to the table. The
+    # counters start at random values, so a recreated database does not repeat the
+    # generations, and thus the ETags, of an earlier one
+    [
+        """
+        CREATE TABLE IF NOT EXISTS Generations (
+          name TEXT PRIMARY KEY,
+          generation INTEGER NOT NULL
+        ) WITHOUT ROWID
+        """,
+        *(
+            f"""
+            INSERT OR IGNORE INTO Generations (name, generation)
+            VALUES ('{table}', abs(random() >> 16))
+            """
+            for table in GENERATION_TABLES
+        ),
+        *(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table.lower()}_generation_{event.lower()}
+            AFTER {event} ON {table} BEGIN
+              UPDATE Generations SET generation = generation + 1 WHERE name = '{table}';
+            END
+            """
+            for table in GENERATION_TABLES
+            for event in ["INSERT", "UPDATE", "DELETE"]
+        ),
+    ],
+    # 8: answers processed by the incremental topic pipeline, see pipeline.py, with
+    # their topic label, NULL for non-answers. Answers whose text changes are
+    # processed again and lose their now stale embedding
+    [
+        """
+        CREATE TABLE IF NOT EXISTS PipelineAnswers (
+          answer_id INTEGER PRIMARY KEY,
+          question_id INTEGER NOT NULL,
+          label INTEGER,
+          probability REAL
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS answers_pipeline_delete AFTER DELETE ON Answers BEGIN
+          DELETE FROM PipelineAnswers WHERE answer_id = old.id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS answers_pipeline_update AFTER UPDATE OF answer ON Answers
+        WHEN old.answer IS NOT new.answer AND NOT EXISTS (
+          SELECT 1 FROM SuspendedTriggers WHERE name = 'answers_pipeline_update'
+        ) BEGIN
+          DELETE FROM PipelineAnswers WHERE answer_id = old.id;
+          DELETE FROM Embeddings WHERE scope = 'answers' AND item_id = old.id;
+        END
+        """,
+    ],
+    # 9: topics of the pipeline belong to the question whose answers they were fitted
+    # on, their external ids, the topic labels, are only unique per question. Earlier
+    # topics belong to no question
+    [
+        "ALTER TABLE Topics ADD COLUMN question_id INTEGER",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_topics_question ON Topics(question_id, external_id)",
+    ],
+]
+
+# Statements updating TopicStats and TopicQuestionStats for the documents in
+# temp.DocTopicsMoved after their topics were updated, see
+# `TextDB.insert_topics_for_documents`
+_BULK_TOPIC_STATS = [
+    """
+    UPDATE TopicStats SET n_documents = n_documents - c.n
+    FROM (SELECT old_topic_id, COUNT(*) AS n FROM temp.DocTopicsMoved GROUP BY 1) c
+    WHERE TopicStats.topic_id = c.old_topic_id
+    """,
+    """
+    INSERT INTO TopicStats (topic_id, n_documents)
+    SELECT new_topic_id, COUNT(*) FROM temp.DocTopicsMoved WHERE true GROUP BY 1
+    ON CONFLICT (topic_id) DO UPDATE SET n_documents = n_documents + excluded.n_documents
+    """,
+    "DELETE FROM TopicStats WHERE n_documents = 0",
+    f"""
+    UPDATE TopicQuestionStats SET
+      n_answers = n_answers - c.n,
+      n_non_answers = n_non_answers - c.n_non
+    FROM (
+      SELECT m.old_topic_id, a.question_id, COUNT(*) AS n,
+        SUM({_non_answer_sql("a.answer", compressed=True)}) AS n_non
+      FROM temp.DocTopicsMoved m JOIN Answers a ON a.doc_id = m.doc_id
+      GROUP BY 1, 2
+    ) c
+    WHERE TopicQuestionStats.topic_id = c.old_topic_id
+      AND TopicQuestionStats.question_id = c.question_id
+    """,
+    f"""
+    INSERT INTO TopicQuestionStats (
+      topic_id, question_id, n_answers, n_non_answers, exemplar_doc_id
+    )
+    SELECT m.new_topic_id, a.question_id, COUNT(*),
+      SUM({_non_answer_sql("a.answer", compressed=True)}),
+      MIN(CASE WHEN {_non_answer_sql("a.answer", compressed=True)} THEN NULL ELSE a.doc_id END)
+    FROM temp.DocTopicsMoved m JOIN Answers a ON a.doc_id = m.doc_id
+    WHERE true
+    GROUP BY 1, 2
+    ON CONFLICT (topic_id, question_id) DO UPDATE SET
+      n_answers = n_answers + excluded.n_answers,
+      n_non_answers = n_non_answers + excluded.n_non_answers,
+      exemplar_doc_id = COALESCE(exemplar_doc_id, excluded.exemplar_doc_id)
+    """,
+    "DELETE FROM TopicQuestionStats WHERE n_answers = 0",
+    f"""
+    UPDATE TopicQuestionStats SET exemplar_doc_id = ({_exemplar_sql("-1", compressed=True)})
+    WHERE exemplar_doc_id IN (
+      SELECT doc_id FROM temp.DocTopicsMoved
+      WHERE old_topic_id = TopicQuestionStats.topic_id
+    )
+    """,
+]
+
+# Id ranges of up to SAMPLE_SCAN_MAX ids, and of fewer than 16 ids per drawn document,
+# are read completely by `TextDB.sample_documents`, which also looks up at most that
+# many random ids per round in at most SAMPLE_ROUNDS rounds
+SAMPLE_SCAN_MAX = 10_000
+SAMPLE_ROUNDS = 8
+
+# Tables holding texts and their text column, the texts can be compressed, see
+# `TextDB.compress_texts`
+TEXT_SCOPES = {
+    "documents": ("Documents", "doc"),
+    "answers": ("Answers", "answer"),
+}
+
+# Triggers on updates of the texts of a scope, suspended while texts are recompressed
+# since that does not change them
+_TEXT_UPDATE_TRIGGERS = {
+    "documents": ["documents_fts_update"],
+    "answers": [
+        "answers_fts_update",
+        "answers_stats_update",
+        "answers_pipeline_update",
+    ],
+}
+
+# Tables whose rows can have an embedding, see `TextDB.insert_embeddings`
+EMBEDDING_SCOPES = TEXT_SCOPES
+
+# Full-text indexes searchable with `TextDB.search`: index table, content table and
+# the columns returned for a hit besides id, rank and snippet
+SEARCH_SCOPES = {
+    "documents": ("DocumentsFts", "Documents", ["topic_id"]),
+    "answers": ("AnswersFts", "Answers", ["doc_id", "question_id"]),
+}
+
+
+def _text_schema(scope: str, compressed: bool) -> list[str]:
+    """Statements replacing the views and triggers that read the texts of a scope
+
+    decompress_text is only registered on the connections of `TextDB`, other clients,
+    e.g. the sqlite3 shell, could no longer write the tables if every trigger called
+    it. So the views and triggers only decompress the texts once the scope has a
+    compression dictionary, see `_sync_text_schema`.
+
+    Args:
+      scope: "documents" or "answers", see `TEXT_SCOPES`
+      compressed: whether the texts may be compressed
+
+    Returns:
+      the statements, to be run in one transaction
+    """
+    table, column = TEXT_SCOPES[scope]
+    index, prefix = SEARCH_SCOPES[scope][0], f"{table.lower()}_fts"
+    statements = [
+        f"DROP VIEW IF EXISTS {table}Text",
+        *(
+            f"DROP TRIGGER IF EXISTS {prefix}_{event}"
+            for event in ["insert", "delete", "update"]
+        ),
+        *_fts_triggers(index, table, column, compressed),
+    ]
+    if scope == "answers":
+        triggers = _stats_triggers(compressed)
+        statements += [f"DROP TRIGGER IF EXISTS {name}" for name in triggers]
+        statements += triggers.values()
+    return statements
+
+
+# Lists of `TextDB.get_list` and `TextDB.get_json_rows`, ordered by id: tables they
+# are read from, their id column and their keys with the SQL of their values
+LISTS = {
+    "documents": (
+        "Documents",
+        "id",
+        {"id": "id", "text": _text_sql("doc"), "topic_id": "topic_id"},
+    ),
+    "questions": ("Questions", "id", {"id": "id", "question": "question"}),
+    "answers": (
+        """
+        Answers a
+        LEFT JOIN Documents d ON a.doc_id = d.id
+        LEFT JOIN Questions q ON a.question_id = q.id
+        """,
+        "a.id",
+        {
+            "doc": _text_sql("d.doc"),
+            "answer": _text_sql("a.answer"),
+            "id": "a.id",
+            "question": "q.id",
+        },
+    ),
+}
+
+
+def document_hash(doc: str) -> bytes:
+    """Returns the 16 byte BLAKE2b digest of a document's text
+
+    Also available in SQL as document_hash(doc) on connections of `TextDB`.
+    """
+    return hashlib.blake2b(doc.encode("utf-8"), digest_size=16).digest()
+
+
+def _load_text_dictionaries(codec: TextCodec, conn: sqlite3.Connection) -> None:
+    """Adds all compression dictionaries of the database to a codec and activates them"""
+    cursor = conn.execute(
+        "SELECT dict_id, scope, dictionary, active FROM TextDictionaries ORDER BY dict_id"
+    )
+    active = {}
+    for dict_id, scope, dictionary, is_active in cursor.fetchall():
+        codec.add_dictionary(dict_id, dictionary)
+        if is_active:
+            active[scope] = dict_id
+    for scope in TEXT_SCOPES:
+        codec.activate(scope, active.get(scope))
+
+
+def _text_schema_changes(conn: sqlite3.Connection) -> dict[str, bool]:
+    """Returns the scopes whose views and triggers do not match their compression
+
+    A scope is compressed once it has a dictionary, see `_text_schema`.
+
+    Args:
+      conn: the connection
+
+    Returns:
+      a mapping from the scopes to whether they are compressed
+    """
+    cursor = conn.execute("SELECT DISTINCT scope FROM TextDictionaries")
+    compressed = {scope for (scope,) in cursor.fetchall()}
+    changes = {}
+    for scope, (table, _) in TEXT_SCOPES.items():
+        view = conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'view' AND name = ?",
+            (f"{table}Text",),
+        ).fetchone()[0]
+        if ("decompress_text" in view) != (scope in compressed):
+            changes[scope] = scope in compressed
+    return changes
+
+
+def _sync_text_schema(conn: sqlite3.Connection) -> None:
+    """Replaces the views and triggers that do not match the compression of their scope
+
+    Must be called in a write transaction. Also repairs databases whose views and
+    triggers decompressed the texts of scopes without a dictionary.
+    """
+    for scope, compressed in _text_schema_changes(conn).items():
+        for statement in _text_schema(scope, compressed):
+            conn.execute(statement)
+
+
+def _decompress_text(codec: TextCodec, conn_ref: weakref.ref, value):
+    """decompress_text(value) in SQL, see `TextCodec.decode`
+
+    Dictionaries trained after the codec was loaded, e.g. by another process, are
+    loaded on first use.
+    """
+    try:
+        return codec.decode(value)
+    except UnknownDictionaryError:
+        _load_text_dictionaries(codec, conn_ref())
+        return codec.decode(value)
+
+
+class _Connection(sqlite3.Connection):
+    """sqlite3 connection that can be tracked with weak references"""
+
+
+@trace_methods("db")
 class TextDB:
-    def __init__(self, db_name: str = "texts.sqlite3") -> None:
+    def __init__(
+        self,
+        db_name: str = "texts.sqlite3",
+        pragmas: dict | None = None,
+        pool_size: int = SQLITE_POOL_SIZE,
+    ) -> None:
         """Initializes the TextDB class
 
         Initializes the database and creates the tables if they do not exist.
 
+        Every thread gets its own connection, so concurrent requests neither share
+        transactions nor wait on each other's statements. Connections released with
+        `release_connection` are kept in a pool of at most `pool_size` idle connections
+        and reused by the next thread. In-memory databases only exist within a single
+        connection, so all threads share one connection for ":memory:".
+
         Args:
             db_name: the name of the database
+            pragmas: pragmas set on every connection, defaults to SQLITE_PRAGMAS
+            pool_size: maximum number of idle connections kept for reuse
 
         Returns:
             None
         """
-        self.conn = sqlite3.connect(db_name, check_same_thread=False)
-        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.db_name = db_name
+        self.pragmas = SQLITE_PRAGMAS if pragmas is None else pragmas
+        self._local = threading.local()
+        self._idle = queue.LifoQueue(maxsize=pool_size)
+        self._connections = weakref.WeakSet()
+        self._shared = None
+        # compresses and decompresses texts, the dictionaries are loaded by init_tables
+        self.codec = TextCodec()
+        if db_name == ":memory:":
+            self._shared = self._connect()
         self.init_tables()
 
     def __del__(self) -> None:
         """Closes the connection to the database when the object is deleted"""
         self.close_connection()
 
+    def _connect(self) -> sqlite3.Connection:
+        """Opens a new connection and applies the pragmas
+
+        Returns:
+          the connection
+        """
+        conn = sqlite3.connect(
+            self.db_name, check_same_thread=False, factory=_Connection
+        )
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.create_function("document_hash", 1, document_hash, deterministic=True)
+        conn.create_function(
+            "decompress_text",
+            1,
+            functools.partial(_decompress_text, self.codec, weakref.ref(conn)),
+            deterministic=True,
+        )
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        self._connections.add(conn)
+        return conn
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """The connection of the calling thread, taken from the pool or newly opened"""
+        if self._shared is not None:
+            return self._shared
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    def release_connection(self) -> None:
+        """Returns the connection of the calling thread to the pool
+
+        Call this when a thread is done with the database, e.g. at the end of a request.
+        Connections of threads that end without releasing them are closed when the
+        thread is garbage collected.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            return
+        self._local.conn = None
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
     def close_connection(self) -> None:
-        """Closes the connection to the database"""
-        self.conn.close()
+        """Closes all connections to the database"""
+        for conn in list(self._connections):
+            conn.close()
+        while not self._idle.empty():
+            self._idle.get_nowait()
+        self._local = threading.local()
 
     def init_tables(self) -> None:
         """
         Initialize the tables in the database.
 
-        Creates tables Documents, Questions, Answers, Topics if they do not exist.
+        Creates tables Documents, Questions, Answers, Topics, Coordinates if they do not exist
+        and applies all pending schema migrations, see `MIGRATIONS`. Loads the
+        compression dictionaries of the texts.
 
         """
         with self.conn as conn:
@@ -82,6 +972,88 @@ class TextDB:
             """
             )
 
+            cursor.execute(
+                """
+            CREATE TABLE IF NOT EXISTS Coordinates (
+              doc_id INTEGER PRIMARY KEY,
+              x REAL NOT NULL,
+              y REAL NOT NULL,
+              CONSTRAINT fk_documents
+                FOREIGN KEY (doc_id)
+                REFERENCES Documents(id)
+                ON DELETE CASCADE
+            )
+            """
+            )
+
+            cursor.execute(
+                """
+            CREATE TABLE IF NOT EXISTS SchemaVersion (
+              version INTEGER PRIMARY KEY,
+              applied_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+            )
+
+        self.migrate()
+        if _text_schema_changes(self.conn):
+            with self.conn as conn:
+                # IMMEDIATE takes the write lock, so concurrent processes change it once
+                conn.execute("BEGIN IMMEDIATE")
+                _sync_text_schema(conn)
+        _load_text_dictionaries(self.codec, self.conn)
+
+    def get_generations(self, tables: list[str] | None = None) -> dict[str, int]:
+        """Returns the generation counters of tables
+
+        Every insert, update or delete of a row bumps the counter of its table,
+        including cascaded deletes and writes of other connections and processes.
+        Data derived from tables, e.g. cached responses or indexes, is up to date as
+        long as their generations are unchanged.
+
+        Args:
+          tables: names of tables in GENERATION_TABLES, all if None
+
+        Returns:
+          a mapping from table names to generations, in the order of `tables`
+        """
+        cursor = self.conn.execute("SELECT name, generation FROM Generations")
+        generations = dict(cursor.fetchall())
+        if tables is None:
+            tables = GENERATION_TABLES
+        return {table: generations[table] for table in tables}
+
+    def get_schema_version(self) -> int:
+        """Returns the version of the last applied schema migration, 0 if none"""
+        cursor = self.conn.execute(
+            "SELECT COALESCE(MAX(version), 0) FROM SchemaVersion"
+        )
+        return cursor.fetchone()[0]
+
+    def migrate(self) -> None:
+        """Applies all pending schema migrations, each in its own transaction
+
+        Args:
+          None
+
+        Returns:
+          None
+        """
+        conn = self.conn
+        for version, statements in enumerate(MIGRATIONS, start=1):
+            if self.get_schema_version() >= version:
+                continue
+            with conn:
+                # IMMEDIATE takes the write lock, so concurrent processes migrate once
+                conn.execute("BEGIN IMMEDIATE")
+                if self.get_schema_version() >= version:
+                    continue
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(
+                    "INSERT INTO SchemaVersion (version) VALUES (?)", (version,)
+                )
+
     def insert_document(self, doc: str) -> int:
         """Inserts a single document into the database
 
@@ -93,7 +1065,10 @@ class TextDB:
         """
         with self.conn as conn:
             cursor = conn.cursor()
-            cursor.execute("INSERT INTO Documents (doc) VALUES (?)", (doc,))
+            cursor.execute(
+                "INSERT INTO Documents (doc) VALUES (?)",
+                (self.codec.encode("documents", doc),),
+            )
             return cursor.lastrowid
 
     def remove_all_documents(self) -> None:
@@ -109,7 +1084,7 @@ class TextDB:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM Documents")
 
-    def insert_topic_for_document(self, doc_id: int, topic_id: int) -> None:
+    def insert_topic_for_document(self, doc_id: int, topic_id: int) -> bool:
         """Inserts a topic for a document
 
         Args:
@@ -117,13 +1092,67 @@ class TextDB:
           topic_id: the id of the topic
 
         Returns:
-          None
+          True if the document exists, False otherwise
         """
         with self.conn as conn:
             cursor = conn.cursor()
             cursor.execute(
                 "UPDATE Documents SET topic_id = ? WHERE id = ?", (topic_id, doc_id)
             )
+            return cursor.rowcount > 0
+
+    def insert_coordinates(self, coordinates: list[tuple[int, float, float]]) -> None:
+        """Inserts or replaces the 2d coordinates of documents for the topic map
+
+        Args:
+          coordinates: tuples (doc_id, x, y)
+
+        Returns:
+          None
+        """
+        with self.conn as conn:
+            cursor = conn.cursor()
+            cursor.executemany(
+                "INSERT OR REPLACE INTO Coordinates (doc_id, x, y) VALUES (?, ?, ?)",
+                coordinates,
+            )
+
+    def remove_coordinates(self, doc_ids: list[int]) -> None:
+        """Removes documents from the topic map
+
+        Args:
+          doc_ids: the ids of the documents
+
+        Returns:
+          None
+        """
+        with self.conn as conn:
+            cursor = conn.cursor()
+            cursor.executemany(
+                "DELETE FROM Coordinates WHERE doc_id = ?",
+                [(doc_id,) for doc_id in doc_ids],
+            )
+
+    def get_points(self) -> list[tuple[int, float, float, int]]:
+        """Returns the 2d coordinates and topic ids of all documents on the topic map
+
+        Args:
+          None
+
+        Returns:
+          a list of tuples (doc_id, x, y, topic_id), topic_id is -1 for documents without topic
+        """
+        with self.conn as conn:
+            cursor = conn.cursor()
+            cursor = cursor.execute(
+                """
+                SELECT c.doc_id, c.x, c.y, COALESCE(d.topic_id, -1)
+                FROM Coordinates c
+                JOIN Documents d ON c.doc_id = d.id
+                ORDER BY c.doc_id
+            """
+            )
+            return cursor.fetchall()
 
     def insert_documents(self, docs: list[str]):
         """Inserts a list of documents into the database
@@ -137,8 +1166,36 @@ class TextDB:
         with self.conn as conn:
             cursor = conn.cursor()
             cursor.executemany(
-                "INSERT INTO Documents (doc) VALUES (?)", [(doc,) for doc in docs]
+                "INSERT INTO Documents (doc) VALUES (?)",
+                [(self.codec.encode("documents", doc),) for doc in docs],
+            )
+
+    def insert_unique_documents(self, docs: list[str]) -> int:
+        """Inserts documents in a single transaction, skipping duplicates
+
+        A document is a duplicate if a document with the same text, see `document_hash`,
+        was inserted with this method before or is part of `docs` already. Documents
+        inserted with `insert_document` or `insert_documents` are not hashed.
+
+        Args:
+          docs: the documents to insert
+
+        Returns:
+          the number of inserted documents
+        """
+        with self.conn as conn:
+            cursor = conn.cursor()
+            cursor.executemany(
+                """
+                INSERT INTO Documents (doc, doc_hash) VALUES (?, ?)
+                ON CONFLICT (doc_hash) DO NOTHING
+                """,
+                [
+                    (self.codec.encode("documents", doc), document_hash(doc))
+                    for doc in docs
+                ],
             )
+            return cursor.rowcount
 
     def insert_topic(self, external_id: int, topic_representation: str) -> int:
         """Inserts a topic into the database
@@ -166,6 +1223,145 @@ class TextDB:
                 topics,
             )
 
+    def upsert_topics(
+        self, topics: list[tuple[int, str]], question_id: int | None = None
+    ) -> dict[int, int]:
+        """Inserts topics or updates the representation of topics with the same external id
+
+        Args:
+          topics: tuples (external_id, topic_representation)
+          question_id: the question the topics belong to, external ids are only
+            unique per question
+
+        Returns:
+          a mapping from external ids to topic ids of the topics of the question
+        """
+        with self.conn as conn:
+            cursor = conn.cursor()
+            select = "SELECT external_id, id FROM Topics WHERE question_id IS ?"
+            existing = dict(cursor.execute(select, (question_id,)))
+            cursor.executemany(
+                "UPDATE Topics SET topic_representation = ? WHERE id = ?",
+                [
+                    (representation, existing[external_id])
+                    for external_id, representation in topics
+                    if external_id in existing
+                ],
+            )
+            cursor.executemany(
+                """
+                INSERT INTO Topics (question_id, external_id, topic_representation)
+                VALUES (?, ?, ?)
+                """,
+                [
+                    (question_id, external_id, representation)
+                    for external_id, representation in topics
+                    if external_id not in existing
+                ],
+            )
+            return dict(cursor.execute(select, (question_id,)))
+
+    def remove_stale_topics(self, question_id: int, external_ids: list[int]) -> int:
+        """Removes the topics of a question that are not among its current topics
+
+        Documents that still have one of the removed topics lose their topic.
+
+        Args:
+          question_id: the question whose topics are removed
+          external_ids: the external ids of the current topics of the question
+
+        Returns:
+          the number of removed topics
+        """
+        cursor = self.conn.execute(
+            """
+            SELECT id FROM Topics
+            WHERE question_id = ? AND external_id NOT IN (SELECT value FROM json_each(?))
+            """,
+            (question_id, json.dumps(external_ids)),
+        )
+        stale = [topic_id for topic_id, in cursor]
+        if not stale:
+            return 0
+        cursor = self.conn.execute(
+            "SELECT id FROM Documents WHERE topic_id IN (SELECT value FROM json_each(?))",
+            (json.dumps(stale),),
+        )
+        self.insert_topics_for_documents([(doc_id, None) for doc_id, in cursor])
+        with self.conn as conn:
+            conn.executemany(
+                "DELETE FROM Topics WHERE id = ?", [(topic_id,) for topic_id in stale]
+            )
+        return len(stale)
+
+    def insert_topics_for_documents(self, doc_topics: list[tuple[int, int]]) -> int:
+        """Sets the topics of many documents in a single transaction
+
+        The labels are loaded into a temporary table and applied with a single
+        UPDATE ... FROM instead of one statement per document. The per-row trigger
+        maintaining the topic statistics is suspended, the statistics are updated with
+        a few set-based statements over the moved documents instead. Documents whose
+        topic does not change are not written.
+
+        Args:
+          doc_topics: tuples (doc_id, topic_id), topic_id may be None
+
+        Returns:
+          the number of documents whose topic changed
+        """
+        with self.conn as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                CREATE TEMP TABLE IF NOT EXISTS DocTopicsStaging (
+                  doc_id INTEGER PRIMARY KEY,
+                  topic_id INTEGER
+                )
+                """
+            )
+            cursor.execute(
+                """
+                CREATE TEMP TABLE IF NOT EXISTS DocTopicsMoved (
+                  doc_id INTEGER PRIMARY KEY,
+                  old_topic_id INTEGER NOT NULL,
+                  new_topic_id INTEGER NOT NULL
+                )
+                """
+            )
+            cursor.executemany(
+                "INSERT OR REPLACE INTO temp.DocTopicsStaging (doc_id, topic_id) VALUES (?, ?)",
+                doc_topics,
+            )
+            # topic ids in DocTopicsMoved are -1 for no topic, like in the statistics
+            cursor.execute(
+                """
+                INSERT INTO temp.DocTopicsMoved (doc_id, old_topic_id, new_topic_id)
+                SELECT d.id, COALESCE(d.topic_id, -1), COALESCE(s.topic_id, -1)
+                FROM temp.DocTopicsStaging s
+                JOIN Documents d ON d.id = s.doc_id
+                WHERE d.topic_id IS NOT s.topic_id
+                """
+            )
+            cursor.execute(
+                "INSERT INTO SuspendedTriggers (name) VALUES ('documents_stats_update')"
+            )
+            cursor.execute(
+                """
+                UPDATE Documents SET topic_id = NULLIF(m.new_topic_id, -1)
+                FROM temp.DocTopicsMoved m
+                WHERE Documents.id = m.doc_id
+                """
+            )
+            updated = cursor.rowcount
+            for statement in _BULK_TOPIC_STATS:
+                cursor.execute(statement)
+            cursor.execute(
+                "DELETE FROM SuspendedTriggers WHERE name = 'documents_stats_update'"
+            )
+            cursor.execute("DELETE FROM temp.DocTopicsStaging")
+            cursor.execute("DELETE FROM temp.DocTopicsMoved")
+        return updated
+
     def insert_question(self, question: str) -> int:
         """Inserts a question into the database
 
@@ -208,10 +1404,34 @@ class TextDB:
             cursor = conn.cursor()
             cursor.execute(
                 "INSERT INTO Answers (doc_id, question_id, answer) VALUES (?, ?, ?)",
-                (doc_id, question_id, answer),
+                (doc_id, question_id, self.codec.encode("answers", answer)),
             )
             return cursor.lastrowid
 
+    def insert_answers(self, answers: list[tuple[int, int, str]]) -> None:
+        """Inserts many answers in a single transaction
+
+        An existing answer of a document to the same question is replaced.
+
+        Args:
+          answers: tuples (doc_id, question_id, answer)
+
+        Returns:
+          None
+        """
+        with self.conn as conn:
+            cursor = conn.cursor()
+            cursor.executemany(
+                """
+                INSERT INTO Answers (doc_id, question_id, answer) VALUES (?, ?, ?)
+                ON CONFLICT (question_id, doc_id) DO UPDATE SET answer = excluded.answer
+                """,
+                [
+                    (doc_id, question_id, self.codec.encode("answers", answer))
+                    for doc_id, question_id, answer in answers
+                ],
+            )
+
     def remove_answer(self, answer_id: int) -> None:
         """Removes an answer from the database
 
@@ -225,21 +1445,34 @@ class TextDB:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM Answers WHERE id = ?", (answer_id,))
 
-    def get_documents(self) -> list[tuple[int, str, int]]:
-        """Returns all docs from Documents as a list
+    def get_documents(
+        self, after_id: int = 0, limit: int | None = None
+    ) -> list[tuple[int, str, int]]:
+        """Returns docs from Documents as a list, ordered by id
 
         Args:
-          None
+          after_id: only return documents with an id greater than this, for keyset pagination
+          limit: maximum number of documents to return, all if None
 
         Returns:
           a list of documents
         """
-        with self.conn as conn:
-            cursor = conn.cursor()
-            cursor = cursor.execute("SELECT * FROM Documents")
-            raw = cursor.fetchall()
-            keys = ["id", "text", "topic_id"]
-            return [dict(zip(keys, row)) for row in raw]
+        return self.get_list("documents", after_id=after_id, limit=limit)
+
+    def iter_documents(self, after_id: int = 0, batch_size: int = 1000):
+        """Iterates over docs from Documents, see `get_documents`
+
+        Documents are fetched in pages of `batch_size`, so memory use does not grow
+        with the number of documents and no transaction is held between pages.
+
+        Args:
+          after_id: only yield documents with an id greater than this
+          batch_size: number of documents fetched per query
+
+        Yields:
+          documents
+        """
+        yield from _iter_pages(self.get_documents, after_id, batch_size)
 
     def get_document(self, doc_id: int) -> tuple[int, str, int]:
         """Returns a document from Documents as a string
@@ -251,9 +1484,153 @@ class TextDB:
         """
         with self.conn as conn:
             cursor = conn.cursor()
-            cursor = cursor.execute("SELECT * FROM Documents WHERE id = ?", (doc_id,))
+            cursor = cursor.execute(
+                f"SELECT id, {_text_sql('doc')}, topic_id FROM Documents WHERE id = ?",
+                (doc_id,),
+            )
             return cursor.fetchone()
 
+    def sample_documents(
+        self,
+        k: int,
+        stratify: str | None = None,
+        question_id: int | None = None,
+        seed: int | None = None,
+    ) -> list[dict]:
+        """Draws a random sample of documents without reading the whole table
+
+        Ids are drawn uniformly from the id range of a stratum and looked up in
+        batches, ids of deleted documents or of documents in other strata are
+        rejected. If too many ids are rejected, the remaining documents are taken
+        as the next document after random ids, which favours documents after large
+        gaps in the ids. The cost depends on k and on the share of the id range
+        occupied by a stratum, not on the number of documents.
+
+        Args:
+          k: number of documents to draw, fewer if there are fewer documents
+          stratify: None for a uniform sample, "topic" to sample every topic, or
+            "answered" to sample documents with and without an answer to `question_id`,
+            both in proportion to the size of the strata, see `get_topic_stats`
+          question_id: the question for stratify="answered"
+          seed: random seed
+
+        Raises:
+          ValueError: if `stratify` is unknown or "answered" without a question
+
+        Returns:
+          a list of documents in random order
+        """
+        rng = random.Random(seed)
+        if k <= 0:
+            return []
+
+        if stratify is None:
+            strata = [("1", (), None)]
+        elif stratify == "topic":
+            cursor = self.conn.execute("SELECT topic_id, n_documents FROM TopicStats")
+            strata = [
+                ("d.topic_id IS ?", (None if topic_id == -1 else topic_id,), size)
+                for topic_id, size in cursor.fetchall()
+            ]
+        elif stratify == "answered":
+            if question_id is None:
+                raise ValueError("stratify='answered' requires a question_id")
+            n_documents, n_answered = self.conn.execute(
+                """
+                SELECT
+                  (SELECT COALESCE(SUM(n_documents), 0) FROM TopicStats),
+                  (SELECT COALESCE(SUM(n_answers), 0) FROM TopicQuestionStats
+                   WHERE question_id = ?)
+                """,
+                (question_id,),
+            ).fetchone()
+            answered = "EXISTS (SELECT 1 FROM Answers a WHERE a.doc_id = d.id AND a.question_id = ?)"
+            strata = [
+                (answered, (question_id,), n_answered),
+                (f"NOT {answered}", (question_id,), n_documents - n_answered),
+            ]
+        else:
+            raise ValueError(f"Unknown stratification: {stratify}")
+
+        if stratify is None:
+            quotas = [k]
+        else:
+            quotas = _allocate(k, [size for _, _, size in strata])
+        documents = []
+        for (where, params, _), quota in zip(strata, quotas):
+            if quota > 0:
+                documents.extend(self._sample_stratum(quota, where, params, rng))
+        rng.shuffle(documents)
+        return documents
+
+    def _sample_stratum(
+        self, k: int, where: str, params: tuple, rng: random.Random
+    ) -> list[dict]:
+        """Draws up to k documents matching `where` on Documents d, see `sample_documents`"""
+        conn = self.conn
+        # separate subqueries, so both use the min/max optimization
+        low, high = conn.execute(
+            f"""
+            SELECT
+              (SELECT MIN(d.id) FROM Documents d WHERE {where}),
+              (SELECT MAX(d.id) FROM Documents d WHERE {where})
+        """,
+            params + params,
+        ).fetchone()
+        if low is None:
+            return []
+        keys = ["id", "text", "topic_id"]
+        found = {}
+
+        if high - low < min(SAMPLE_SCAN_MAX, 16 * k):
+            # small ranges are cheaper to read than to sample
+            rows = conn.execute(
+                f"""
+                SELECT d.id, {_text_sql("d.doc")}, d.topic_id FROM Documents d
+                WHERE d.id BETWEEN ? AND ? AND {where}
+            """,
+                (low, high, *params),
+            ).fetchall()
+            return [dict(zip(keys, row)) for row in rng.sample(rows, min(k, len(rows)))]
+
+        acceptance = 0.5
+        for _ in range(SAMPLE_ROUNDS):
+            needed = k - len(found)
+            if needed == 0:
+                break
+            draws = min(
+                SAMPLE_SCAN_MAX,
+                high - low + 1,
+                math.ceil(1.5 * needed / max(acceptance, 1 / 256)),
+            )
+            candidates = rng.sample(range(low, high + 1), draws)
+            rows = conn.execute(
+                f"""
+                SELECT d.id, {_text_sql("d.doc")}, d.topic_id FROM Documents d
+                WHERE d.id IN (SELECT value FROM json_each(?)) AND {where}
+            """,
+                (json.dumps(candidates), *params),
+            ).fetchall()
+            acceptance = len(rows) / draws
+            rng.shuffle(rows)
+            for row in rows:
+                if len(found) < k:
+                    found.setdefault(row[0], row)
+
+        # successors of random ids if the stratum occupies little of its id range
+        for _ in range(SAMPLE_ROUNDS * (k - len(found))):
+            if len(found) == k:
+                break
+            row = conn.execute(
+                f"""
+                SELECT d.id, {_text_sql("d.doc")}, d.topic_id FROM Documents d
+                WHERE d.id >= ? AND {where} ORDER BY d.id LIMIT 1
+            """,
+                (rng.randint(low, high), *params),
+            ).fetchone()
+            found.setdefault(row[0], row)
+        return [dict(zip(keys, row)) for row in found.values()]
+
     def get_documents_without_answer(self, question_id: int) -> list[tuple[int, str]]:
         """Returns all docs from Documents as a list
 
@@ -266,8 +1643,8 @@ class TextDB:
         with self.conn as conn:
             cursor = conn.cursor()
             cursor = cursor.execute(
-                """
-                SELECT d.id, d.doc
+                f"""
+                SELECT d.id, {_text_sql("d.doc")}
                 FROM Documents d
                 LEFT JOIN Answers a ON d.id = a.doc_id AND a.question_id = ?
                 WHERE a.doc_id IS NULL
@@ -278,49 +1655,572 @@ class TextDB:
             keys = ["id", "text"]
             return [dict(zip(keys, row)) for row in raw]
 
-    def get_questions(self) -> list[str]:
-        """Returns all questions from Questions as a list
+    def get_questions(self, after_id: int = 0, limit: int | None = None) -> list[str]:
+        """Returns questions from Questions as a list, ordered by id
 
         Args:
-          None
+          after_id: only return questions with an id greater than this, for keyset pagination
+          limit: maximum number of questions to return, all if None
 
         Returns:
           a list of questions
         """
+        return self.get_list("questions", after_id=after_id, limit=limit)
+
+    def iter_questions(self, after_id: int = 0, batch_size: int = 1000):
+        """Iterates over questions from Questions in pages, see `iter_documents`
+
+        Args:
+          after_id: only yield questions with an id greater than this
+          batch_size: number of questions fetched per query
+
+        Yields:
+          questions
+        """
+        yield from _iter_pages(self.get_questions, after_id, batch_size)
+
+    def get_answers(self, after_id: int = 0, limit: int | None = None) -> list[str]:
+        """Returns answers from Answers as a list, ordered by id
+
+        Args:
+          after_id: only return answers with an id greater than this, for keyset pagination
+          limit: maximum number of answers to return, all if None
+
+        Returns:
+          a list of answers
+        """
+        return self.get_list("answers", after_id=after_id, limit=limit)
+
+    def iter_answers(self, after_id: int = 0, batch_size: int = 1000):
+        """Iterates over answers from Answers in pages, see `iter_documents`
+
+        Args:
+          after_id: only yield answers with an id greater than this
+          batch_size: number of answers fetched per query
+
+        Yields:
+          answers
+        """
+        yield from _iter_pages(self.get_answers, after_id, batch_size)
+
+    def get_list(self, name: str, after_id: int = 0, limit: int | None = None) -> list:
+        """Returns rows of a list in LISTS as dicts, ordered by id
+
+        Args:
+          name: the list, e.g. "documents"
+          after_id: only return rows with an id greater than this, for keyset pagination
+          limit: maximum number of rows to return, all if None
+
+        Returns:
+          a list of rows
+        """
+        table, id_column, columns = LISTS[name]
+        cursor = self.conn.execute(
+            f"""
+            SELECT {", ".join(columns.values())} FROM {table}
+            WHERE {id_column} > ? ORDER BY {id_column} LIMIT ?
+            """,
+            (after_id, -1 if limit is None else limit),
+        )
+        keys = list(columns)
+        return [dict(zip(keys, row)) for row in cursor.fetchall()]
+
+    def get_json_rows(
+        self,
+        name: str,
+        after_id: int = 0,
+        limit: int | None = None,
+        separator: str = ",",
+    ) -> tuple[str, int, int | None]:
+        """Returns rows of a list in LISTS as JSON objects, ordered by id
+
+        The objects are rendered by SQLite, so no Python objects are created for the
+        values of the rows. They are equal to the dicts of `get_list`.
+
+        Args:
+          name: the list, e.g. "documents"
+          after_id: only return rows with an id greater than this, for keyset pagination
+          limit: maximum number of rows to return, all if None
+          separator: string between two objects, e.g. "\\n" for newline-delimited JSON
+
+        Returns:
+          the JSON objects joined by `separator`, the number of rows and the id of the
+          last row, None if there are no rows
+        """
+        table, id_column, columns = LISTS[name]
+        json_object = ", ".join(f"'{key}', {sql}" for key, sql in columns.items())
+        cursor = self.conn.execute(
+            f"""
+            SELECT {id_column}, json_object({json_object}) FROM {table}
+            WHERE {id_column} > ? ORDER BY {id_column} LIMIT ?
+            """,
+            (after_id, -1 if limit is None else limit),
+        )
+        rows = cursor.fetchall()
+        if len(rows) == 0:
+            return "", 0, None
+        return separator.join([row[1] for row in rows]), len(rows), rows[-1][0]
+
+    def iter_json_rows(
+        self,
+        name: str,
+        after_id: int = 0,
+        batch_size: int = 1000,
+        separator: str = ",",
+    ):
+        """Iterates over rows of a list as JSON objects in pages, see `get_json_rows`
+
+        Args:
+          name: the list, e.g. "documents"
+          after_id: only yield rows with an id greater than this
+          batch_size: number of rows fetched per query
+          separator: string between two objects
+
+        Yields:
+          the JSON objects of a page joined by `separator`
+        """
+        while True:
+            objects, count, last_id = self.get_json_rows(
+                name, after_id=after_id, limit=batch_size, separator=separator
+            )
+            if count > 0:
+                yield objects
+            if count < batch_size:
+                return
+            after_id = last_id
+
+    def search(
+        self,
+        query: str,
+        scope: str = "documents",
+        limit: int = 20,
+        offset: int = 0,
+        raw: bool = False,
+        snippet_tokens: int = 12,
+        max_ranked: int | None = SEARCH_MAX_RANKED,
+    ) -> list[dict]:
+        """Returns the documents or answers matching a keyword query, best matches first
+
+        Hits are ranked by BM25 of the FTS5 index. By default every whitespace separated
+        term of `query` is searched as a literal and all terms must match, a trailing *
+        matches a term prefix. With `raw` the query is passed to FTS5 as is, e.g. to
+        use OR, NEAR or phrase queries.
+
+        Ranking reads every match of a query, so only the `max_ranked` matches with the
+        highest ids are ranked. Queries for terms that occur in a large share of the
+        corpus thus return the best of the most recently inserted matches.
+
+        Args:
+          query: the keywords
+          scope: "documents" or "answers", see `SEARCH_SCOPES`
+          limit: maximum number of hits to return
+          offset: number of hits to skip, for pagination
+          raw: pass `query` to FTS5 unchanged
+          snippet_tokens: maximum number of tokens of the snippets
+          max_ranked: maximum number of matches ranked, all if None
+
+        Raises:
+          ValueError: if the scope is unknown or the query has a syntax error
+
+        Returns:
+          a list of hits with id, rank, snippet with matches marked by <b></b>, and
+          topic_id for documents or doc_id and question_id for answers
+        """
+        index, table, columns = _check_scope(scope, SEARCH_SCOPES)
+        if not raw:
+            query = _fts_query(query)
+            if not query:
+                return []
         with self.conn as conn:
             cursor = conn.cursor()
-            cursor = cursor.execute("SELECT * FROM Questions")
-            raw = cursor.fetchall()
-            keys = ["id", "question"]
-            return [dict(zip(keys, row)) for row in raw]
-
-    def get_answers(self) -> list[str]:
-        """Returns all answers from Answers as a list
+            try:
+                # finding the cutoff only walks the index in rowid order, no ranking
+                cutoff = None
+                if max_ranked is not None:
+                    cutoff = cursor.execute(
+                        f"""
+                        SELECT rowid FROM {index} WHERE {index} MATCH ?
+                        ORDER BY rowid DESC LIMIT 1 OFFSET ?
+                    """,
+                        (query, max_ranked),
+                    ).fetchone()
+                cursor = cursor.execute(
+                    f"""
+                    SELECT t.id, f.rank,
+                      snippet({index}, 0, '<b>', '</b>', '…', ?),
+                      {", ".join(f"t.{column}" for column in columns)}
+                    FROM {index} f
+                    JOIN {table} t ON t.id = f.rowid
+                    WHERE {index} MATCH ? AND f.rowid > ?
+                    ORDER BY f.rank
+                    LIMIT ? OFFSET ?
+                """,
+                    (
+                        snippet_tokens,
+                        query,
+                        0 if cutoff is None else cutoff[0],
+                        limit,
+                        offset,
+                    ),
+                )
+                raw_hits = cursor.fetchall()
+            except sqlite3.OperationalError as error:
+                raise ValueError(f"Invalid search query: {error}") from error
+            keys = ["id", "rank", "snippet", *columns]
+            return [dict(zip(keys, row)) for row in raw_hits]
+
+    def insert_embeddings(
+        self, scope: str, embeddings: list[tuple[int, bytes]]
+    ) -> None:
+        """Inserts or replaces the embeddings of documents or answers
 
         Args:
+          scope: "documents" or "answers", see `EMBEDDING_SCOPES`
+          embeddings: tuples (item_id, vector), vectors encoded with `vectorindex.to_blob`
+
+        Returns:
           None
+        """
+        _check_scope(scope, EMBEDDING_SCOPES)
+        with self.conn as conn:
+            cursor = conn.cursor()
+            cursor.executemany(
+                """
+                INSERT INTO Embeddings (scope, item_id, vector) VALUES (?, ?, ?)
+                ON CONFLICT (scope, item_id) DO UPDATE SET vector = excluded.vector
+                """,
+                [(scope, item_id, vector) for item_id, vector in embeddings],
+            )
+
+    def get_embedding(self, scope: str, item_id: int) -> bytes | None:
+        """Returns the embedding of a document or answer, None if it has none
+
+        Args:
+          scope: "documents" or "answers"
+          item_id: the id of the document or answer
 
         Returns:
-          a list of answers
+          the encoded vector
+        """
+        with self.conn as conn:
+            cursor = conn.cursor()
+            cursor = cursor.execute(
+                "SELECT vector FROM Embeddings WHERE scope = ? AND item_id = ?",
+                (scope, item_id),
+            )
+            row = cursor.fetchone()
+            return None if row is None else row[0]
+
+    def get_embeddings(
+        self, scope: str, after_id: int = 0, limit: int | None = None
+    ) -> list[dict]:
+        """Returns embeddings of documents or answers, ordered by item id
+
+        Args:
+          scope: "documents" or "answers"
+          after_id: only return embeddings of items with an id greater than this
+          limit: maximum number of embeddings to return, all if None
+
+        Returns:
+          a list of dicts with the item id as "id" and the encoded "vector"
         """
         with self.conn as conn:
             cursor = conn.cursor()
             cursor = cursor.execute(
                 """
-                SELECT d.doc, a.answer, a.id, q.id
+                SELECT item_id, vector FROM Embeddings
+                WHERE scope = ? AND item_id > ?
+                ORDER BY item_id
+                LIMIT ?
+            """,
+                (scope, after_id, -1 if limit is None else limit),
+            )
+            return [{"id": item_id, "vector": vector} for item_id, vector in cursor]
+
+    def iter_embeddings(self, scope: str, after_id: int = 0, batch_size: int = 10_000):
+        """Iterates over the embeddings of documents or answers in pages, see `iter_documents`
+
+        Args:
+          scope: "documents" or "answers"
+          after_id: only yield embeddings of items with an id greater than this
+          batch_size: number of embeddings fetched per query
+
+        Yields:
+          dicts with the item id as "id" and the encoded "vector"
+        """
+        get_page = functools.partial(self.get_embeddings, scope)
+        yield from _iter_pages(get_page, after_id, batch_size)
+
+    def get_texts_without_embedding(self, scope: str, limit: int) -> list[dict]:
+        """Returns documents or answers that have no embedding yet, ordered by id
+
+        Args:
+          scope: "documents" or "answers"
+          limit: maximum number of items to return
+
+        Returns:
+          a list of dicts with "id" and "text"
+        """
+        table, column = _check_scope(scope, EMBEDDING_SCOPES)
+        with self.conn as conn:
+            cursor = conn.cursor()
+            cursor = cursor.execute(
+                f"""
+                SELECT t.id, {_text_sql(f"t.{column}")}
+                FROM {table} t
+                LEFT JOIN Embeddings e ON e.scope = ? AND e.item_id = t.id
+                WHERE e.id IS NULL
+                ORDER BY t.id
+                LIMIT ?
+            """,
+                (scope, limit),
+            )
+            return [{"id": item_id, "text": text} for item_id, text in cursor]
+
+    def get_pipeline_answers(
+        self,
+        question_id: int,
+        pending: bool = True,
+        after_id: int = 0,
+        limit: int | None = None,
+    ) -> list[dict]:
+        """Returns the answers to a question for the incremental topic pipeline, ordered by id
+
+        Args:
+          question_id: the id of the question
+          pending: only answers that are new or changed since they were last processed,
+            see `mark_pipeline_answers`, otherwise all answers
+          after_id: only return answers with an id greater than this
+          limit: maximum number of answers to return, all if None
+
+        Returns:
+          a list of dicts with "id", "doc_id", "text", "non_answer" (bool) and the
+          encoded "vector" of the answer, None if it has no embedding
+        """
+        pending_sql = "AND p.answer_id IS NULL" if pending else ""
+        with self.conn as conn:
+            cursor = conn.cursor()
+            cursor = cursor.execute(
+                f"""
+                SELECT a.id, a.doc_id, {_text_sql("a.answer")},
+                  {_non_answer_sql("a.answer", compressed=True)}, e.vector
                 FROM Answers a
-                LEFT JOIN Documents d ON a.doc_id = d.id
-                LEFT JOIN Questions q ON a.question_id = q.id
-            """
+                LEFT JOIN PipelineAnswers p ON p.answer_id = a.id
+                LEFT JOIN Embeddings e ON e.scope = 'answers' AND e.item_id = a.id
+                WHERE a.question_id = ? AND a.id > ? {pending_sql}
+                ORDER BY a.id
+                LIMIT ?
+            """,
+                (question_id, after_id, -1 if limit is None else limit),
             )
-            raw = cursor.fetchall()
-            keys = [
-                "doc",
-                "answer",
-                "id",
-                "question",
+            keys = ["id", "doc_id", "text", "non_answer", "vector"]
+            return [
+                {**dict(zip(keys, row)), "non_answer": bool(row[3])} for row in cursor
             ]
-            return [dict(zip(keys, row)) for row in raw]
+
+    def mark_pipeline_answers(
+        self, question_id: int, answers: list[tuple[int, int | None, float | None]]
+    ) -> None:
+        """Records answers as processed by the incremental topic pipeline
+
+        Args:
+          question_id: the id of the question of the answers
+          answers: tuples (answer_id, label, probability), label and probability
+            are None for non-answers
+
+        Returns:
+          None
+        """
+        with self.conn as conn:
+            cursor = conn.cursor()
+            cursor.executemany(
+                """
+                INSERT INTO PipelineAnswers (answer_id, question_id, label, probability)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (answer_id) DO UPDATE SET
+                  label = excluded.label, probability = excluded.probability
+                """,
+                [
+                    (answer_id, question_id, label, probability)
+                    for answer_id, label, probability in answers
+                ],
+            )
+
+    def count_pipeline_answers(self, question_id: int) -> int:
+        """Returns the number of answers to a question processed by the incremental topic pipeline"""
+        with self.conn as conn:
+            cursor = conn.cursor()
+            cursor = cursor.execute(
+                "SELECT COUNT(*) FROM PipelineAnswers WHERE question_id = ?",
+                (question_id,),
+            )
+            return cursor.fetchone()[0]
+
+    def get_texts(self, scope: str, ids: list[int]) -> dict[int, str]:
+        """Returns the texts of documents or answers by id
+
+        Args:
+          scope: "documents" or "answers"
+          ids: the ids of the items
+
+        Returns:
+          a mapping from ids to texts, missing items are left out
+        """
+        table, column = _check_scope(scope, EMBEDDING_SCOPES)
+        with self.conn as conn:
+            cursor = conn.cursor()
+            cursor = cursor.execute(
+                f"""
+                SELECT id, {_text_sql(column)} FROM {table}
+                WHERE id IN (SELECT value FROM json_each(?))
+            """,
+                (json.dumps([int(item_id) for item_id in ids]),),
+            )
+            return dict(cursor.fetchall())
+
+    def compress_texts(
+        self,
+        scope: str,
+        dict_size: int = TEXT_COMPRESSION_DICT_SIZE,
+        n_samples: int = TEXT_COMPRESSION_SAMPLES,
+        batch_size: int = 10_000,
+    ) -> dict:
+        """Compresses all documents or answers with a dictionary trained on them
+
+        Trains a zstd dictionary on `n_samples` random texts of the scope and makes it
+        the active dictionary of the scope, so texts inserted from then on are
+        compressed with it. Then the stored texts are rewritten in batches of
+        `batch_size`, each in its own transaction, so the database stays usable and
+        an interrupted run can be repeated. Running it again trains a new dictionary
+        and recompresses all texts, older dictionaries are kept to read texts that
+        other processes still compress with them. Freed pages are reused by later
+        inserts, VACUUM shrinks the file.
+
+        Requires the zstandard package, as does reading compressed texts. From the
+        first dictionary of a scope on, the triggers on its table decompress texts
+        with a function only `TextDB` provides, so other clients, e.g. the sqlite3
+        shell, can read the table but no longer write it.
+
+        Args:
+          scope: "documents" or "answers", see `TEXT_SCOPES`
+          dict_size: maximum size of the dictionary in bytes
+          n_samples: number of texts to train the dictionary on
+          batch_size: number of texts rewritten per transaction
+
+        Raises:
+          ValueError: if the scope is unknown or there are too few texts to train on
+
+        Returns:
+          a dict with the dict_id and the storage of the texts before and after,
+          see `get_text_storage`
+        """
+        table, column = _check_scope(scope, TEXT_SCOPES)
+        before = self.get_text_storage(scope)
+        cursor = self.conn.execute(
+            f"""
+            SELECT {_text_sql(column)} FROM {table}
+            WHERE id IN (SELECT id FROM {table} ORDER BY random() LIMIT ?)
+        """,
+            (n_samples,),
+        )
+        samples = [row[0] for row in cursor.fetchall()]
+        dict_id = self.conn.execute(
+            "SELECT COALESCE(MAX(dict_id), 0) + 1 FROM TextDictionaries"
+        ).fetchone()[0]
+        dictionary = train_dictionary(samples, dict_id, dict_size, self.codec.level)
+        with self.conn as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE TextDictionaries SET active = 0 WHERE scope = ?", (scope,)
+            )
+            cursor.execute(
+                "INSERT INTO TextDictionaries (dict_id, scope, dictionary) VALUES (?, ?, ?)",
+                (dict_id, scope, dictionary),
+            )
+            _sync_text_schema(conn)
+        _load_text_dictionaries(self.codec, self.conn)
+        self._rewrite_texts(scope, batch_size)
+        return {
+            "dict_id": dict_id,
+            "before": before,
+            "after": self.get_text_storage(scope),
+        }
+
+    def decompress_texts(self, scope: str, batch_size: int = 10_000) -> dict:
+        """Stores all documents or answers uncompressed again, see `compress_texts`
+
+        Args:
+          scope: "documents" or "answers"
+          batch_size: number of texts rewritten per transaction
+
+        Returns:
+          a dict with the storage of the texts before and after, see `get_text_storage`
+        """
+        _check_scope(scope, TEXT_SCOPES)
+        before = self.get_text_storage(scope)
+        with self.conn as conn:
+            conn.execute(
+                "UPDATE TextDictionaries SET active = 0 WHERE scope = ?", (scope,)
+            )
+        _load_text_dictionaries(self.codec, self.conn)
+        self._rewrite_texts(scope, batch_size)
+        return {"before": before, "after": self.get_text_storage(scope)}
+
+    def _rewrite_texts(self, scope: str, batch_size: int) -> None:
+        """Encodes all texts of a scope again with the active dictionary of the codec"""
+        table, column = TEXT_SCOPES[scope]
+        suspended = [(name,) for name in _TEXT_UPDATE_TRIGGERS[scope]]
+        after_id = 0
+        while True:
+            with self.conn as conn:
+                # IMMEDIATE takes the write lock, so no text changes between read and write
+                conn.execute("BEGIN IMMEDIATE")
+                rows = conn.execute(
+                    f"""
+                    SELECT id, {_text_sql(column)} FROM {table}
+                    WHERE id > ? ORDER BY id LIMIT ?
+                """,
+                    (after_id, batch_size),
+                ).fetchall()
+                if not rows:
+                    return
+                conn.executemany(
+                    "INSERT INTO SuspendedTriggers (name) VALUES (?)", suspended
+                )
+                conn.executemany(
+                    f"UPDATE {table} SET {column} = ? WHERE id = ?",
+                    [
+                        (self.codec.encode(scope, text), item_id)
+                        for item_id, text in rows
+                    ],
+                )
+                conn.executemany(
+                    "DELETE FROM SuspendedTriggers WHERE name = ?", suspended
+                )
+            after_id = rows[-1][0]
+
+    def get_text_storage(self, scope: str) -> dict:
+        """Returns how the documents or answers are stored
+
+        Args:
+          scope: "documents" or "answers"
+
+        Returns:
+          a dict with the number of texts n_texts, the number of compressed texts
+          n_compressed and the stored size of the texts in bytes stored_bytes
+        """
+        table, column = _check_scope(scope, TEXT_SCOPES)
+        with self.conn as conn:
+            cursor = conn.cursor()
+            cursor = cursor.execute(
+                f"""
+                SELECT COUNT(*), COALESCE(SUM(typeof({column}) = 'blob'), 0),
+                  COALESCE(SUM(length(CAST({column} AS BLOB))), 0)
+                FROM {table}
+            """
+            )
+            keys = ["n_texts", "n_compressed", "stored_bytes"]
+            return dict(zip(keys, cursor.fetchone()))
 
     def get_topics(self) -> list[str]:
         """Returns all topics from Topics as a list
@@ -333,9 +2233,66 @@ class TextDB:
         """
         with self.conn as conn:
             cursor = conn.cursor()
-            cursor = cursor.execute("SELECT * FROM Topics")
+            cursor = cursor.execute(
+                "SELECT id, external_id, topic_representation FROM Topics"
+            )
             return cursor.fetchall()
 
+    def get_topic_stats(self) -> list[dict]:
+        """Returns the summary statistics of all topics
+
+        Reads the TopicStats and TopicQuestionStats tables, which are maintained by
+        triggers, so the cost does not depend on the number of documents or answers.
+
+        Returns:
+          a list of dicts with topic_id (-1 for documents without topic), external_id,
+          topic_representation, n_documents and questions, a list of dicts with
+          question_id, n_answers, n_non_answers, non_answer_rate and exemplar_doc_id
+        """
+        with self.conn as conn:
+            cursor = conn.cursor()
+            topics = {}
+            for row in cursor.execute(
+                """
+                SELECT s.topic_id, t.external_id, t.topic_representation, s.n_documents
+                FROM TopicStats s
+                LEFT JOIN Topics t ON t.id = s.topic_id
+                ORDER BY s.topic_id
+            """
+            ):
+                keys = [
+                    "topic_id",
+                    "external_id",
+                    "topic_representation",
+                    "n_documents",
+                ]
+                topics[row[0]] = {**dict(zip(keys, row)), "questions": []}
+            for (
+                topic_id,
+                question_id,
+                n_answers,
+                n_non_answers,
+                exemplar,
+            ) in cursor.execute(
+                """
+                SELECT topic_id, question_id, n_answers, n_non_answers, exemplar_doc_id
+                FROM TopicQuestionStats
+                ORDER BY topic_id, question_id
+            """
+            ):
+                if topic_id not in topics:
+                    continue
+                topics[topic_id]["questions"].append(
+                    {
+                        "question_id": question_id,
+                        "n_answers": n_answers,
+                        "n_non_answers": n_non_answers,
+                        "non_answer_rate": n_non_answers / n_answers,
+                        "exemplar_doc_id": exemplar,
+                    }
+                )
+            return list(topics.values())
+
     def get_answers_by_doc(self, doc_id: int) -> list[tuple]:
         """Returns all answers for a given document
 
@@ -343,11 +2300,17 @@ class TextDB:
             doc_id: the id of the document
 
         Returns:
-            a list of answers as tuples (id, doc_id, question_id, answer, topic_id)
+            a list of answers as tuples (id, doc_id, question_id, answer)
         """
         with self.conn as conn:
             cursor = conn.cursor()
-            cursor = cursor.execute("SELECT * FROM Answers WHERE doc_id = ?", (doc_id,))
+            cursor = cursor.execute(
+                f"""
+                SELECT id, doc_id, question_id, {_text_sql("answer")} FROM Answers
+                WHERE doc_id = ?
+            """,
+                (doc_id,),
+            )
             return cursor.fetchall()
 
     def get_docs_with_answers(self) -> list[tuple]:
@@ -364,8 +2327,8 @@ class TextDB:
         with self.conn as conn:
             cursor = conn.cursor()
             cursor = cursor.execute(
-                """
-                SELECT d.id, d.doc, a.answer
+                f"""
+                SELECT d.id, {_text_sql("d.doc")}, {_text_sql("a.answer")}
                 FROM Documents d
                 LEFT JOIN Answers a ON d.id = a.doc_id
             """
@@ -384,10 +2347,304 @@ class TextDB:
         with self.conn as conn:
             cursor = conn.cursor()
             cursor = cursor.execute(
-                """
-                SELECT d.id, d.doc, a.answer, a.topic_id
+                f"""
+                SELECT d.id, {_text_sql("d.doc")}, {_text_sql("a.answer")}, d.topic_id
                 FROM Documents d
                 LEFT JOIN Answers a ON d.id = a.doc_id
             """
             )
             return cursor.fetchall()
+
+
+class AnswerWriter:
+    """Write-behind buffer for answers
+
+    Answers are collected in memory and written with `TextDB.insert_answers`, i.e. one
+    transaction per batch instead of one per answer. A batch is written as soon as it
+    holds `max_rows` answers, or by a background thread once its oldest answer is
+    `max_delay` seconds old. Call `flush` when a job is done and `close` on shutdown.
+
+    Answers violating a constraint, e.g. of a document deleted in the meantime, are
+    dropped without losing the rest of their batch. A batch that fails otherwise stays
+    buffered and is written by the next flush.
+    """
+
+    def __init__(
+        self,
+        db: TextDB,
+        max_rows: int = ANSWER_WRITER_MAX_ROWS,
+        max_delay: float = ANSWER_WRITER_MAX_DELAY,
+    ) -> None:
+        """Initializes the AnswerWriter class and starts the background flush thread
+
+        Args:
+          db: the database to write to
+          max_rows: number of buffered answers that triggers a write
+          max_delay: maximum number of seconds an answer is buffered
+
+        Returns:
+          None
+        """
+        assert max_rows > 0, "max_rows must be greater than 0"
+        assert max_delay > 0, "max_delay must be greater than 0"
+        self.db = db
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.batches_written = 0
+        self.write_seconds = 0.0
+        self._buffer = []
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._flush_periodically, daemon=True)
+        self._thread.start()
+
+    def __enter__(self) -> "AnswerWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def add(self, doc_id: int, question_id: int, answer: str) -> None:
+        """Buffers an answer
+
+        Args:
+          doc_id: the id of the document
+          question_id: the id of the question
+          answer: the answer to insert
+
+        Returns:
+          None
+        """
+        with self._lock:
+            if not self._buffer:
+                self._oldest = time.monotonic()
+            self._buffer.append((doc_id, question_id, answer))
+            is_full = len(self._buffer) >= self.max_rows
+        if is_full:
+            self.flush()
+
+    def flush(self) -> int:
+        """Writes all buffered answers
+
+        Returns:
+          the number of answers written
+
+        Raises:
+          sqlite3.Error: if the batch could not be written, it stays buffered
+        """
+        # the write lock keeps batches in the order they were buffered
+        with self._write_lock:
+            with self._lock:
+                batch, self._buffer = self._buffer, []
+                oldest = self._oldest
+            if not batch:
+                return 0
+            start = time.perf_counter()
+            try:
+                written = self._write(batch)
+            except BaseException:
+                # answers are upserted, so rewriting already written ones is harmless
+                with self._lock:
+                    self._buffer[:0] = batch
+                    self._oldest = oldest
+                raise
+            self.write_seconds += time.perf_counter() - start
+            self.rows_written += written
+            self.rows_dropped += len(batch) - written
+            self.batches_written += 1
+            return written
+
+    def _write(self, batch: list[tuple[int, int, str]]) -> int:
+        """Writes a batch, answers violating a constraint are dropped
+
+        Args:
+          batch: tuples (doc_id, question_id, answer)
+
+        Returns:
+          the number of answers written
+        """
+        try:
+            self.db.insert_answers(batch)
+            return len(batch)
+        except sqlite3.IntegrityError:
+            pass
+        # the transaction of the batch was rolled back, find the offending answers
+        written = 0
+        for doc_id, question_id, answer in batch:
+            try:
+                self.db.insert_answers([(doc_id, question_id, answer)])
+                written += 1
+            except sqlite3.IntegrityError as e:
+                logger.warning(
+                    "Dropped answer of document %s to question %s: %s",
+                    doc_id,
+                    question_id,
+                    e,
+                )
+        return written
+
+    def close(self) -> None:
+        """Stops the background thread and writes all buffered answers"""
+        self._closed.set()
+        self._thread.join()
+        self.flush()
+
+    def stats(self) -> dict:
+        """Returns the number of written answers and batches and the observed insert throughput
+
+        Returns:
+          a dict with rows_written, rows_dropped, batches_written, write_seconds and
+          rows_per_second
+        """
+        return {
+            "rows_written": self.rows_written,
+            "rows_dropped": self.rows_dropped,
+            "batches_written": self.batches_written,
+            "write_seconds": self.write_seconds,
+            "rows_per_second": self.rows_written / self.write_seconds
+            if self.write_seconds > 0
+            else None,
+        }
+
+    def _flush_periodically(self) -> None:
+        """Writes the buffer once its oldest answer exceeds `max_delay`"""
+        while not self._closed.wait(self.max_delay / 4):
+            with self._lock:
+                is_due = (
+                    self._buffer and time.monotonic() - self._oldest >= self.max_delay
+                )
+            if is_due:
+                try:
+                    self.flush()
+                except Exception:
+                    # the batch stays buffered, the thread must keep flushing
+                    logger.exception("Writing buffered answers failed")
+        self.db.release_connection()
+
+
+class AsyncTextDB:
+    """Awaitable access to a `TextDB` for async code
+
+    Every method of the wrapped `TextDB` is available as a coroutine function, e.g.
+    `await adb.get_document(1)`. The calls run on a pool of `workers` threads, so
+    they do not block the event loop, and every thread keeps its own connection.
+    """
+
+    def __init__(self, db: TextDB, workers: int = SQLITE_POOL_SIZE) -> None:
+        """Initializes the AsyncTextDB class
+
+        Args:
+          db: the database
+          workers: number of threads running database calls
+
+        Returns:
+          None
+        """
+        self.db = db
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="textdb"
+        )
+
+    def __getattr__(self, name: str):
+        method = getattr(self.db, name)
+        if not callable(method):
+            raise AttributeError(f"{name} is not a method of TextDB")
+
+        @functools.wraps(method)
+        async def call(*args, **kwargs):
+            return await self.run(method, *args, **kwargs)
+
+        return call
+
+    async def run(self, func, *args, **kwargs):
+        """Runs a function that uses the database on the database threads
+
+        The function runs in a copy of the current context, so its spans count towards
+        the timings of the request, see `tracing.begin_request`.
+
+        Args:
+          func: the function, e.g. a method of `AnswerWriter`
+          args, kwargs: the arguments of the function
+
+        Returns:
+          the return value of the function
+        """
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(context.run, func, *args, **kwargs)
+        )
+
+    def close(self) -> None:
+        """Waits for running calls and stops the threads"""
+        self._executor.shutdown(wait=True)
+
+
+def _allocate(k: int, sizes: list[int]) -> list[int]:
+    """Splits k in proportion to sizes with largest remainders, capped at the sizes
+
+    Args:
+      k: total to allocate
+      sizes: sizes of the strata
+
+    Returns:
+      the quota of every stratum
+    """
+    total = sum(sizes)
+    if total == 0:
+        return [0] * len(sizes)
+    k = min(k, total)
+    exact = [size * k / total for size in sizes]
+    quotas = [math.floor(share) for share in exact]
+    by_remainder = sorted(range(len(sizes)), key=lambda i: quotas[i] - exact[i])
+    for i in by_remainder[: k - sum(quotas)]:
+        quotas[i] += 1
+    return [min(quota, size) for quota, size in zip(quotas, sizes)]
+
+
+def _check_scope(scope: str, scopes: dict):
+    """Returns the entry of a scope, raises a ValueError if the scope is unknown"""
+    if scope not in scopes:
+        raise ValueError(f"Unknown scope: {scope}")
+    return scopes[scope]
+
+
+def _fts_query(query: str) -> str:
+    """Converts keywords to an FTS5 query that matches all of them literally
+
+    Args:
+      query: whitespace separated keywords, a trailing * marks a prefix
+
+    Returns:
+      the FTS5 query, empty if there are no keywords
+    """
+    terms = []
+    for term in query.split():
+        prefix = term.endswith("*") and len(term) > 1
+        term = term.rstrip("*")
+        if term:
+            terms.append('"' + term.replace('"', '""') + '"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+
+def _iter_pages(get_page, after_id: int, batch_size: int):
+    """Yields rows of a keyset-paginated getter page by page
+
+    Args:
+      get_page: a getter taking `after_id` and `limit` that returns dicts with an "id" key
+      after_id: id after which to start
+      batch_size: number of rows per page
+
+    Yields:
+      rows
+    """
+    while True:
+        page = get_page(after_id=after_id, limit=batch_size)
+        yield from page
+        if len(page) < batch_size:
+            return
+        after_id = page[-1]["id"]
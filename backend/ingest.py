@@ -0,0 +1,223 @@
+import io
+import json
+import time
+import uuid
+import pandas as pd
+from config import INGEST_BATCH_SIZE
+from db import TextDB
+
+# File extensions of the supported upload formats
+FORMATS = {
+    ".csv": "csv",
+    ".jsonl": "jsonl",
+    ".ndjson": "jsonl",
+    ".parquet": "parquet",
+}
+
+
+class IngestError(ValueError):
+    """Raised if an uploaded file cannot be read, e.g. it has no text column"""
+
+
+def detect_format(filename: str) -> str | None:
+    """Returns the upload format of a file name, None if it is not supported"""
+    for extension, file_format in FORMATS.items():
+        if filename.lower().endswith(extension):
+            return file_format
+    return None
+
+
+class DocumentIngest:
+    """Streams the documents of an uploaded file into the database
+
+    The file is read in chunks of `batch_size` rows, so memory use does not grow
+    with the file size. Every chunk is validated and inserted in its own
+    transaction with `TextDB.insert_unique_documents`, documents that are already
+    in the database or occur twice in the file are skipped. Rows without a
+    non-empty string in the text column are counted as invalid and skipped.
+    `progress` may be called from another thread while `run` is ingesting.
+    """
+
+    def __init__(
+        self,
+        db: TextDB,
+        batch_size: int = INGEST_BATCH_SIZE,
+        text_column: str = "text",
+    ) -> None:
+        """Initializes the DocumentIngest class
+
+        Args:
+            db (TextDB): the database to insert into
+            batch_size (int): number of rows per chunk and transaction
+            text_column (str): name of the column or JSON key holding the documents
+
+        Returns:
+            None
+        """
+        assert batch_size > 0, "batch_size must be greater than 0"
+        self.id = uuid.uuid4().hex
+        self.db = db
+        self.batch_size = batch_size
+        self.text_column = text_column
+        self.filename = None
+        self.status = "pending"
+        self.error = None
+        self.rows_read = 0
+        self.rows_inserted = 0
+        self.rows_invalid = 0
+        self.rows_duplicate = 0
+        self.bytes_read = 0
+        self.bytes_total = None
+        self.started_at = None
+        self.finished_at = None
+
+    def run(self, stream, file_format: str, filename: str | None = None) -> dict:
+        """Ingests all rows of a file
+
+        Args:
+            stream: binary file object, must be seekable for Parquet
+            file_format (str): "csv", "jsonl" or "parquet", see `detect_format`
+            filename (str, optional): name of the file, only used for reporting
+
+        Raises:
+            IngestError: if the file cannot be read, chunks ingested up to
+                then stay in the database. The ingest is failed on any other
+                error as well, which is raised unchanged
+
+        Returns:
+            dict: the final progress, see `progress`
+        """
+        readers = {
+            "csv": self._read_csv,
+            "jsonl": self._read_jsonl,
+            "parquet": self._read_parquet,
+        }
+        if file_format not in readers:
+            raise IngestError(f"Unsupported file format: {file_format}")
+
+        self.filename = filename
+        self.status = "running"
+        self.started_at = time.time()
+        self.bytes_total = _stream_size(stream)
+        try:
+            for texts in readers[file_format](stream):
+                docs = [
+                    text for text in texts if isinstance(text, str) and text.strip()
+                ]
+                inserted = self.db.insert_unique_documents(docs)
+                self.rows_read += len(texts)
+                self.rows_invalid += len(texts) - len(docs)
+                self.rows_inserted += inserted
+                self.rows_duplicate += len(docs) - inserted
+                self.bytes_read = _stream_position(stream, self.bytes_read)
+        except Exception as error:
+            # any error, e.g. of the database, or the ingest stays listed as running
+            self.status = "failed"
+            self.error = str(error)
+            raise
+        finally:
+            self.finished_at = time.time()
+        self.status = "done"
+        if self.bytes_total is not None:
+            self.bytes_read = self.bytes_total
+        return self.progress()
+
+    def progress(self) -> dict:
+        """Returns the state and row counts of the ingest
+
+        Returns:
+            dict: id, filename, status, error, rows_read, rows_inserted,
+                rows_invalid, rows_duplicate, bytes_read, bytes_total,
+                elapsed_seconds and rows_per_second
+        """
+        if self.started_at is None:
+            elapsed = 0.0
+        else:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+        return {
+            "id": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "error": self.error,
+            "rows_read": self.rows_read,
+            "rows_inserted": self.rows_inserted,
+            "rows_invalid": self.rows_invalid,
+            "rows_duplicate": self.rows_duplicate,
+            "bytes_read": self.bytes_read,
+            "bytes_total": self.bytes_total,
+            "elapsed_seconds": elapsed,
+            "rows_per_second": self.rows_read / elapsed if elapsed > 0 else None,
+        }
+
+    def _read_csv(self, stream):
+        """Yields the text column of a CSV file in chunks"""
+        try:
+            chunks = pd.read_csv(
+                stream,
+                sep=",",
+                usecols=[self.text_column],
+                dtype={self.text_column: str},
+                encoding="utf-8",
+                chunksize=self.batch_size,
+            )
+            for chunk in chunks:
+                yield chunk[self.text_column].to_list()
+        except ValueError as error:
+            raise IngestError(f"Invalid CSV file: {error}") from error
+
+    def _read_jsonl(self, stream):
+        """Yields the text field of the objects of a JSON lines file in chunks
+
+        Lines that are not valid JSON objects yield None and are counted as invalid.
+        """
+        texts = []
+        for line in stream:
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            texts.append(row.get(self.text_column) if isinstance(row, dict) else None)
+            if len(texts) == self.batch_size:
+                yield texts
+                texts = []
+        if texts:
+            yield texts
+
+    def _read_parquet(self, stream):
+        """Yields the text column of a Parquet file in chunks, requires pyarrow"""
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as error:
+            raise IngestError("Parquet uploads require pyarrow") from error
+
+        try:
+            parquet_file = pq.ParquetFile(stream)
+        except Exception as error:
+            raise IngestError(f"Invalid Parquet file: {error}") from error
+        if self.text_column not in parquet_file.schema_arrow.names:
+            raise IngestError(f"Parquet file has no column {self.text_column!r}")
+        for batch in parquet_file.iter_batches(
+            batch_size=self.batch_size, columns=[self.text_column]
+        ):
+            yield batch.column(0).to_pylist()
+
+
+def _stream_size(stream) -> int | None:
+    """Returns the size of a seekable stream in bytes, None if it is not seekable"""
+    try:
+        position = stream.tell()
+        size = stream.seek(0, io.SEEK_END)
+        stream.seek(position)
+        return size
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def _stream_position(stream, default: int) -> int:
+    """Returns the read position of a stream, `default` if it cannot be told"""
+    try:
+        return stream.tell()
+    except (AttributeError, OSError, ValueError):
+        return default
@@ -0,0 +1,362 @@
+import os
+import pickle
+import tempfile
+from typing import Callable
+import numpy as np
+from hdbscan import approximate_predict
+from sentence_transformers import SentenceTransformer
+from db import TextDB
+from topicmodel import TopicModel, topic_representations
+from tracing import span
+from vectorindex import from_blobs, to_blob
+from config import (
+    EMBEDDING_MODEL,
+    OPTUNA_STORAGE,
+    PIPELINE_BATCH_SIZE,
+    PIPELINE_DRIFT_TOLERANCE,
+    PIPELINE_MIN_DRIFT_ANSWERS,
+    PIPELINE_MODEL_DIR,
+    PIPELINE_REFIT_GROWTH,
+)
+
+# Bump STATE_VERSION whenever the stored state changes, older states are refit
+STATE_VERSION = 3
+# answers less similar to the nearest topic centroid than this quantile of the fitted
+# answers count as novel. UMAP transforms novel answers close to fitted ones, so
+# they are often assigned with a high probability
+NOVELTY_QUANTILE = 0.05
+
+
+class TopicPipeline:
+    """Incremental topic modelling of the answers to a question
+
+    The stage after question answering: non-answers are filtered, the answers are
+    embedded, labelled with topics and the topics written to their documents. The
+    database records which answers were processed, see `TextDB.get_pipeline_answers`,
+    so a run only embeds and labels answers that are new or changed since the last
+    run. They are assigned to the topics of the stored model, which is refit on all
+    answers once the assigned answers drift away from it, see `_drifted`.
+
+    Assigned answers are added to the c-TF-IDF counts of the topics, the counts of the
+    old text of a changed answer are only removed by the next refit.
+    """
+
+    def __init__(
+        self,
+        db: TextDB,
+        question_id: int,
+        topic_model_kwargs: dict,
+        embedding_model: SentenceTransformer | None = None,
+        model_dir: str = PIPELINE_MODEL_DIR,
+        batch_size: int = PIPELINE_BATCH_SIZE,
+        drift_tolerance: float = PIPELINE_DRIFT_TOLERANCE,
+        min_drift_answers: int = PIPELINE_MIN_DRIFT_ANSWERS,
+        refit_growth: float = PIPELINE_REFIT_GROWTH,
+        callbacks: list[Callable[[dict], None]] | None = None,
+    ) -> None:
+        """Initializes the TopicPipeline class
+
+        Args:
+            db (TextDB): the database with the answers
+            question_id (int): the question whose answers are processed
+            topic_model_kwargs (dict): arguments of `TopicModel` for refits, at least min_cluster and max_cluster, the storage defaults to OPTUNA_STORAGE
+            embedding_model (SentenceTransformer | None): embeds the answers, the EMBEDDING_MODEL if None
+            model_dir (str): directory the fitted model of the question is stored in
+            batch_size (int): answers embedded and assigned at once
+            drift_tolerance (float): refit once the share of assigned answers that fit the model poorly exceeds the share at the fit by this much, see `_poor_fit`
+            min_drift_answers (int): answers assigned since the fit before the share is compared
+            refit_growth (float): refit once this many times as many answers were assigned as fitted
+            callbacks (list[Callable[[dict], None]] | None): progress callbacks of the search of a refit, see `TopicModel.optimize_umap_hdbscan`
+
+        Returns:
+            None
+        """
+        assert batch_size > 0, "batch_size must be greater than 0"
+        assert refit_growth > 0, "refit_growth must be greater than 0"
+        self.db = db
+        self.question_id = question_id
+        self.topic_model_kwargs = {"storage": OPTUNA_STORAGE, **topic_model_kwargs}
+        if embedding_model is None:
+            embedding_model = SentenceTransformer(EMBEDDING_MODEL)
+        self.embedding_model = embedding_model
+        self.model_dir = model_dir
+        self.batch_size = batch_size
+        self.drift_tolerance = drift_tolerance
+        self.min_drift_answers = min_drift_answers
+        self.refit_growth = refit_growth
+        self.callbacks = callbacks
+
+    @property
+    def model_path(self) -> str:
+        return os.path.join(self.model_dir, f"question-{self.question_id}.pkl")
+
+    def _load_state(self) -> dict | None:
+        """Returns the stored model and drift counters, None if there is no usable one
+
+        A model is only usable if the database still knows the answers it
+        processed, e.g. not after the database was recreated.
+        """
+        if not os.path.exists(self.model_path):
+            return None
+        if self.db.count_pipeline_answers(self.question_id) == 0:
+            return None
+        with open(self.model_path, "rb") as f:
+            state = pickle.load(f)
+        if state.get("version") != STATE_VERSION:
+            return None
+        return state
+
+    def _save_state(self, state: dict) -> None:
+        """Stores the state atomically, an interrupted run keeps the previous one"""
+        os.makedirs(self.model_dir, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=self.model_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(path, self.model_path)
+        except BaseException:
+            os.remove(path)
+            raise
+
+    def _embed(self, answers: list[dict]) -> int:
+        """Embeds and stores the answers without an embedding, in place
+
+        Args:
+            answers (list[dict]): rows of `TextDB.get_pipeline_answers`
+
+        Returns:
+            int: the number of answers embedded
+        """
+        missing = [answer for answer in answers if answer["vector"] is None]
+        if not missing:
+            return 0
+        # normalized like the embeddings of POST /embeddings, which are reused
+        with span("embedding.encode"):
+            vectors = self.embedding_model.encode(
+                [answer["text"] for answer in missing], normalize_embeddings=True
+            )
+        for answer, vector in zip(missing, vectors):
+            answer["vector"] = to_blob(vector)
+        self.db.insert_embeddings(
+            "answers", [(answer["id"], answer["vector"]) for answer in missing]
+        )
+        return len(missing)
+
+    @staticmethod
+    def _poor_fit(state: dict, X: np.ndarray, probabilities: np.ndarray) -> np.ndarray:
+        """Flags answers that fit the model poorly
+
+        Args:
+            state (dict): the stored state, see `_refit`
+            X (np.ndarray): normalized embeddings of the answers
+            probabilities (np.ndarray): probabilities of their topics
+
+        Returns:
+            np.ndarray: `True` for answers assigned below the probability threshold of the topic model, or novel, see `NOVELTY_QUANTILE`
+        """
+        poor = probabilities < state["prob_threshold"]
+        if len(state["centroids"]) > 0:
+            similarity = (X @ state["centroids"].T).max(axis=1)
+            poor |= similarity < state["novelty_threshold"]
+        return poor
+
+    def _drifted(self, state: dict) -> bool:
+        """Checks whether the answers assigned since the fit call for a refit
+
+        Args:
+            state (dict): the stored state, see `_refit`
+
+        Returns:
+            bool: `True` if the model should be refit
+        """
+        if state["n_assigned"] >= self.refit_growth * state["n_fit"]:
+            return True
+        if state["n_assigned"] < self.min_drift_answers:
+            return False
+        poor_fit_rate = state["n_poor_fit"] / state["n_assigned"]
+        return poor_fit_rate > state["poor_fit_rate"] + self.drift_tolerance
+
+    def _write_labels(
+        self,
+        state: dict,
+        answers: list[dict],
+        labels: np.ndarray,
+        probabilities: np.ndarray,
+        coordinates: np.ndarray,
+    ) -> None:
+        """Writes the topics and topic map coordinates of the answers to their documents
+        and marks them processed"""
+        topic_ids = self.db.upsert_topics(state["topics"], question_id=self.question_id)
+        self.db.insert_topics_for_documents(
+            [
+                (answer["doc_id"], topic_ids.get(int(label)))
+                for answer, label in zip(answers, labels)
+            ]
+        )
+        self.db.insert_coordinates(
+            [
+                (answer["doc_id"], float(x), float(y))
+                for answer, (x, y) in zip(answers, coordinates)
+            ]
+        )
+        self.db.mark_pipeline_answers(
+            self.question_id,
+            [
+                (answer["id"], int(label), float(probability))
+                for answer, label, probability in zip(answers, labels, probabilities)
+            ],
+        )
+
+    def _refit(self) -> dict | None:
+        """Fits a new topic model on all answers to the question and labels them all
+
+        Topics of the question that the new model does not have are removed.
+
+        Returns:
+            dict | None: the new state with the models, the topics and the drift counters, None if there are no answers to fit, e.g. only non-answers
+        """
+        answers, after_id = [], 0
+        while batch := self.db.get_pipeline_answers(
+            self.question_id, pending=False, after_id=after_id, limit=self.batch_size
+        ):
+            after_id = batch[-1]["id"]
+            batch = [answer for answer in batch if not answer["non_answer"]]
+            self._embed(batch)
+            answers.extend(batch)
+        if not answers:
+            # the documents of the non-answers already lost their topics
+            self.db.remove_stale_topics(self.question_id, [])
+            return None
+
+        tm = TopicModel(embedding_model=self.embedding_model, **self.topic_model_kwargs)
+        tm.docs = [answer["text"] for answer in answers]
+        tm.embeddings = from_blobs([answer["vector"] for answer in answers])
+        for answer in answers:
+            # the texts and vectors are held by the topic model now
+            answer["text"] = answer["vector"] = None
+        tm.optimize_umap_hdbscan(callbacks=self.callbacks)
+        topics = tm.compute_topic_representations()
+        coordinates = tm._compute_2d_embeddings()
+
+        cluster = tm.best_model["cluster"]
+        if cluster._prediction_data is None:
+            # needed to assign new answers with approximate_predict
+            cluster.generate_prediction_data()
+        labels, probabilities = tm.get_labels(), tm.probabilities
+        # the embeddings are normalized, see `_embed`
+        centroids = np.array(
+            [tm.embeddings[labels == label].mean(axis=0) for label, _ in topics]
+        )
+        if len(centroids) > 0:
+            centroids /= np.linalg.norm(centroids, axis=1, keepdims=True)
+            similarity = (tm.embeddings @ centroids.T).max(axis=1)
+            novelty_threshold = float(np.quantile(similarity, NOVELTY_QUANTILE))
+        else:
+            novelty_threshold = None
+        state = {
+            "version": STATE_VERSION,
+            "umap": tm.best_model["umap"],
+            "umap2d": tm.umap2d,
+            "cluster": cluster,
+            "ctfidf": tm.ctfidf,
+            "topics": topics,
+            "prob_threshold": tm.prob_threshold,
+            "centroids": centroids,
+            "novelty_threshold": novelty_threshold,
+            "n_fit": len(answers),
+            "n_assigned": 0,
+            "n_poor_fit": 0,
+        }
+        state["poor_fit_rate"] = float(
+            np.mean(self._poor_fit(state, tm.embeddings, probabilities))
+        )
+        self._write_labels(state, answers, labels, probabilities, coordinates)
+        self.db.remove_stale_topics(self.question_id, [label for label, _ in topics])
+        return state
+
+    def run(self, refit: bool = False) -> dict:
+        """Processes the answers that are new or changed since the last run
+
+        Non-answers are marked as processed and their documents lose their topic and
+        are removed from the topic map. The other answers are embedded unless they
+        already have an embedding, assigned to the topics of the stored model and
+        placed on its topic map. If there is no stored model, `refit` is set or the
+        answers drifted, the model is refit on all answers instead and all documents
+        are labelled and placed again. Without answers to fit, e.g. if there are only
+        non-answers, there is no model and nothing is refit.
+
+        Args:
+            refit (bool): refit the model even if the answers did not drift
+
+        Returns:
+            dict: counts of the run, "processed" answers, "non_answers" among them,
+                "embedded" answers, answers "assigned" to the stored topics and
+                answers "fitted" by a refit, and whether the model was refit, "refit"
+        """
+        state = None if refit else self._load_state()
+        stats = {
+            "processed": 0,
+            "non_answers": 0,
+            "embedded": 0,
+            "assigned": 0,
+            "fitted": 0,
+        }
+        pending, pending_labels, pending_probabilities = [], [], []
+        pending_coordinates = []
+        after_id = 0
+        while batch := self.db.get_pipeline_answers(
+            self.question_id, pending=True, after_id=after_id, limit=self.batch_size
+        ):
+            after_id = batch[-1]["id"]
+            stats["processed"] += len(batch)
+            non_answers = [answer for answer in batch if answer["non_answer"]]
+            answers = [answer for answer in batch if not answer["non_answer"]]
+            stats["non_answers"] += len(non_answers)
+            self.db.insert_topics_for_documents(
+                [(answer["doc_id"], None) for answer in non_answers]
+            )
+            self.db.remove_coordinates([answer["doc_id"] for answer in non_answers])
+            self.db.mark_pipeline_answers(
+                self.question_id, [(answer["id"], None, None) for answer in non_answers]
+            )
+
+            stats["embedded"] += self._embed(answers)
+            if state is None or not answers:
+                continue
+            X = from_blobs([answer["vector"] for answer in answers])
+            with span("topicmodel.assign"):
+                labels, probabilities = approximate_predict(
+                    state["cluster"], state["umap"].transform(X)
+                )
+            with span("topicmodel.layout"):
+                coordinates = state["umap2d"].transform(X)
+            state["n_assigned"] += len(answers)
+            state["n_poor_fit"] += int(np.sum(self._poor_fit(state, X, probabilities)))
+            for answer in answers:
+                answer["vector"] = None
+            pending.extend(answers)
+            pending_labels.append(labels)
+            pending_probabilities.append(probabilities)
+            pending_coordinates.append(coordinates)
+
+        stats["refit"] = False
+        if state is None or self._drifted(state):
+            state = self._refit()
+            if state is not None:
+                self._save_state(state)
+                stats["refit"], stats["fitted"] = True, state["n_fit"]
+        elif pending:
+            labels = np.concatenate(pending_labels)
+            probabilities = np.concatenate(pending_probabilities)
+            state["ctfidf"].partial_fit([answer["text"] for answer in pending], labels)
+            state["topics"] = topic_representations(state["ctfidf"])
+            self._write_labels(
+                state,
+                pending,
+                labels,
+                probabilities,
+                np.concatenate(pending_coordinates),
+            )
+            self._save_state(state)
+            stats["assigned"] = len(pending)
+        return stats
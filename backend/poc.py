@@ -1,6 +1,6 @@
 from db import TextDB
 from qa import QAProcessor
-from topicmodel import TopicModel
+from pipeline import TopicPipeline
 import pandas as pd
 
 DEMO_FILE = "./20newsgroup_data_comp_20perCl.csv"
@@ -8,6 +8,15 @@ DEMO_DB = "./demo_20newsgroup_software_20perCl.sqlite3"
 EXEMPLARY_OUTPUT = "./docs_answers_lbls.csv"
 QUESTION = "What software problem is discussed?"
 
+
+def print_trial(record: dict) -> None:
+    print(
+        f"Trial {record['number']} {record['state']}: cost {record['cost']}, "
+        f"{record['ntopics']} topics, UMAP fit {record['umap_fit_s'] or 0:.1f}s, "
+        f"HDBSCAN fit {record['hdbscan_fit_s'] or 0:.1f}s, best cost {record['best_cost']}"
+    )
+
+
 if __name__ == "__main__":
     db = TextDB(DEMO_DB)
     
@@ -46,21 +55,25 @@ if __name__ == "__main__":
     else:
         print("Database already contains answers. Skipping question answering.")
 
-    # get answers from database
-    answers = db.get_answers()
-    answer_list = [answer for _, _, _, answer, _ in answers if "not found" not in answer.lower()]
-    doc_ids = [doc_id for _, doc_id, _, answer, _ in answers if "not found" not in answer.lower()]
-
-    print(f"Found {len(answer_list)} valid answers.")
-
-    print("Starting topic model...")
-    tm = TopicModel(answer_list, min_cluster=3, max_cluster=15, max_evals=20, seed=42423)
-    best_params = tm.optim()
-
-    lbls = tm.get_labels().tolist()
-
-    for doc_id, lbl in zip(doc_ids, lbls):
-        db.insert_topic_for_answer(doc_id, lbl)
+    print("Starting topic pipeline...")
+    pipeline = TopicPipeline(
+        db,
+        question_id,
+        topic_model_kwargs={
+            "min_cluster": 3,
+            "max_cluster": 15,
+            "max_evals": 20,
+            "seed": 42423,
+        },
+        callbacks=[print_trial],
+    )
+    stats = pipeline.run()
+    print(
+        f"Processed {stats['processed']} new or changed answers, "
+        f"{stats['non_answers']} without answer, {stats['embedded']} embedded, "
+        f"{stats['assigned']} assigned to existing topics"
+        + (f", refit on {stats['fitted']} answers." if stats["refit"] else ".")
+    )
 
     print(f"Dumping output to file {EXEMPLARY_OUTPUT}...")
     docs_answers_lbls = db.get_docs_with_answers_and_topic_ids()
@@ -0,0 +1,185 @@
+import numpy as np
+from config import POINT_GRID_LEVELS, POINTS_PER_CELL
+
+
+class PointGrid:
+    """Spatial grid index over the 2d document coordinates of the topic map
+
+    The bounding box of the points is split into a quadtree-like hierarchy of
+    regular grids, level `l` has 2**l x 2**l cells. Every point gets a random
+    priority and is visible from the coarsest level at which it is among the
+    `per_cell` highest-priority points of its cell. A query for a zoom level
+    therefore returns at most `per_cell` points per cell of that level and
+    zooming in only ever adds points. Points are stored sorted by their cell on
+    the finest level, so a viewport is resolved to one contiguous slice per
+    grid row.
+    """
+
+    def __init__(
+        self,
+        xy: np.ndarray,
+        doc_ids: np.ndarray,
+        topic_ids: np.ndarray,
+        levels: int = POINT_GRID_LEVELS,
+        per_cell: int = POINTS_PER_CELL,
+        seed: int = 42423,
+    ) -> None:
+        """Builds the grid index
+
+        Args:
+            xy (np.ndarray): coordinates of shape (n, 2)
+            doc_ids (np.ndarray): document ids of shape (n,)
+            topic_ids (np.ndarray): topic ids of shape (n,), -1 for documents without topic
+            levels (int): number of grid levels below the root cell
+            per_cell (int): maximum number of points per cell and zoom level
+            seed (int): random seed for the point priorities
+
+        Returns:
+            None
+        """
+        assert levels >= 0, "levels must be non-negative"
+        assert per_cell > 0, "per_cell must be greater than 0"
+
+        xy = np.asarray(xy, dtype=np.float32).reshape(-1, 2)
+        self.levels = levels
+        self.per_cell = per_cell
+        self.size = 2**levels
+        self.lower = xy.min(axis=0) if len(xy) else np.zeros(2, dtype=np.float32)
+        upper = xy.max(axis=0) if len(xy) else np.ones(2, dtype=np.float32)
+        self.upper = upper
+        self.extent = np.where(upper > self.lower, upper - self.lower, 1.0)
+
+        cells = self._cells(xy)
+        cell_ids = cells[:, 1] * self.size + cells[:, 0]
+
+        # sorting by priority first makes the stable sorts by cell keep that order
+        priority = np.random.default_rng(seed).permutation(len(xy))
+        order = np.argsort(priority)
+        order = order[np.argsort(cell_ids[order], kind="stable")]
+
+        self.xy = np.ascontiguousarray(xy[order])
+        self.doc_ids = np.asarray(doc_ids, dtype=np.int32)[order]
+        self.topic_ids = np.asarray(topic_ids, dtype=np.int32)[order]
+        cells = cells[order]
+        self.offsets = np.searchsorted(
+            cell_ids[order], np.arange(self.size * self.size + 1)
+        )
+
+        # level levels + 1 marks points that are only shown at full detail
+        self.visible_from = np.full(len(xy), levels + 1, dtype=np.uint8)
+        ranked_by_priority = np.argsort(priority[order])
+        for level in range(levels + 1):
+            shift = levels - level
+            coarse = (cells[:, 1] >> shift) * 2**level + (cells[:, 0] >> shift)
+            ranks = _rank_within_groups(coarse, ranked_by_priority)
+            newly_visible = (ranks < per_cell) & (self.visible_from > level)
+            self.visible_from[newly_visible] = level
+
+    def __len__(self) -> int:
+        return len(self.xy)
+
+    def _cells(self, xy: np.ndarray) -> np.ndarray:
+        """Cell coordinates of points on the finest level"""
+        cells = np.floor((xy - self.lower) / self.extent * self.size).astype(np.int64)
+        return np.clip(cells, 0, self.size - 1)
+
+    def query(
+        self,
+        x_min: float | None = None,
+        y_min: float | None = None,
+        x_max: float | None = None,
+        y_max: float | None = None,
+        zoom: int = 0,
+    ) -> np.ndarray:
+        """Returns the positions of the points to show in a viewport at a zoom level
+
+        Args:
+            x_min (float, optional): left edge of the viewport. Defaults to the bounds of all points.
+            y_min (float, optional): bottom edge of the viewport. Defaults to the bounds of all points.
+            x_max (float, optional): right edge of the viewport. Defaults to the bounds of all points.
+            y_max (float, optional): top edge of the viewport. Defaults to the bounds of all points.
+            zoom (int): zoom level, 0 shows the coarsest level, values above `levels` show all points
+
+        Returns:
+            np.ndarray: indices into `xy`, `doc_ids` and `topic_ids`
+        """
+        lower = np.array(
+            [
+                self.lower[0] if x_min is None else x_min,
+                self.lower[1] if y_min is None else y_min,
+            ],
+            dtype=np.float32,
+        )
+        upper = np.array(
+            [
+                self.upper[0] if x_max is None else x_max,
+                self.upper[1] if y_max is None else y_max,
+            ],
+            dtype=np.float32,
+        )
+        if len(self) == 0 or np.any(lower > upper):
+            return np.empty(0, dtype=np.int64)
+
+        (cx_min, cy_min), (cx_max, cy_max) = self._cells(np.stack([lower, upper]))
+        if cx_min == 0 and cx_max == self.size - 1:
+            # full-width viewports are a single slice
+            rows = [(cy_min, cy_max)]
+        else:
+            rows = [(cy, cy) for cy in range(cy_min, cy_max + 1)]
+        candidates = np.concatenate(
+            [
+                np.arange(
+                    self.offsets[first * self.size + cx_min],
+                    self.offsets[last * self.size + cx_max + 1],
+                )
+                for first, last in rows
+            ]
+        )
+
+        candidates = candidates[self.visible_from[candidates] <= zoom]
+
+        # cells on the border of the viewport are only partially inside
+        x, y = self.xy[candidates, 0], self.xy[candidates, 1]
+        keep = (x >= lower[0]) & (x <= upper[0]) & (y >= lower[1]) & (y <= upper[1])
+        return candidates[keep]
+
+    def pack(self, indices: np.ndarray) -> bytes:
+        """Packs points into a little-endian binary buffer
+
+        The buffer holds the float32 coordinates (x0, y0, x1, y1, ...), followed by
+        the int32 document ids and the int32 topic ids, -1 for documents without topic.
+
+        Args:
+            indices (np.ndarray): positions returned by `query`
+
+        Returns:
+            bytes: the packed points
+        """
+        return b"".join(
+            [
+                self.xy[indices].astype("<f4").tobytes(),
+                self.doc_ids[indices].astype("<i4").tobytes(),
+                self.topic_ids[indices].astype("<i4").tobytes(),
+            ]
+        )
+
+
+def _rank_within_groups(groups: np.ndarray, order: np.ndarray) -> np.ndarray:
+    """Ranks elements within their group, following a given order
+
+    Args:
+        groups (np.ndarray): group of each element
+        order (np.ndarray): permutation giving the order in which elements are ranked
+
+    Returns:
+        np.ndarray: rank of each element within its group, starting at 0
+    """
+    order = order[np.argsort(groups[order], kind="stable")]
+    sorted_groups = groups[order]
+    is_start = np.ones(len(order), dtype=bool)
+    is_start[1:] = sorted_groups[1:] != sorted_groups[:-1]
+    starts = np.flatnonzero(is_start)
+    positions = np.arange(len(order))
+    ranks = np.empty(len(order), dtype=np.int64)
+    ranks[order] = positions - starts[np.cumsum(is_start) - 1]
+    return ranks
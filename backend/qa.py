@@ -1,5 +1,7 @@
+import asyncio
 import os
 from config import (
+    LLM_MAX_CONCURRENCY,
     OPENAI_PARAMS,
     PROMPTS,
     EMBEDDING_MODEL,
@@ -9,6 +11,7 @@ from config import (
 from sentence_transformers import SentenceTransformer, util
 from langchain.chat_models import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
+from tracing import span
 
 
 OPENAI_KEY = os.getenv("OPENAI_KEY")
@@ -52,6 +55,8 @@ class QAProcessor:
         self.non_answers_embedded = self.embedding_model.encode(
             non_answer_examples, normalize_embeddings=True
         )
+        # bounds the LLM requests in flight of the async methods
+        self._llm_slots = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
 
     def _ask_question_to_txt(
         self, question: str, context: str, debug: bool = False
@@ -70,7 +75,8 @@ class QAProcessor:
 
         if debug:
             return context
-        response = self.llm(messages=msg)
+        with span("llm.chat"):
+            response = self.llm(messages=msg)
         return response.content
 
     def ask_question_to_texts(
@@ -88,6 +94,40 @@ class QAProcessor:
         #         answers_cleaned.append(answer)
         return answers
 
+    async def _aask_question_to_txt(
+        self, question: str, context: str, debug: bool = False
+    ) -> str:
+        """Async version of `_ask_question_to_txt`, waits for the LLM without a thread"""
+        msg = self.prompt_template.format_messages(question=question, context=context)
+
+        if debug:
+            return context
+        async with self._llm_slots:
+            with span("llm.chat"):
+                response = await self.llm.apredict_messages(msg)
+        return response.content
+
+    async def aask_question_to_texts(
+        self, question: str, texts: list[str], debug: bool = False
+    ) -> list[str]:
+        """Asks the LLM a question about every text concurrently
+
+        At most LLM_MAX_CONCURRENCY requests of all callers are in flight at once.
+
+        Args:
+            question (str): the question asked to the LLM
+            texts (list[str]): the contexts for the question
+            debug (bool, optional): returns the contexts without calling the LLM
+
+        Returns:
+            list[str]: the answers in the order of `texts`
+        """
+        return list(
+            await asyncio.gather(
+                *(self._aask_question_to_txt(question, text, debug) for text in texts)
+            )
+        )
+
     def check_non_answers(
         self,
         answers: list[str],
@@ -111,7 +151,10 @@ class QAProcessor:
             self.non_answer_token.lower() in answer.lower() for answer in answers
         ]
 
-        answer_embeds = self.embedding_model.encode(answers, normalize_embeddings=True)
+        with span("embedding.encode"):
+            answer_embeds = self.embedding_model.encode(
+                answers, normalize_embeddings=True
+            )
         scores = util.dot_score(self.non_answers_embedded, answer_embeds)
 
         # return highest score for each answer
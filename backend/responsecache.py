@@ -0,0 +1,126 @@
+import collections
+import hashlib
+import threading
+from config import RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_MAX_ENTRY_BYTES
+
+
+def make_etag(key, version) -> str:
+    """Returns an opaque entity tag for the response to a key at a version"""
+    return hashlib.blake2b(
+        repr((key, version)).encode("utf-8"), digest_size=16
+    ).hexdigest()
+
+
+class ResponseCache:
+    """Least recently used cache of response bodies, bounded by their total size
+
+    Every entry holds the version of the data it was rendered from, e.g. the
+    generations of the tables read by the endpoint, and is only served while the
+    version is unchanged. Outdated entries are replaced by the next `put` of their
+    key or evicted once the cache is full. The cache is shared by all request
+    threads.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+        max_entry_bytes: int = RESPONSE_CACHE_MAX_ENTRY_BYTES,
+    ) -> None:
+        """Initializes the ResponseCache class
+
+        Args:
+            max_bytes (int): maximum total size of the cached bodies in bytes
+            max_entry_bytes (int): larger bodies are not cached
+
+        Returns:
+            None
+        """
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        # key -> (version, body, headers), least recently used first
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key, version) -> tuple[bytes, dict] | None:
+        """Returns the cached body and headers of a key, None if missing or outdated"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[1], entry[2]
+
+    def put(self, key, version, body: bytes, headers: dict) -> bool:
+        """Caches a body, evicting least recently used entries if the cache is full
+
+        Args:
+            key: hashable key of the response, e.g. the URL
+            version: hashable version of the data the body was rendered from
+            body (bytes): the response body
+            headers (dict): headers to send along with the cached body
+
+        Returns:
+            bool: False if the body is too large to be cached
+        """
+        if len(body) > self.max_entry_bytes:
+            return False
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old[1])
+            self._entries[key] = (version, body, headers)
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                _, (_, evicted, _) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+                self._stats["evictions"] += 1
+        return True
+
+    def tee(self, key, version, chunks, headers: dict):
+        """Yields the chunks of a streamed body and caches it once it is complete
+
+        The body is not cached if the stream is not consumed to the end, e.g. if
+        the client disconnects, or if it grows larger than `max_entry_bytes`.
+        Closing the generator closes `chunks`.
+
+        Args:
+            key: hashable key of the response
+            version: hashable version of the data the body is rendered from
+            chunks: iterable of str (encoded as UTF-8) or bytes
+            headers (dict): headers to send along with the cached body
+
+        Yields:
+            bytes: the chunks
+        """
+        parts, size = [], 0
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode("utf-8")
+                if parts is not None:
+                    size += len(chunk)
+                    if size > self.max_entry_bytes:
+                        parts = None
+                    else:
+                        parts.append(chunk)
+                yield chunk
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+        if parts is not None:
+            self.put(key, version, b"".join(parts), headers)
+
+    def clear(self) -> None:
+        """Removes all entries"""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> dict:
+        """Returns the number of entries, their total size and hit, miss and eviction counts"""
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._size, **self._stats}
@@ -1,6 +1,12 @@
 #!/usr/bin/env bash
-if [ "$1" = "--clear" ]; then
-  rm instance/demo.sqlite
-fi
+for arg in "$@"; do
+  if [ "$arg" = "--clear" ]; then
+    rm instance/demo.sqlite
+  fi
+done
 
-.venv/bin/python -m flask --app api run
+if [[ " $* " == *" --async "* ]]; then
+  .venv/bin/python -m uvicorn --factory asgi:create_asgi_app --port 5000
+else
+  .venv/bin/python -m flask --app api run
+fi
@@ -1,7 +1,11 @@
+import gzip
+import json
 import unittest
+import struct
 from io import BytesIO
 from flask_testing import TestCase
 from db import TextDB
+import api
 from api import create_app
 
 
@@ -57,6 +61,37 @@ class FlaskTestCase(TestCase):
         # self.assertEqual(response.status_code, 400)
         self.assertEqual(response.json["error"], "Invalid file type")
 
+    def test_upload_jsonl_skips_duplicates(self):
+        tester = self.app.test_client(self)
+        data = {
+            "file": (
+                BytesIO(b'{"text": "Test data"}\n{"text": "Test data"}\n{"id": 3}\n'),
+                "test.jsonl",
+            )
+        }
+        response = tester.post(
+            "/documents", content_type="multipart/form-data", data=data
+        )
+        self.assert200(response)
+        self.assertEqual(response.json["rows_inserted"], 1)
+        self.assertEqual(response.json["rows_duplicate"], 1)
+        self.assertEqual(response.json["rows_invalid"], 1)
+        self.assertEqual(len(self.db.get_documents()), 1)
+
+        response = tester.get("/documents/ingests")
+        self.assert200(response)
+        self.assertEqual(response.json[0]["filename"], "test.jsonl")
+        self.assertEqual(response.json[0]["status"], "done")
+
+    def test_upload_csv_without_text_column(self):
+        tester = self.app.test_client(self)
+        data = {"file": (BytesIO(b"id,body\n1,Test data"), "test.csv")}
+        response = tester.post(
+            "/documents", content_type="multipart/form-data", data=data
+        )
+        self.assert400(response)
+        self.assertEqual(response.json["status"], "failed")
+
     def test_get_documents(self):
         tester = self.app.test_client(self)
         data = {
@@ -77,6 +112,206 @@ class FlaskTestCase(TestCase):
             ],
         )
 
+    def test_get_documents_paginated(self):
+        tester = self.app.test_client(self)
+        data = {
+            "file": (
+                BytesIO(b"id,text\n1,Test Document\n2,Test Document 2"),
+                "test.csv",
+            )
+        }
+        _ = tester.post("/documents", content_type="multipart/form-data", data=data)
+        response = tester.get("/documents?limit=1")
+        self.assert200(response)
+        self.assertEqual(
+            response.json, [{"id": 1, "text": "Test Document", "topic_id": None}]
+        )
+        after_id = response.headers["X-Next-After-Id"]
+
+        response = tester.get(f"/documents?limit=1&after_id={after_id}")
+        self.assertEqual(
+            response.json, [{"id": 2, "text": "Test Document 2", "topic_id": None}]
+        )
+        response = tester.get("/documents?limit=1&after_id=2")
+        self.assert200(response)
+        self.assertEqual(response.json, [])
+
+    def test_get_documents_limits(self):
+        tester = self.app.test_client(self)
+        data = {
+            "file": (
+                BytesIO(b"id,text\n1,Test Document\n2,Test Document 2"),
+                "test.csv",
+            )
+        }
+        _ = tester.post("/documents", content_type="multipart/form-data", data=data)
+        for limit in [0, -1]:
+            response = tester.get(f"/documents?limit={limit}")
+            self.assert400(response)
+
+        # pages are capped at the page size
+        page_size = api.LIST_PAGE_SIZE
+        api.LIST_PAGE_SIZE = 1
+        try:
+            response = tester.get("/documents?limit=100000000")
+        finally:
+            api.LIST_PAGE_SIZE = page_size
+        self.assertEqual([document["id"] for document in response.json], [1])
+        self.assertEqual(response.headers["X-Next-After-Id"], "1")
+
+        # a stream after the last row is empty
+        response = tester.get("/documents?after_id=2")
+        self.assert200(response)
+        self.assertEqual(response.json, [])
+        response = tester.get("/documents?after_id=2&format=ndjson")
+        self.assert200(response)
+        self.assertEqual(response.data, b"")
+
+    def test_get_documents_ndjson(self):
+        tester = self.app.test_client(self)
+        data = {
+            "file": (
+                BytesIO(b"id,text\n1,Test Document\n2,Test Document 2"),
+                "test.csv",
+            )
+        }
+        _ = tester.post("/documents", content_type="multipart/form-data", data=data)
+        response = tester.get("/documents", headers={"Accept": "application/x-ndjson"})
+        self.assert200(response)
+        lines = response.data.decode().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(json.loads(lines[1])["text"], "Test Document 2")
+
+    def test_get_documents_etag(self):
+        tester = self.app.test_client(self)
+        self.db.insert_documents(["Test Document", "Test Document 2"])
+        response = tester.get("/documents")
+        self.assert200(response)
+        etag = response.headers["ETag"]
+        self.assertEqual(response.headers["Cache-Control"], "no-cache")
+
+        # unchanged documents are not sent again, or sent from the cache
+        response = tester.get("/documents", headers={"If-None-Match": etag})
+        self.assertStatus(response, 304)
+        self.assertEqual(response.data, b"")
+        response = tester.get("/documents")
+        self.assertEqual(response.headers["ETag"], etag)
+        self.assertEqual(len(response.json), 2)
+
+        # other URLs have other tags, writes of any connection invalidate them
+        response = tester.get("/documents?limit=1", headers={"If-None-Match": etag})
+        self.assert200(response)
+        self.db.insert_document("Test Document 3")
+        response = tester.get("/documents", headers={"If-None-Match": etag})
+        self.assert200(response)
+        self.assertNotEqual(response.headers["ETag"], etag)
+        self.assertEqual(len(response.json), 3)
+
+    def test_get_documents_compressed(self):
+        tester = self.app.test_client(self)
+        self.db.insert_documents([f"Test Document {i}" for i in range(100)])
+        response = tester.get("/documents", headers={"Accept-Encoding": "gzip"})
+        self.assert200(response)
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response.headers["Vary"])
+        documents = json.loads(gzip.decompress(response.data))
+        self.assertEqual(len(documents), 100)
+
+        # the cached body is sent compressed as well, small bodies are not compressed
+        response = tester.get("/documents", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(json.loads(gzip.decompress(response.data)), documents)
+        response = tester.get("/documents/1", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(response.json[1], "Test Document 0")
+        response = tester.get("/documents", headers={"Accept-Encoding": "gzip;q=0"})
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(response.json, documents)
+
+    def test_metrics(self):
+        tester = self.app.test_client(self)
+        self.app.config["SERVER_TIMING"] = True
+        self.db.insert_documents(["Test Document"])
+        response = tester.get("/documents/1")
+        self.assert200(response)
+        self.assertRegex(
+            response.headers["Server-Timing"], r"^db;dur=[\d.]+, total;dur="
+        )
+
+        response = tester.get("/metrics")
+        self.assert200(response)
+        self.assertTrue(response.content_type.startswith("text/plain"))
+        metrics = response.data.decode()
+        self.assertIn('easytopics_span_seconds_count{span="db.get_document"}', metrics)
+        self.assertIn(
+            'easytopics_request_seconds_bucket{method="GET",'
+            'route="/documents/<int:doc_id>",status="200",le="+Inf"}',
+            metrics,
+        )
+        self.assertIn("easytopics_response_cache_misses_total", metrics)
+
+    def test_profiler(self):
+        tester = self.app.test_client(self)
+        response = tester.post("/profiler", json={"enabled": True, "reset": True})
+        self.assertTrue(response.json["running"])
+        try:
+            tester.get("/documents")
+        finally:
+            response = tester.post("/profiler", json={"enabled": False})
+        self.assertFalse(response.json["running"])
+        response = tester.get("/profiler")
+        self.assert200(response)
+
+    def test_search(self):
+        tester = self.app.test_client(self)
+        data = {
+            "file": (
+                BytesIO(b"id,text\n1,Test Document\n2,Another Document"),
+                "test.csv",
+            )
+        }
+        _ = tester.post("/documents", content_type="multipart/form-data", data=data)
+        response = tester.get("/search?q=document&limit=1")
+        self.assert200(response)
+        self.assertEqual(len(response.json), 1)
+        self.assertEqual(response.headers["X-Next-Offset"], "1")
+        response = tester.get("/search?q=another")
+        self.assertEqual(response.json[0]["snippet"], "<b>Another</b> Document")
+        self.assert400(tester.get("/search?q="))
+        self.assert400(tester.get("/search?q=test&scope=topics"))
+
+    def test_similar_documents(self):
+        tester = self.app.test_client(self)
+        data = {
+            "file": (
+                BytesIO(b"id,text\n1,Test Document\n2,Test Document 2\n3,Other"),
+                "test.csv",
+            )
+        }
+        _ = tester.post("/documents", content_type="multipart/form-data", data=data)
+        self.assert404(tester.get("/documents/1/similar"))
+
+        for batch_size in ["2", -1, 0, True]:
+            response = tester.post("/embeddings", json={"batch_size": batch_size})
+            self.assert400(response)
+        response = tester.post("/embeddings", json={"scope": "documents"})
+        self.assert200(response)
+        self.assertEqual(response.json["count"], 3)
+
+        response = tester.get("/documents/1/similar?k=5")
+        self.assert200(response)
+        self.assertEqual(sorted(hit["id"] for hit in response.json), [2, 3])
+        self.assertIn(response.json[0]["text"], ["Test Document 2", "Other"])
+
+        response = tester.get("/similar?q=document&k=1")
+        self.assert200(response)
+        self.assertEqual(len(response.json), 1)
+        self.assert400(tester.get("/similar?q=document&scope=topics"))
+
+    def test_get_documents_empty(self):
+        tester = self.app.test_client(self)
+        response = tester.get("/documents")
+        self.assert404(response)
+
     def test_get_document(self):
         tester = self.app.test_client(self)
         data = {
@@ -107,6 +342,53 @@ class FlaskTestCase(TestCase):
         self.assert200(response)
         self.assertEqual(self.db.get_document(doc_id), (1, "Test Document", 1))
 
+    def test_add_topics_to_documents(self):
+        tester = self.app.test_client(self)
+        data = {
+            "file": (
+                BytesIO(b"id,text\n1,Test Document\n2,Test Document 2"),
+                "test.csv",
+            )
+        }
+        _ = tester.post("/documents", content_type="multipart/form-data", data=data)
+        topic_ids = self.db.upsert_topics([(0, "Topic 0")])
+        response = tester.post(
+            "/documents/topics", json={"doc_topics": [[1, topic_ids[0]], [2, None]]}
+        )
+        self.assert200(response)
+        self.assertEqual(response.json["updated"], 1)
+        self.assertEqual(self.db.get_document(1), (1, "Test Document", topic_ids[0]))
+        self.assert404(tester.post("/documents/1/999"))
+        self.assert404(tester.post(f"/documents/99/{topic_ids[0]}"))
+
+        response = tester.get("/topics/stats")
+        self.assert200(response)
+        self.assertEqual(
+            [(topic["topic_id"], topic["n_documents"]) for topic in response.json],
+            [(-1, 1), (topic_ids[0], 1)],
+        )
+
+    def test_get_points(self):
+        tester = self.app.test_client(self)
+        data = {
+            "file": (
+                BytesIO(b"id,text\n1,Test Document\n2,Test Document 2"),
+                "test.csv",
+            )
+        }
+        _ = tester.post("/documents", content_type="multipart/form-data", data=data)
+        doc_ids = [doc["id"] for doc in self.db.get_documents()]
+        self.db.insert_coordinates([(doc_ids[0], 0.0, 1.0), (doc_ids[1], 2.0, 3.0)])
+
+        response = tester.get("/points?zoom=9")
+        self.assert200(response)
+        self.assertEqual(response.headers["X-Point-Count"], "2")
+        self.assertEqual(response.headers["X-Point-Bounds"], "0.0,1.0,2.0,3.0")
+        values = struct.unpack("<4f2i2i", response.data)
+        self.assertEqual(values[:4], (0.0, 1.0, 2.0, 3.0))
+        self.assertEqual(list(values[4:6]), doc_ids)
+        self.assertEqual(values[6:], (-1, -1))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,146 @@
+import asyncio
+import json
+import time
+import types
+import unittest
+from asgi import create_asgi_app
+from db import TextDB
+
+
+class FakeLLM:
+    """Stands in for the chat model, answers after `latency` seconds like a remote LLM"""
+
+    def __init__(self, latency: float) -> None:
+        self.latency = latency
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def apredict_messages(self, messages):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.latency)
+        self.in_flight -= 1
+        return types.SimpleNamespace(content="answer")
+
+
+async def request(app, method: str, path: str, body: dict | None = None):
+    """Sends a request to an ASGI app, returns the status code and the body"""
+    data = b"" if body is None else json.dumps(body).encode()
+    scope = {
+        "type": "http",
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [
+            (b"host", b"localhost"),
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(data)).encode()),
+        ],
+        "client": ("127.0.0.1", 12345),
+        "server": ("localhost", 80),
+    }
+    messages = [{"type": "http.request", "body": data, "more_body": False}]
+    disconnected = asyncio.Event()
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    status, chunks = None, []
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        else:
+            chunks.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    disconnected.set()
+    return status, b"".join(chunks)
+
+
+class TestAsyncApp(unittest.TestCase):
+    def setUp(self):
+        self.app = create_asgi_app(
+            {"TESTING": True, "DATABASE": "tests/testing.sqlite3"}
+        )
+        self.db = TextDB(self.app.flask_app.config["DATABASE"])
+        self.db.insert_documents([f"Test Document {i}" for i in range(10)])
+        self.llm = FakeLLM(latency=0.2)
+        self.app.question_answer.llm = self.llm
+
+    def tearDown(self):
+        self.db.remove_all_documents()
+        for question in self.db.get_questions():
+            self.db.remove_question(question["id"])
+        self.db.close_connection()
+
+    def test_concurrent_questions(self):
+        async def ask_all():
+            return await asyncio.gather(
+                *(
+                    request(
+                        self.app,
+                        "POST",
+                        "/ask_question",
+                        {"tryout": True, "question": f"Question {i}?", "k": 3},
+                    )
+                    for i in range(20)
+                )
+            )
+
+        start = time.perf_counter()
+        responses = asyncio.run(ask_all())
+        # 20 requests of 3 LLM calls each wait on the LLM at the same time
+        self.assertLess(time.perf_counter() - start, 2.0)
+        self.assertEqual(self.llm.max_in_flight, 60)
+        for status, body in responses:
+            self.assertEqual(status, 200)
+            documents = json.loads(body)
+            self.assertEqual(len(documents), 3)
+            self.assertEqual(documents[0]["answer"], "answer")
+        self.assertEqual(len(self.db.get_questions()), 20)
+        self.assertEqual(len(self.db.get_answers()), 60)
+
+    def test_invalid_question(self):
+        status, body = asyncio.run(
+            request(self.app, "POST", "/ask_question", {"tryout": True, "k": 3})
+        )
+        self.assertEqual(status, 400)
+        self.assertEqual(json.loads(body)["error"], "Missing parameter: question")
+
+    def test_invalid_k(self):
+        client = self.app.flask_app.test_client()
+        for k in ["2", -1, 0, 1.5, True]:
+            params = {"tryout": True, "question": "Question?", "k": k}
+            status, body = asyncio.run(
+                request(self.app, "POST", "/ask_question", params)
+            )
+            self.assertEqual(status, 400)
+            self.assertEqual(json.loads(body)["error"], "k must be a positive integer")
+            response = client.post("/ask_question", json=params)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json["error"], "k must be a positive integer")
+        self.assertEqual(self.llm.max_in_flight, 0)
+        self.assertEqual(self.db.get_questions(), [])
+
+    def test_flask_routes(self):
+        status, body = asyncio.run(request(self.app, "GET", "/documents"))
+        self.assertEqual(status, 200)
+        self.assertEqual(len(json.loads(body)), 10)
+        status, body = asyncio.run(
+            request(self.app, "POST", "/questions", {"question": "Question?"})
+        )
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)["message"], "Question added successfully")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import gzip
+import unittest
+from werkzeug.http import parse_accept_header
+from contentencoding import ENCODINGS, compress, compress_chunks, negotiate
+
+
+def decompress(body: bytes, encoding: str) -> bytes:
+    if encoding == "gzip":
+        return gzip.decompress(body)
+    if encoding == "zstd":
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompressobj().decompress(body)
+    import brotli
+
+    return brotli.decompress(body)
+
+
+class TestContentEncoding(unittest.TestCase):
+    def test_negotiate(self):
+        self.assertEqual(negotiate(parse_accept_header("gzip")), "gzip")
+        self.assertEqual(negotiate(parse_accept_header("*")), ENCODINGS[0])
+        self.assertEqual(negotiate(parse_accept_header("gzip;q=1, br;q=0.5")), "gzip")
+        self.assertIsNone(negotiate(parse_accept_header("identity")))
+        self.assertIsNone(negotiate(parse_accept_header("gzip;q=0")))
+        self.assertIsNone(negotiate(parse_accept_header("")))
+
+    def test_round_trip(self):
+        chunks = ['[{"id": 1}', "," + '{"id": 2, "text": "tëst"}' * 1000, "]"]
+        body = "".join(chunks).encode("utf-8")
+        for encoding in ENCODINGS:
+            compressed = compress(body, encoding)
+            self.assertLess(len(compressed), len(body))
+            self.assertEqual(decompress(compressed, encoding), body)
+            streamed = b"".join(compress_chunks(iter(chunks), encoding))
+            self.assertEqual(decompress(streamed, encoding), body)
+
+    def test_chunks_flushed(self):
+        # every chunk can be decoded as soon as it is received
+        chunks = compress_chunks(iter([b"first chunk", b"second chunk"]), "gzip")
+        decompressor = gzip.zlib.decompressobj(31)
+        self.assertEqual(decompressor.decompress(next(chunks)), b"first chunk")
+
+    def test_unsupported(self):
+        with self.assertRaises(ValueError):
+            compress(b"body", "deflate")
+
+
+if __name__ == "__main__":
+    unittest.main()
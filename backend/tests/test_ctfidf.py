@@ -0,0 +1,41 @@
+import unittest
+import numpy as np
+from ctfidf import ClassTfidf
+
+DOCS = [
+    "The cat sat on the mat",
+    "Cats purr and cats sleep",
+    "Dogs bark loudly at night",
+    "The dog chased a ball",
+    "Python code throws a bug",
+    "Compile error in the code",
+]
+LABELS = np.array([0, 0, 1, 1, 2, -1])
+
+
+class TestClassTfidf(unittest.TestCase):
+    def test_fit(self):
+        topic_words = ClassTfidf(top_n=3).fit(DOCS, LABELS).get_topic_words()
+        self.assertEqual(set(topic_words), {-1, 0, 1, 2})
+        self.assertEqual(topic_words[0][0][0], "cats")
+        self.assertTrue(all(len(words) <= 3 for words in topic_words.values()))
+        self.assertNotIn("the", [word for word, _ in topic_words[0]])
+
+    def test_partial_fit(self):
+        full = ClassTfidf().fit(DOCS, LABELS)
+        incremental = ClassTfidf().fit(DOCS[:3], LABELS[:3])
+        incremental.partial_fit(DOCS[3:], LABELS[3:])
+
+        full_words = full.get_topic_words()
+        incremental_words = incremental.get_topic_words()
+        self.assertEqual(full_words.keys(), incremental_words.keys())
+        for label, words in full_words.items():
+            self.assertEqual(sorted(words), sorted(incremental_words[label]))
+
+    def test_stop_words_only(self):
+        ctfidf = ClassTfidf().fit(["the and a", "of the"], np.array([0, 1]))
+        self.assertEqual(ctfidf.get_topic_words(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,12 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
 import unittest
-from db import TextDB
+from config import NON_ANSWER_TOKEN
+from db import MIGRATIONS, AnswerWriter, TextDB, _text_schema, document_hash
 
 
 class TestTextDB(unittest.TestCase):
@@ -46,6 +53,75 @@ class TestTextDB(unittest.TestCase):
         answer_id = self.db.insert_answer(doc_id, question_id, "Test Answer")
         self.assertIsNotNone(answer_id)
 
+    def test_insert_answers(self):
+        self.db = TextDB(":memory:")
+        self.db.insert_documents(["Test Document 1", "Test Document 2"])
+        question_id = self.db.insert_question("Test Question")
+        self.db.insert_answers(
+            [(1, question_id, "Answer 1"), (2, question_id, "Answer 2")]
+        )
+        self.assertEqual(len(self.db.get_answers()), 2)
+
+    def test_answer_writer(self):
+        self.db = TextDB(":memory:")
+        self.db.insert_documents([f"Test Document {i}" for i in range(1, 6)])
+        question_id = self.db.insert_question("Test Question")
+        writer = AnswerWriter(self.db, max_rows=2, max_delay=60)
+        for doc_id in range(1, 6):
+            writer.add(doc_id, question_id, f"Answer {doc_id}")
+        # two full batches are written, the last answer is still buffered
+        self.assertEqual(len(self.db.get_answers()), 4)
+        writer.close()
+        self.assertEqual(len(self.db.get_answers()), 5)
+        self.assertEqual(writer.stats()["batches_written"], 3)
+        self.assertGreater(writer.stats()["rows_per_second"], 0)
+
+    def test_answer_writer_max_delay(self):
+        self.db = TextDB(":memory:")
+        doc_id = self.db.insert_document("Test Document")
+        question_id = self.db.insert_question("Test Question")
+        with AnswerWriter(self.db, max_rows=100, max_delay=0.05) as writer:
+            writer.add(doc_id, question_id, "Test Answer")
+            time.sleep(0.5)
+            self.assertEqual(len(self.db.get_answers()), 1)
+
+    def test_answer_writer_bad_answer(self):
+        self.db = TextDB(":memory:")
+        doc_id = self.db.insert_document("Test Document")
+        question_id = self.db.insert_question("Test Question")
+        with AnswerWriter(self.db, max_rows=100, max_delay=0.05) as writer:
+            writer.add(doc_id, question_id, "Test Answer")
+            writer.add(999, question_id, "Answer of a missing document")
+            time.sleep(0.5)
+            self.assertEqual(
+                [answer["answer"] for answer in self.db.get_answers()], ["Test Answer"]
+            )
+            self.assertEqual(writer.stats()["rows_dropped"], 1)
+            # the background thread still writes answers on time
+            writer.add(doc_id, question_id, "New Answer")
+            time.sleep(0.5)
+            self.assertEqual(self.db.get_answers()[0]["answer"], "New Answer")
+        self.assertEqual(writer.stats()["rows_written"], 2)
+
+    def test_answer_writer_failed_batch(self):
+        self.db = TextDB(":memory:")
+        doc_id = self.db.insert_document("Test Document")
+        question_id = self.db.insert_question("Test Question")
+        writer = AnswerWriter(self.db, max_rows=100, max_delay=60)
+        writer.add(doc_id, question_id, "Test Answer")
+        insert_answers = self.db.insert_answers
+
+        def locked(answers):
+            raise sqlite3.OperationalError("database is locked")
+
+        self.db.insert_answers = locked
+        with self.assertRaises(sqlite3.OperationalError):
+            writer.flush()
+        # the batch is kept and written by the next flush
+        self.db.insert_answers = insert_answers
+        writer.close()
+        self.assertEqual(len(self.db.get_answers()), 1)
+
     def test_remove_answer(self):
         self.db = TextDB(":memory:")
         doc_id = self.db.insert_document("Test Document")
@@ -62,6 +138,22 @@ class TestTextDB(unittest.TestCase):
         documents = self.db.get_documents()
         self.assertEqual(len(documents), 2)
 
+    def test_get_documents_paginated(self):
+        self.db = TextDB(":memory:")
+        self.db.insert_documents([f"Test Document {i}" for i in range(1, 6)])
+        page = self.db.get_documents(after_id=2, limit=2)
+        self.assertEqual([doc["id"] for doc in page], [3, 4])
+        self.assertEqual(self.db.get_documents(after_id=5, limit=2), [])
+
+    def test_iter_documents(self):
+        self.db = TextDB(":memory:")
+        self.db.insert_documents([f"Test Document {i}" for i in range(1, 6)])
+        documents = list(self.db.iter_documents(batch_size=2))
+        self.assertEqual(documents, self.db.get_documents())
+        self.assertEqual(
+            [doc["id"] for doc in self.db.iter_documents(after_id=3)], [4, 5]
+        )
+
     def test_get_questions(self):
         self.db = TextDB(":memory:")
         self.db.insert_question("Test Question 1")
@@ -92,6 +184,677 @@ class TestTextDB(unittest.TestCase):
         answers = self.db.get_answers_by_doc(doc_id)
         self.assertIn((answer_id, doc_id, question_id, "Test Answer"), answers)
 
+    def test_upsert_topics(self):
+        self.db = TextDB(":memory:")
+        first = self.db.upsert_topics([(0, "cat, cats"), (1, "dog, dogs")])
+        second = self.db.upsert_topics([(1, "dog, bark"), (2, "code, bug")])
+        self.assertEqual(first[1], second[1])
+        self.assertEqual(
+            sorted(topic[1:] for topic in self.db.get_topics()),
+            [(0, "cat, cats"), (1, "dog, bark"), (2, "code, bug")],
+        )
+
+    def test_topics_per_question(self):
+        self.db = TextDB(":memory:")
+        first = self.db.insert_question("First Question")
+        second = self.db.insert_question("Second Question")
+        self.db.insert_documents(["Test Document 1", "Test Document 2"])
+        first_ids = self.db.upsert_topics([(0, "cat"), (1, "dog")], question_id=first)
+        second_ids = self.db.upsert_topics([(0, "code")], question_id=second)
+        self.assertNotEqual(first_ids[0], second_ids[0])
+        self.db.insert_topics_for_documents([(1, first_ids[1]), (2, second_ids[0])])
+
+        self.assertEqual(self.db.remove_stale_topics(first, [0, 1]), 0)
+        self.assertEqual(self.db.remove_stale_topics(first, [0]), 1)
+        self.assertEqual(
+            sorted(self.db.get_topics()),
+            [(first_ids[0], 0, "cat"), (second_ids[0], 0, "code")],
+        )
+        self.assertEqual(self.db.get_document(1)[2], None)
+        self.assertEqual(self.db.get_document(2)[2], second_ids[0])
+        self.assert_topic_stats()
+
+    def test_insert_topics_for_documents(self):
+        self.db = TextDB(":memory:")
+        self.db.insert_documents(["Test Document 1", "Test Document 2"])
+        topic_ids = self.db.upsert_topics([(0, "Test Topic")])
+        self.db.insert_topics_for_documents([(1, topic_ids[0]), (2, None)])
+        self.assertEqual(self.db.get_document(1), (1, "Test Document 1", topic_ids[0]))
+        self.assertEqual(self.db.get_document(2), (2, "Test Document 2", None))
+
+    def test_get_points(self):
+        self.db = TextDB(":memory:")
+        doc_id = self.db.insert_document("Test Document 1")
+        self.db.insert_document("Test Document 2")
+        topic_id = self.db.insert_topic(1, "Test Topic")
+        self.db.insert_topic_for_document(doc_id, topic_id)
+        self.db.insert_coordinates([(1, 0.5, 1.5), (2, -1.0, 2.0)])
+        self.assertEqual(
+            self.db.get_points(), [(1, 0.5, 1.5, topic_id), (2, -1.0, 2.0, -1)]
+        )
+        self.db.remove_coordinates([1])
+        self.assertEqual(self.db.get_points(), [(2, -1.0, 2.0, -1)])
+
+    def test_connection_per_thread(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self.db = TextDB(os.path.join(tmpdir, "test.sqlite3"))
+            journal_mode = self.db.conn.execute("PRAGMA journal_mode").fetchone()[0]
+            self.assertEqual(journal_mode, "wal")
+
+            connections = []
+            thread = threading.Thread(target=lambda: connections.append(self.db.conn))
+            thread.start()
+            thread.join()
+            self.assertIsNot(connections[0], self.db.conn)
+
+            # released connections are reused by the next thread
+            conn = self.db.conn
+            self.db.release_connection()
+            thread = threading.Thread(target=lambda: connections.append(self.db.conn))
+            thread.start()
+            thread.join()
+            self.assertIs(connections[1], conn)
+            self.db.close_connection()
+
+    def test_read_during_write_transaction(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self.db = TextDB(os.path.join(tmpdir, "test.sqlite3"))
+            self.db.insert_document("Test Document 1")
+            with self.db.conn as conn:
+                conn.execute("INSERT INTO Documents (doc) VALUES ('Test Document 2')")
+                documents = []
+                thread = threading.Thread(
+                    target=lambda: documents.extend(self.db.get_documents())
+                )
+                thread.start()
+                thread.join()
+            # the reader neither blocks nor sees the uncommitted document
+            self.assertEqual(len(documents), 1)
+            self.assertEqual(len(self.db.get_documents()), 2)
+            self.db.close_connection()
+
+    def test_migrations(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db_name = os.path.join(tmpdir, "test.sqlite3")
+            # unversioned schema with a duplicate answer and a duplicate document
+            conn = sqlite3.connect(db_name)
+            conn.executescript(
+                """
+                CREATE TABLE Topics (
+                  id INTEGER PRIMARY KEY,
+                  external_id INT NOT NULL,
+                  topic_representation TEXT NOT NULL
+                );
+                CREATE TABLE Documents (
+                  id INTEGER PRIMARY KEY,
+                  doc TEXT NOT NULL,
+                  topic_id INTEGER,
+                  FOREIGN KEY (topic_id) REFERENCES Topics(id)
+                );
+                CREATE TABLE Questions (id INTEGER PRIMARY KEY, question TEXT NOT NULL);
+                CREATE TABLE Answers (
+                  id INTEGER PRIMARY KEY,
+                  doc_id INTEGER NOT NULL,
+                  question_id INTEGER NOT NULL,
+                  answer TEXT NOT NULL
+                );
+                INSERT INTO Documents (doc) VALUES ('Test Document'), ('Test Document');
+                INSERT INTO Questions (question) VALUES ('Test Question');
+                INSERT INTO Answers (doc_id, question_id, answer)
+                  VALUES (1, 1, 'Old Answer'), (1, 1, 'New Answer');
+                """
+            )
+            conn.close()
+            doc_id, question_id = 1, 1
+
+            self.db = TextDB(db_name)
+            self.assertEqual(self.db.get_schema_version(), len(MIGRATIONS))
+            answers = self.db.get_answers_by_doc(doc_id)
+            self.assertEqual([answer[3] for answer in answers], ["New Answer"])
+            with self.assertRaises(sqlite3.IntegrityError):
+                self.db.insert_answer(doc_id, question_id, "Another Answer")
+            # only the first copy of the duplicated document is hashed
+            hashes = self.db.conn.execute("SELECT doc_hash FROM Documents ORDER BY id")
+            self.assertEqual(
+                [row[0] for row in hashes], [document_hash("Test Document"), None]
+            )
+            self.assert_topic_stats()
+            self.db.close_connection()
+
+            # migrating again is a no-op
+            self.db = TextDB(db_name)
+            self.assertEqual(self.db.get_schema_version(), len(MIGRATIONS))
+            self.db.close_connection()
+
+    def test_insert_unique_documents(self):
+        self.db = TextDB(":memory:")
+        inserted = self.db.insert_unique_documents(["Doc 1", "Doc 2", "Doc 1"])
+        self.assertEqual(inserted, 2)
+        inserted = self.db.insert_unique_documents(["Doc 2", "Doc 3"])
+        self.assertEqual(inserted, 1)
+        self.assertEqual(
+            [doc["text"] for doc in self.db.get_documents()],
+            ["Doc 1", "Doc 2", "Doc 3"],
+        )
+
+    def test_insert_answers_replaces(self):
+        self.db = TextDB(":memory:")
+        doc_id = self.db.insert_document("Test Document")
+        question_id = self.db.insert_question("Test Question")
+        self.db.insert_answers([(doc_id, question_id, "Old Answer")])
+        self.db.insert_answers([(doc_id, question_id, "New Answer")])
+        answers = self.db.get_answers_by_doc(doc_id)
+        self.assertEqual([answer[3] for answer in answers], ["New Answer"])
+
+    def test_get_docs_with_answers_and_topic_ids(self):
+        self.db = TextDB(":memory:")
+        doc_id = self.db.insert_document("Test Document")
+        question_id = self.db.insert_question("Test Question")
+        topic_id = self.db.insert_topic(1, "Test Topic")
+        self.db.insert_topic_for_document(doc_id, topic_id)
+        self.db.insert_answer(doc_id, question_id, "Test Answer")
+        self.assertEqual(
+            self.db.get_docs_with_answers_and_topic_ids(),
+            [(doc_id, "Test Document", "Test Answer", topic_id)],
+        )
+
+    def test_search_documents(self):
+        self.db = TextDB(":memory:")
+        self.db.insert_documents(
+            [
+                "The cat sat on the mat",
+                "A dog and a cat, the cat purred",
+                "Dogs bark at night",
+            ]
+        )
+        hits = self.db.search("cat")
+        self.assertEqual([hit["id"] for hit in hits], [2, 1])
+        self.assertIn("<b>cat</b>", hits[0]["snippet"])
+        self.assertEqual(hits[0]["topic_id"], None)
+        self.assertEqual(
+            [hit["id"] for hit in self.db.search("cat", limit=1, offset=1)], [1]
+        )
+        self.assertEqual(sorted(hit["id"] for hit in self.db.search("dog*")), [2, 3])
+        self.assertEqual(self.db.search("cat night"), [])
+        self.assertEqual(len(self.db.search("cat OR night", raw=True)), 3)
+        # only the most recent matches are ranked
+        self.assertEqual(
+            [hit["id"] for hit in self.db.search("cat", max_ranked=1)], [2]
+        )
+        self.assertEqual(
+            [hit["id"] for hit in self.db.search("the", max_ranked=1)], [2]
+        )
+        # keywords are literals unless raw is set
+        self.assertEqual(self.db.search('cat" OR'), [])
+        with self.assertRaises(ValueError):
+            self.db.search('cat" OR', raw=True)
+
+    def test_search_follows_writes(self):
+        self.db = TextDB(":memory:")
+        doc_id = self.db.insert_document("An old text")
+        question_id = self.db.insert_question("Test Question")
+        self.db.insert_answers([(doc_id, question_id, "First answer")])
+        self.db.insert_answers([(doc_id, question_id, "Second answer")])
+        hits = self.db.search("answer", scope="answers")
+        self.assertEqual(len(hits), 1)
+        self.assertEqual(hits[0]["snippet"], "Second <b>answer</b>")
+        self.assertEqual(
+            (hits[0]["doc_id"], hits[0]["question_id"]), (doc_id, question_id)
+        )
+
+        with self.db.conn as conn:
+            conn.execute(
+                "UPDATE Documents SET doc = 'A new text' WHERE id = ?", (doc_id,)
+            )
+        self.assertEqual(self.db.search("old"), [])
+        self.assertEqual(len(self.db.search("new")), 1)
+
+        self.db.remove_all_documents()
+        self.assertEqual(self.db.search("text"), [])
+        self.assertEqual(self.db.search("answer", scope="answers"), [])
+        with self.assertRaises(ValueError):
+            self.db.search("text", scope="topics")
+
+    def test_compress_texts(self):
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            self.skipTest("zstandard is not installed")
+        self.db = TextDB(":memory:")
+        words = ["price", "sound", "weight", "design", "battery", "cable", "support"]
+        docs = [
+            f"Subject: Re: ticket {i}\n\nThe {words[i % 7]} of the headphones is "
+            f"{'great' if i % 3 else 'poor'}, see order {i * 7919}.\n-- \nSent from my phone"
+            for i in range(500)
+        ]
+        self.db.insert_documents(docs)
+        question_id = self.db.insert_question("Test Question")
+        self.db.insert_answers(
+            [
+                (
+                    doc_id,
+                    question_id,
+                    NON_ANSWER_TOKEN if doc_id % 4 == 1 else f"The answer is {doc}",
+                )
+                for doc_id, doc in enumerate(docs, start=1)
+            ]
+        )
+        topic_id = self.db.insert_topic(0, "Topic 0")
+        self.db.insert_topics_for_documents(
+            [(doc_id, topic_id) for doc_id in range(1, 251)]
+        )
+
+        result = self.db.compress_texts("documents", dict_size=4096)
+        self.assertEqual(result["after"]["n_texts"], 500)
+        self.assertEqual(result["after"]["n_compressed"], 500)
+        self.assertLess(
+            result["after"]["stored_bytes"], result["before"]["stored_bytes"] / 2
+        )
+        result = self.db.compress_texts("answers", dict_size=4096)
+        # non-answers are too short to be compressed
+        self.assertEqual(result["after"]["n_compressed"], 375)
+
+        # texts are decompressed on read, new texts are compressed
+        self.assertEqual([doc["text"] for doc in self.db.get_documents()], docs)
+        self.assertEqual(self.db.get_document(2), (2, docs[1], topic_id))
+        doc_id = self.db.insert_document(docs[0] + " again")
+        self.assertEqual(self.db.get_text_storage("documents")["n_compressed"], 501)
+        self.assertEqual(
+            self.db.get_texts("documents", [doc_id]), {doc_id: docs[0] + " again"}
+        )
+        self.assertEqual(
+            self.db.get_answers_by_doc(2)[0][3], f"The answer is {docs[1]}"
+        )
+
+        # search, snippets and statistics see the decompressed texts
+        hits = self.db.search("battery", limit=200)
+        self.assertEqual(len(hits), 71)
+        self.assertIn("<b>battery</b>", hits[0]["snippet"])
+        self.assertEqual(
+            len(self.db.search("answer battery", scope="answers", limit=200)), 53
+        )
+        self.assert_topic_stats()
+        self.db.insert_answers(
+            [(2, question_id, NON_ANSWER_TOKEN), (1, question_id, "Yes")]
+        )
+        self.db.insert_topics_for_documents(
+            [(doc_id, topic_id) for doc_id in range(200, 300)]
+        )
+        self.assert_topic_stats()
+
+        # recompressing and decompressing keep the texts and the index
+        self.db.compress_texts("documents", dict_size=4096)
+        result = self.db.decompress_texts("documents")
+        self.assertEqual(result["after"]["n_compressed"], 0)
+        self.assertEqual(
+            result["after"]["stored_bytes"],
+            sum(len(doc["text"].encode("utf-8")) for doc in self.db.get_documents()),
+        )
+        self.assertEqual(self.db.get_documents()[-1]["text"], docs[0] + " again")
+        self.assertEqual(len(self.db.search("battery", limit=200)), 71)
+        self.assertEqual(self.db.search("again")[0]["id"], doc_id)
+        with self.assertRaises(ValueError):
+            self.db.compress_texts("topics")
+
+    def test_plain_sqlite_clients(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db_name = os.path.join(tmpdir, "test.sqlite3")
+            self.db = TextDB(db_name)
+            docs = [f"Document {i} about the {i % 7} headphones" for i in range(300)]
+            self.db.insert_documents(docs)
+            question_id = self.db.insert_question("Test Question")
+            # views and triggers left by an earlier version, which decompressed
+            # without a dictionary
+            with self.db.conn as conn:
+                for statement in _text_schema("documents", compressed=True):
+                    conn.execute(statement)
+            self.db.close_connection()
+
+            # clients without decompress_text can write uncompressed databases
+            self.db = TextDB(db_name)
+            self.db.close_connection()
+            conn = sqlite3.connect(db_name)
+            with conn:
+                conn.executemany(
+                    "INSERT INTO Answers (doc_id, question_id, answer) VALUES (?, ?, ?)",
+                    [
+                        (doc_id, question_id, f"The answer is {doc}")
+                        for doc_id, doc in enumerate(docs, start=1)
+                    ],
+                )
+                conn.execute("UPDATE Answers SET answer = 'Changed' WHERE id = 1")
+                conn.execute("INSERT INTO Documents (doc) VALUES ('Another document')")
+                conn.execute("DELETE FROM Documents WHERE id = 2")
+            texts = conn.execute("SELECT doc FROM DocumentsText WHERE id < 3")
+            self.assertEqual(texts.fetchall(), [(docs[0],)])
+            conn.close()
+
+            self.db = TextDB(db_name)
+            self.assertEqual(self.db.search("changed", scope="answers")[0]["id"], 1)
+            self.assertEqual(self.db.search("another")[0]["id"], 301)
+            self.assert_topic_stats()
+            try:
+                import zstandard  # noqa: F401
+            except ImportError:
+                self.skipTest("zstandard is not installed")
+            # once answers are compressed, only writes of documents do not need it
+            self.db.compress_texts("answers", dict_size=4096)
+            self.db.close_connection()
+            conn = sqlite3.connect(db_name)
+            with conn:
+                conn.execute("INSERT INTO Documents (doc) VALUES ('Third document')")
+            with self.assertRaisesRegex(sqlite3.OperationalError, "decompress_text"):
+                conn.execute("UPDATE Answers SET answer = 'Again' WHERE id = 1")
+            conn.close()
+
+            self.db = TextDB(db_name)
+            self.db.insert_answers([(1, question_id, "Changed again")])
+            self.assertEqual(self.db.search("again", scope="answers")[0]["id"], 1)
+            self.assertEqual(self.db.search("third")[0]["id"], 302)
+            self.assert_topic_stats()
+            self.db.close_connection()
+
+    def test_embeddings(self):
+        self.db = TextDB(":memory:")
+        self.db.insert_documents(["Test Document 1", "Test Document 2"])
+        self.db.insert_embeddings("documents", [(1, b"old"), (2, b"two")])
+        self.db.insert_embeddings("documents", [(1, b"one")])
+        self.assertEqual(self.db.get_embedding("documents", 1), b"one")
+        self.assertIsNone(self.db.get_embedding("answers", 1))
+        self.assertEqual(
+            list(self.db.iter_embeddings("documents", batch_size=1)),
+            [{"id": 1, "vector": b"one"}, {"id": 2, "vector": b"two"}],
+        )
+        self.assertEqual(self.db.get_texts("documents", [2, 3]), {2: "Test Document 2"})
+
+        with self.db.conn as conn:
+            conn.execute("DELETE FROM Documents WHERE id = 2")
+        self.assertEqual(
+            self.db.get_embeddings("documents"), [{"id": 1, "vector": b"one"}]
+        )
+        self.db.insert_document("Test Document 3")
+        self.assertEqual(
+            self.db.get_texts_without_embedding("documents", limit=10),
+            [{"id": 2, "text": "Test Document 3"}],
+        )
+        with self.assertRaises(ValueError):
+            self.db.insert_embeddings("topics", [(1, b"one")])
+
+    def test_pipeline_answers(self):
+        self.db = TextDB(":memory:")
+        self.db.insert_documents(
+            ["Test Document 1", "Test Document 2", "Test Document 3"]
+        )
+        question_id = self.db.insert_question("Test Question")
+        self.db.insert_answers(
+            [
+                (1, question_id, "Answer 1"),
+                (2, question_id, NON_ANSWER_TOKEN),
+                (3, question_id, "Answer 3"),
+            ]
+        )
+        self.db.insert_embeddings("answers", [(1, b"one"), (3, b"three")])
+        pending = self.db.get_pipeline_answers(question_id)
+        self.assertEqual(
+            pending[:2],
+            [
+                {
+                    "id": 1,
+                    "doc_id": 1,
+                    "text": "Answer 1",
+                    "non_answer": False,
+                    "vector": b"one",
+                },
+                {
+                    "id": 2,
+                    "doc_id": 2,
+                    "text": NON_ANSWER_TOKEN,
+                    "non_answer": True,
+                    "vector": None,
+                },
+            ],
+        )
+
+        self.db.mark_pipeline_answers(
+            question_id, [(1, 0, 0.9), (2, None, None), (3, 1, 0.8)]
+        )
+        self.assertEqual(self.db.get_pipeline_answers(question_id), [])
+        self.assertEqual(self.db.count_pipeline_answers(question_id), 3)
+        # the same answer again is no change
+        self.db.insert_answers([(1, question_id, "Answer 1")])
+        self.assertEqual(self.db.get_pipeline_answers(question_id), [])
+
+        # a changed answer is pending again and its embedding is dropped
+        self.db.insert_answers([(3, question_id, "Changed Answer 3")])
+        pending = self.db.get_pipeline_answers(question_id)
+        self.assertEqual([(row["id"], row["vector"]) for row in pending], [(3, None)])
+        self.assertEqual(
+            len(self.db.get_pipeline_answers(question_id, pending=False, limit=2)), 2
+        )
+        self.db.remove_answer(3)
+        self.assertEqual(self.db.count_pipeline_answers(question_id), 2)
+
+    def test_get_json_rows(self):
+        self.db = TextDB(":memory:")
+        self.db.insert_documents(['Test "Document" 1', "Tëst Document 2\n"])
+        question_id = self.db.insert_question("Test Question")
+        self.db.insert_answer(2, question_id, "Test Answer")
+        for name in ["documents", "questions", "answers"]:
+            objects, count, last_id = self.db.get_json_rows(name)
+            rows = self.db.get_list(name)
+            self.assertEqual(json.loads("[" + objects + "]"), rows)
+            self.assertEqual((count, last_id), (len(rows), rows[-1]["id"]))
+
+        objects, count, last_id = self.db.get_json_rows(
+            "documents", after_id=1, limit=1, separator="\n"
+        )
+        self.assertEqual(json.loads(objects)["text"], "Tëst Document 2\n")
+        self.assertEqual((count, last_id), (1, 2))
+        self.assertEqual(self.db.get_json_rows("documents", after_id=2), ("", 0, None))
+        pages = list(self.db.iter_json_rows("documents", batch_size=1, separator="\n"))
+        self.assertEqual([json.loads(page)["id"] for page in pages], [1, 2])
+
+    def test_generations(self):
+        self.db = TextDB(":memory:")
+        before = self.db.get_generations()
+        self.assertEqual(
+            list(self.db.get_generations(["Answers", "Documents"])),
+            ["Answers", "Documents"],
+        )
+        self.db.insert_documents(["Test Document 1", "Test Document 2"])
+        question_id = self.db.insert_question("Test Question")
+        self.db.insert_answer(1, question_id, "Test Answer")
+        self.db.insert_embeddings("documents", [(1, b"one")])
+        after = self.db.get_generations()
+        self.assertGreater(after["Documents"], before["Documents"])
+        self.assertGreater(after["Questions"], before["Questions"])
+        self.assertGreater(after["Answers"], before["Answers"])
+        self.assertGreater(after["Embeddings"], before["Embeddings"])
+        self.assertEqual(after["Topics"], before["Topics"])
+        self.assertEqual(after["Coordinates"], before["Coordinates"])
+
+        # cascaded deletes bump the generations of the referencing tables too
+        self.db.remove_question(question_id)
+        generations = self.db.get_generations()
+        self.assertGreater(generations["Answers"], after["Answers"])
+        self.assertEqual(generations["Documents"], after["Documents"])
+
+    def test_sample_documents(self):
+        self.db = TextDB(":memory:")
+        self.assertEqual(self.db.sample_documents(3), [])
+        self.db.insert_documents([f"Test Document {i}" for i in range(1, 21)])
+        sample = self.db.sample_documents(5, seed=1)
+        self.assertEqual(len({doc["id"] for doc in sample}), 5)
+        self.assertEqual(sample, self.db.sample_documents(5, seed=1))
+        self.assertEqual(len(self.db.sample_documents(50)), 20)
+        self.assertEqual(self.db.sample_documents(0), [])
+        with self.assertRaises(ValueError):
+            self.db.sample_documents(5, stratify="answered")
+        with self.assertRaises(ValueError):
+            self.db.sample_documents(5, stratify="length")
+
+    def test_sample_documents_large_range(self):
+        self.db = TextDB(":memory:")
+        self.db.insert_documents([f"Test Document {i}" for i in range(1, 30_001)])
+        topic_ids = self.db.upsert_topics([(0, "Topic 0"), (1, "Topic 1")])
+        # sparse ids: only every 10th document is kept, a tenth of them in topic 1
+        with self.db.conn as conn:
+            conn.execute("DELETE FROM Documents WHERE id % 10 != 0")
+        self.db.insert_topics_for_documents(
+            [
+                (doc_id, topic_ids[int(doc_id % 100 == 0)])
+                for doc_id in range(10, 30_001, 10)
+            ]
+        )
+        question_id = self.db.insert_question("Test Question")
+        self.db.insert_answers(
+            [(doc_id, question_id, "Answer") for doc_id in range(10, 6_001, 10)]
+        )
+
+        sample = self.db.sample_documents(10, seed=0)
+        self.assertEqual(len({doc["id"] for doc in sample}), 10)
+        self.assertTrue(all(doc["id"] % 10 == 0 for doc in sample))
+        for stratify in [None, "topic"]:
+            plans = self.query_plans(self.db.sample_documents, 10, stratify)
+            self.assertLess(len(plans), 10)
+            for plan in plans:
+                self.assertNotIn("SCAN d", plan)
+
+        sample = self.db.sample_documents(10, stratify="topic", seed=0)
+        topics = [doc["topic_id"] for doc in sample]
+        self.assertEqual(topics.count(topic_ids[1]), 1)
+        self.assertEqual(topics.count(topic_ids[0]), 9)
+
+        sample = self.db.sample_documents(
+            10, stratify="answered", question_id=question_id, seed=0
+        )
+        answered = [doc["id"] <= 6_000 for doc in sample]
+        self.assertEqual(answered.count(True), 2)
+        self.assertEqual(len({doc["id"] for doc in sample}), 10)
+
+    def assert_topic_stats(self):
+        """Compares the maintained topic statistics with aggregates over the raw tables"""
+        stats = self.db.get_topic_stats()
+        cursor = self.db.conn.cursor()
+        expected = cursor.execute(
+            "SELECT COALESCE(topic_id, -1), COUNT(*) FROM Documents GROUP BY 1 ORDER BY 1"
+        ).fetchall()
+        self.assertEqual([(s["topic_id"], s["n_documents"]) for s in stats], expected)
+
+        expected = cursor.execute(
+            f"""
+            SELECT COALESCE(d.topic_id, -1), a.question_id, COUNT(*),
+              SUM(instr(lower(decompress_text(a.answer)), lower('{NON_ANSWER_TOKEN}')) > 0)
+            FROM Answers a JOIN Documents d ON d.id = a.doc_id
+            GROUP BY 1, 2 ORDER BY 1, 2
+            """
+        ).fetchall()
+        questions = [(s["topic_id"], q) for s in stats for q in s["questions"]]
+        self.assertEqual(
+            [
+                (topic_id, q["question_id"], q["n_answers"], q["n_non_answers"])
+                for topic_id, q in questions
+            ],
+            expected,
+        )
+        for topic_id, q in questions:
+            exemplars = cursor.execute(
+                f"""
+                SELECT d.id FROM Documents d JOIN Answers a ON a.doc_id = d.id
+                WHERE COALESCE(d.topic_id, -1) = ? AND a.question_id = ?
+                  AND instr(lower(decompress_text(a.answer)), lower('{NON_ANSWER_TOKEN}')) = 0
+                """,
+                (topic_id, q["question_id"]),
+            ).fetchall()
+            if exemplars:
+                self.assertIn((q["exemplar_doc_id"],), exemplars)
+            else:
+                self.assertIsNone(q["exemplar_doc_id"])
+
+    def test_topic_stats(self):
+        self.db = TextDB(":memory:")
+        self.db.insert_documents([f"Test Document {i}" for i in range(1, 9)])
+        topic_ids = self.db.upsert_topics([(0, "Topic 0"), (1, "Topic 1")])
+        questions = [self.db.insert_question(f"Question {i}") for i in range(2)]
+        self.assert_topic_stats()
+
+        self.db.insert_answers(
+            [
+                (doc_id, question_id, NON_ANSWER_TOKEN if doc_id % 3 == 0 else "Answer")
+                for doc_id in range(1, 9)
+                for question_id in questions
+            ]
+        )
+        self.assert_topic_stats()
+
+        updated = self.db.insert_topics_for_documents(
+            [(doc_id, topic_ids[doc_id % 2]) for doc_id in range(1, 9)]
+        )
+        self.assertEqual(updated, 8)
+        self.assert_topic_stats()
+        self.assertEqual(self.db.insert_topics_for_documents([(1, topic_ids[1])]), 0)
+
+        # move the exemplars around one by one and in bulk
+        stats = self.db.get_topic_stats()
+        exemplar = stats[0]["questions"][0]["exemplar_doc_id"]
+        self.assertTrue(self.db.insert_topic_for_document(exemplar, topic_ids[0]))
+        self.assert_topic_stats()
+        self.assertFalse(self.db.insert_topic_for_document(100, topic_ids[0]))
+        self.db.insert_topics_for_documents([(2, None), (4, None), (5, topic_ids[0])])
+        self.assert_topic_stats()
+
+        # answers that become non-answers and the other way round
+        self.db.insert_answers(
+            [(1, questions[0], NON_ANSWER_TOKEN), (3, questions[0], "A")]
+        )
+        self.assert_topic_stats()
+
+        self.db.remove_answer(self.db.get_answers_by_doc(5)[0][0])
+        self.assert_topic_stats()
+        with self.db.conn as conn:
+            conn.execute("DELETE FROM Documents WHERE id IN (1, 2)")
+        self.assert_topic_stats()
+        self.db.remove_question(questions[1])
+        self.assert_topic_stats()
+        self.db.remove_all_documents()
+        self.assertEqual(self.db.get_topic_stats(), [])
+
+    def query_plans(self, method, *args) -> list[str]:
+        """Runs a TextDB method and returns the query plans of its SELECT statements"""
+        statements = []
+        self.db.conn.set_trace_callback(statements.append)
+        method(*args)
+        self.db.conn.set_trace_callback(None)
+        return [
+            "\n".join(
+                row[3]
+                for row in self.db.conn.execute(f"EXPLAIN QUERY PLAN {statement}")
+            )
+            for statement in statements
+            if statement.lstrip().upper().startswith("SELECT")
+        ]
+
+    def test_query_plan_documents_without_answer(self):
+        self.db = TextDB(":memory:")
+        (plan,) = self.query_plans(self.db.get_documents_without_answer, 1)
+        self.assertIn("USING COVERING INDEX idx_answers_question_doc", plan)
+        self.assertNotIn("SCAN a", plan)
+
+    def test_query_plan_answers_by_doc(self):
+        self.db = TextDB(":memory:")
+        (plan,) = self.query_plans(self.db.get_answers_by_doc, 1)
+        self.assertIn("USING INDEX idx_answers_doc", plan)
+
+    def test_query_plan_documents_by_topic(self):
+        self.db = TextDB(":memory:")
+        plan = "\n".join(
+            row[3]
+            for row in self.db.conn.execute(
+                "EXPLAIN QUERY PLAN SELECT id FROM Documents WHERE topic_id = 1"
+            )
+        )
+        self.assertIn("USING COVERING INDEX idx_documents_topic", plan)
+
     def tear_down(self):
         self.db = TextDB(":memory:")
         del self.db
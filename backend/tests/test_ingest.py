@@ -0,0 +1,93 @@
+import unittest
+from io import BytesIO
+from db import TextDB
+from ingest import DocumentIngest, IngestError, detect_format
+
+
+class BrokenStream(BytesIO):
+    """An upload whose connection breaks while it is read"""
+
+    def read(self, *args):
+        raise OSError("connection reset")
+
+    def readline(self, *args):
+        raise OSError("connection reset")
+
+    def __iter__(self):
+        raise OSError("connection reset")
+
+
+class TestDocumentIngest(unittest.TestCase):
+    def setUp(self):
+        self.db = TextDB(":memory:")
+
+    def texts(self) -> list[str]:
+        return [doc["text"] for doc in self.db.get_documents()]
+
+    def test_detect_format(self):
+        self.assertEqual(detect_format("docs.CSV"), "csv")
+        self.assertEqual(detect_format("docs.ndjson"), "jsonl")
+        self.assertEqual(detect_format("docs.parquet"), "parquet")
+        self.assertIsNone(detect_format("docs.txt"))
+
+    def test_csv_in_batches(self):
+        rows = "".join(f"{i},Document {i}\n" for i in range(25))
+        ingest = DocumentIngest(self.db, batch_size=10)
+        progress = ingest.run(BytesIO(f"id,text\n{rows}".encode()), "csv")
+        self.assertEqual(progress["status"], "done")
+        self.assertEqual(progress["rows_read"], 25)
+        self.assertEqual(progress["rows_inserted"], 25)
+        self.assertEqual(progress["bytes_read"], progress["bytes_total"])
+        self.assertEqual(self.texts(), [f"Document {i}" for i in range(25)])
+
+    def test_jsonl_skips_invalid_and_duplicate_rows(self):
+        self.db.insert_unique_documents(["Known"])
+        lines = [
+            '{"text": "First"}',
+            "not json",
+            '{"title": "no text"}',
+            '{"text": "   "}',
+            '{"text": "First"}',
+            '{"text": "Known"}',
+            "",
+            '{"text": "Second"}',
+        ]
+        ingest = DocumentIngest(self.db, batch_size=3)
+        progress = ingest.run(BytesIO("\n".join(lines).encode()), "jsonl")
+        self.assertEqual(progress["rows_read"], 7)
+        self.assertEqual(progress["rows_invalid"], 3)
+        self.assertEqual(progress["rows_duplicate"], 2)
+        self.assertEqual(progress["rows_inserted"], 2)
+        self.assertEqual(self.texts(), ["Known", "First", "Second"])
+
+    def test_csv_without_text_column(self):
+        ingest = DocumentIngest(self.db)
+        with self.assertRaises(IngestError):
+            ingest.run(BytesIO(b"id,body\n1,Document"), "csv")
+        self.assertEqual(ingest.progress()["status"], "failed")
+        self.assertEqual(self.texts(), [])
+
+    def test_read_error(self):
+        ingest = DocumentIngest(self.db)
+        with self.assertRaises(OSError):
+            ingest.run(BrokenStream(b'{"text": "Document"}\n'), "jsonl")
+        progress = ingest.progress()
+        self.assertEqual(progress["status"], "failed")
+        self.assertEqual(progress["error"], "connection reset")
+
+    def test_parquet(self):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            self.skipTest("pyarrow is not installed")
+        buffer = BytesIO()
+        pq.write_table(pa.table({"text": ["Document 1", None, "Document 2"]}), buffer)
+        buffer.seek(0)
+        progress = DocumentIngest(self.db, batch_size=2).run(buffer, "parquet")
+        self.assertEqual(progress["rows_invalid"], 1)
+        self.assertEqual(self.texts(), ["Document 1", "Document 2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,242 @@
+import hashlib
+import os
+import tempfile
+import unittest
+import numpy as np
+from config import NON_ANSWER_TOKEN
+from api import create_app
+from db import TextDB
+from pipeline import TopicPipeline
+
+
+class ClusterEncoder:
+    """Embeds an answer "cluster<k> ..." close to the k-th of a few random directions"""
+
+    def __init__(self, dims: int = 16) -> None:
+        self.dims = dims
+        self.centers = np.random.default_rng(0).normal(scale=5, size=(10, dims))
+        self.encoded = 0
+
+    def encode(self, texts: list[str], normalize_embeddings: bool = False):
+        self.encoded += len(texts)
+        vectors = []
+        for text in texts:
+            cluster = int(text.split()[0].removeprefix("cluster"))
+            seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:4], "little")
+            noise = np.random.default_rng(seed).normal(scale=0.3, size=self.dims)
+            vectors.append(self.centers[cluster] + noise)
+        vectors = np.array(vectors, dtype=np.float32)
+        if normalize_embeddings:
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors
+
+
+class TestTopicPipeline(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        # a file, so the API can open the database in test_topic_map
+        self.db_path = os.path.join(self.tmpdir.name, "test.sqlite3")
+        self.db = TextDB(self.db_path)
+        self.question_id = self.db.insert_question("What is the post about?")
+        self.encoder = ClusterEncoder()
+        self.n_answers = 0
+
+    def tearDown(self):
+        self.db.close_connection()
+        self.tmpdir.cleanup()
+
+    def add_answers(self, clusters: list[int]) -> list[int]:
+        doc_ids = []
+        for cluster in clusters:
+            self.n_answers += 1
+            doc_id = self.db.insert_document(f"Post {self.n_answers}")
+            if cluster < 0:
+                answer = NON_ANSWER_TOKEN
+            else:
+                answer = f"cluster{cluster} topic{cluster}words answer{self.n_answers}"
+            self.db.insert_answer(doc_id, self.question_id, answer)
+            doc_ids.append(doc_id)
+        return doc_ids
+
+    def make_pipeline(self, **kwargs) -> TopicPipeline:
+        return TopicPipeline(
+            self.db,
+            self.question_id,
+            topic_model_kwargs={
+                "min_cluster": 2,
+                "max_cluster": 8,
+                "max_evals": 2,
+                "storage": None,
+            },
+            embedding_model=self.encoder,
+            model_dir=self.tmpdir.name,
+            batch_size=50,
+            **kwargs,
+        )
+
+    def topic_of(self, doc_id: int) -> int | None:
+        return self.db.get_document(doc_id)[2]
+
+    def test_incremental_runs(self):
+        doc_ids = self.add_answers([cluster for cluster in range(3) for _ in range(50)])
+        non_answer_ids = self.add_answers([-1] * 5)
+
+        stats = self.make_pipeline().run()
+        self.assertEqual(
+            stats,
+            {
+                "processed": 155,
+                "non_answers": 5,
+                "embedded": 150,
+                "assigned": 0,
+                "fitted": 150,
+                "refit": True,
+            },
+        )
+        topics = [self.topic_of(doc_id) for doc_id in doc_ids]
+        self.assertEqual(len(set(topics)), 3)
+        self.assertTrue(all(self.topic_of(doc_id) is None for doc_id in non_answer_ids))
+
+        # nothing changed, nothing to do
+        stats = self.make_pipeline().run()
+        self.assertEqual(stats["processed"], 0)
+        self.assertFalse(stats["refit"])
+        self.assertEqual(self.encoder.encoded, 150)
+
+        # new answers are assigned to the stored topics
+        new_doc_ids = self.add_answers([0, 1, 2])
+        stats = self.make_pipeline().run()
+        self.assertEqual((stats["processed"], stats["assigned"]), (3, 3))
+        self.assertFalse(stats["refit"])
+        self.assertEqual(self.encoder.encoded, 153)
+        self.assertEqual(
+            [self.topic_of(doc_id) for doc_id in new_doc_ids],
+            [topics[0], topics[50], topics[100]],
+        )
+
+        # a changed answer is processed again
+        self.db.insert_answers(
+            [(doc_ids[0], self.question_id, "cluster1 topic1words changed")]
+        )
+        stats = self.make_pipeline().run()
+        self.assertEqual((stats["processed"], stats["embedded"]), (1, 1))
+        self.assertEqual(self.topic_of(doc_ids[0]), topics[50])
+
+        # answers unlike the fitted ones drift and trigger a refit
+        drifted_doc_ids = self.add_answers([7] * 30)
+        stats = self.make_pipeline().run()
+        self.assertTrue(stats["refit"])
+        self.assertEqual(stats["fitted"], 183)
+        drifted_topics = {self.topic_of(doc_id) for doc_id in drifted_doc_ids}
+        self.assertEqual(len(drifted_topics), 1)
+        self.assertNotIn(
+            drifted_topics.pop(), {self.topic_of(doc_id) for doc_id in doc_ids[1:]}
+        )
+
+    def test_refit_growth(self):
+        self.add_answers([cluster for cluster in range(3) for _ in range(20)])
+        pipeline = self.make_pipeline(refit_growth=0.1)
+        self.assertTrue(pipeline.run()["refit"])
+        self.add_answers([0, 1, 2])
+        self.assertFalse(pipeline.run()["refit"])
+        self.add_answers([0, 1, 2])
+        self.assertTrue(pipeline.run()["refit"])
+
+    def test_only_non_answers(self):
+        self.add_answers([-1] * 3)
+        stats = self.make_pipeline().run()
+        self.assertEqual(
+            stats,
+            {
+                "processed": 3,
+                "non_answers": 3,
+                "embedded": 0,
+                "assigned": 0,
+                "fitted": 0,
+                "refit": False,
+            },
+        )
+        self.assertFalse(self.make_pipeline().run(refit=True)["refit"])
+
+        self.add_answers([cluster for cluster in range(3) for _ in range(20)])
+        stats = self.make_pipeline().run()
+        self.assertEqual((stats["processed"], stats["fitted"]), (60, 60))
+        self.assertTrue(stats["refit"])
+
+    def test_topics_per_question(self):
+        first_doc_ids = self.add_answers(
+            [cluster for cluster in range(3) for _ in range(20)]
+        )
+        self.make_pipeline().run()
+        first_topics = [self.topic_of(doc_id) for doc_id in first_doc_ids]
+
+        # the labels of the topics of another question do not replace these topics
+        first_question_id = self.question_id
+        self.question_id = self.db.insert_question("Who wrote the post?")
+        second_doc_ids = self.add_answers(
+            [cluster for cluster in range(3, 5) for _ in range(20)]
+        )
+        self.make_pipeline().run()
+        second_topics = {self.topic_of(doc_id) for doc_id in second_doc_ids}
+        self.assertEqual(
+            [self.topic_of(doc_id) for doc_id in first_doc_ids], first_topics
+        )
+        self.assertFalse(second_topics & set(first_topics))
+        self.assertEqual(len(self.db.get_topics()), 5)
+
+        # a refit removes the topics that no longer exist
+        self.db.insert_answers(
+            [
+                (doc_id, self.question_id, f"cluster3 topic3words changed{doc_id}")
+                for doc_id in second_doc_ids[20:]
+            ]
+        )
+        self.make_pipeline().run(refit=True)
+        second_topics = {self.topic_of(doc_id) for doc_id in second_doc_ids}
+        self.assertEqual(
+            sorted(topic[0] for topic in self.db.get_topics()),
+            sorted((set(first_topics) | second_topics) - {None}),
+        )
+
+        # without answers to fit, no topics are left
+        self.db.insert_answers(
+            [(doc_id, self.question_id, NON_ANSWER_TOKEN) for doc_id in second_doc_ids]
+        )
+        self.assertFalse(self.make_pipeline().run(refit=True)["refit"])
+        self.assertEqual(
+            sorted(topic[0] for topic in self.db.get_topics()),
+            sorted(set(first_topics)),
+        )
+        self.question_id = first_question_id
+        self.assertEqual(
+            [self.topic_of(doc_id) for doc_id in first_doc_ids], first_topics
+        )
+
+    def test_topic_map(self):
+        client = create_app({"TESTING": True, "DATABASE": self.db_path}).test_client()
+        self.assertEqual(client.get("/points").status_code, 404)
+
+        doc_ids = self.add_answers([cluster for cluster in range(3) for _ in range(20)])
+        self.add_answers([-1] * 2)
+        self.make_pipeline().run()
+        response = client.get("/points?zoom=9")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["X-Point-Count"], "60")
+        n = len(response.data) // 16
+        ids = np.frombuffer(response.data, dtype="<i4", count=n, offset=8 * n)
+        topic_ids = np.frombuffer(response.data, dtype="<i4", offset=12 * n)
+        self.assertEqual(sorted(ids), doc_ids)
+        self.assertTrue(np.all(topic_ids != -1))
+
+        # assigned answers are placed on the map, answers turned non-answers removed
+        new_doc_ids = self.add_answers([0, 1, 2])
+        self.db.insert_answers([(doc_ids[0], self.question_id, NON_ANSWER_TOKEN)])
+        self.assertEqual(self.make_pipeline().run()["assigned"], 3)
+        response = client.get("/points?zoom=9")
+        n = len(response.data) // 16
+        ids = np.frombuffer(response.data, dtype="<i4", count=n, offset=8 * n)
+        self.assertEqual(sorted(ids), doc_ids[1:] + new_doc_ids)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+import numpy as np
+from pointcloud import PointGrid
+
+
+class TestPointGrid(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.xy = rng.normal(size=(5000, 2)).astype(np.float32)
+        self.doc_ids = np.arange(1, 5001)
+        self.topic_ids = rng.integers(-1, 10, size=5000)
+        self.grid = PointGrid(
+            self.xy, self.doc_ids, self.topic_ids, levels=4, per_cell=8
+        )
+
+    def test_full_detail(self):
+        indices = self.grid.query(zoom=5)
+        self.assertEqual(len(indices), 5000)
+        self.assertEqual(set(self.grid.doc_ids[indices]), set(self.doc_ids))
+
+    def test_level_of_detail(self):
+        coarsest = self.grid.query(zoom=0)
+        self.assertEqual(len(coarsest), 8)
+        previous = set()
+        for zoom in range(6):
+            visible = set(self.grid.query(zoom=zoom).tolist())
+            self.assertTrue(previous <= visible)
+            previous = visible
+
+    def test_viewport(self):
+        indices = self.grid.query(-0.5, -0.25, 0.5, 0.25, zoom=5)
+        inside = (
+            (np.abs(self.xy[:, 0]) <= 0.5) & (np.abs(self.xy[:, 1]) <= 0.25)
+        ).sum()
+        self.assertEqual(len(indices), inside)
+        self.assertTrue(np.all(np.abs(self.grid.xy[indices, 0]) <= 0.5))
+        self.assertEqual(len(self.grid.query(1.0, 1.0, 0.0, 0.0)), 0)
+
+    def test_pack(self):
+        indices = self.grid.query(zoom=1)
+        buffer = self.grid.pack(indices)
+        n = len(indices)
+        self.assertEqual(len(buffer), n * 16)
+        xy = np.frombuffer(buffer, dtype="<f4", count=2 * n).reshape(n, 2)
+        doc_ids = np.frombuffer(buffer, dtype="<i4", count=n, offset=8 * n)
+        topic_ids = np.frombuffer(buffer, dtype="<i4", count=n, offset=12 * n)
+        np.testing.assert_array_equal(xy, self.xy[doc_ids - 1])
+        np.testing.assert_array_equal(topic_ids, self.topic_ids[doc_ids - 1])
+
+    def test_empty(self):
+        grid = PointGrid(np.empty((0, 2)), np.empty(0), np.empty(0))
+        self.assertEqual(len(grid), 0)
+        self.assertEqual(len(grid.query()), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,3 +1,221 @@
+import os
+import tempfile
 import unittest
+import weakref
+import numpy as np
+from sklearn.datasets import make_blobs
+from topicmodel import TopicModel
 
-##from topicmodel import TopicModel
+
+def make_embeddings(n_samples: int = 300, random_state: int = 0) -> np.ndarray:
+    X, _ = make_blobs(
+        n_samples=n_samples, n_features=16, centers=5, random_state=random_state
+    )
+    return X.astype(np.float32)
+
+
+class RowEncoder:
+    """Embeds a document "<row> ..." as the row of precomputed embeddings"""
+
+    def __init__(self, embeddings: np.ndarray) -> None:
+        self.embeddings = embeddings
+
+    def encode(self, docs: list[str]) -> np.ndarray:
+        return self.embeddings[[int(doc.split()[0]) for doc in docs]]
+
+
+class TestTopicModel(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        # the directory of the database does not exist yet
+        path = os.path.join(self.tmpdir.name, "instance", "optuna.sqlite3")
+        self.storage = f"sqlite:///{path}"
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_optimize_without_embeddings(self):
+        tm = TopicModel(min_cluster=2, max_cluster=8, storage=None)
+        with self.assertRaises(ValueError):
+            tm.optimize_umap_hdbscan()
+
+    def test_resume_study(self):
+        embeddings = make_embeddings()
+        tm = TopicModel(min_cluster=2, max_cluster=8, max_evals=2, storage=self.storage)
+        tm.embeddings = embeddings
+        tm.optimize_umap_hdbscan()
+
+        resumed = TopicModel(
+            min_cluster=2, max_cluster=8, max_evals=3, storage=self.storage
+        )
+        resumed.embeddings = embeddings
+        best_params = resumed.optimize_umap_hdbscan()
+        study = resumed._load_study(embeddings)
+
+        self.assertEqual(len(study.trials), 3)
+        self.assertEqual(best_params, study.best_params)
+        self.assertIsNotNone(resumed.best_model["cluster"])
+
+    def test_warm_start(self):
+        tm = TopicModel(min_cluster=2, max_cluster=8, max_evals=2, storage=self.storage)
+        tm.embeddings = make_embeddings()
+        best_params = tm.optimize_umap_hdbscan()
+
+        warm = TopicModel(
+            min_cluster=2, max_cluster=8, max_evals=1, storage=self.storage
+        )
+        warm.embeddings = make_embeddings(n_samples=350, random_state=1)
+        warm.optimize_umap_hdbscan()
+        study = warm._load_study(warm.embeddings)
+
+        self.assertEqual(study.trials[0].params, best_params)
+
+    def test_early_stopping(self):
+        embeddings = make_embeddings()
+        records = []
+        tm = TopicModel(
+            min_cluster=2,
+            max_cluster=8,
+            max_evals=10,
+            storage=self.storage,
+            early_stopping_trials=2,
+        )
+        tm.embeddings = embeddings
+        tm.optimize_umap_hdbscan(callbacks=[records.append])
+
+        # the blobs are separated perfectly by the first trial already
+        self.assertEqual([record["number"] for record in records], [0, 1, 2])
+        self.assertEqual(tm.trial_records(), records)
+        for record in records:
+            self.assertEqual(record["state"], "COMPLETE")
+            self.assertEqual(record["best_cost"], 0.0)
+            self.assertEqual(
+                set(record["params"]),
+                {"n_neighbors", "n_components", "min_cluster_size", "min_samples"},
+            )
+            for name in ("umap_fit_s", "hdbscan_fit_s", "peak_rss_mb", "duration_s"):
+                self.assertGreater(record[name], 0)
+
+        # a converged study is not continued
+        resumed = TopicModel(
+            min_cluster=2,
+            max_cluster=8,
+            max_evals=10,
+            storage=self.storage,
+            early_stopping_trials=2,
+        )
+        resumed.embeddings = embeddings
+        resumed.optimize_umap_hdbscan()
+        self.assertEqual(len(resumed.trial_records()), 3)
+        self.assertEqual(resumed.trial_records()[0]["ntopics"], records[0]["ntopics"])
+
+    def test_landmarks(self):
+        embeddings = make_embeddings(n_samples=600)
+        for method in ("kmeans++", "stratified"):
+            tm = TopicModel(
+                min_cluster=2,
+                max_cluster=8,
+                max_evals=2,
+                storage=None,
+                landmarks=200,
+                landmark_method=method,
+                max_memory_mb=1,
+            )
+            tm.embeddings = embeddings
+            tm.optimize_umap_hdbscan()
+
+            self.assertEqual(len(tm.landmark_idx), 200)
+            self.assertEqual(len(np.unique(tm.landmark_idx)), len(tm.landmark_idx))
+            self.assertEqual(tm.get_labels().shape, (600,))
+            np.testing.assert_array_equal(
+                tm.get_labels()[tm.landmark_idx], tm.best_model["cluster"].labels_
+            )
+
+    def test_landmark_quotas(self):
+        # shares below one landmark are rounded up, the largest stratum pays for them
+        sizes = np.array([10_000] + [3] * 99 + [0])
+        quota = TopicModel._landmark_quotas(sizes, 1000)
+        self.assertEqual(quota.sum(), 1000)
+        self.assertTrue(np.all(quota[1:100] == 1))
+        self.assertEqual(quota[100], 0)
+        self.assertTrue(np.all(quota <= sizes))
+
+        quota = TopicModel._landmark_quotas(np.array([50, 30, 20]), 7)
+        np.testing.assert_array_equal(quota, [4, 2, 1])
+
+    def test_compute_2d_embeddings(self):
+        for layout_in_background in (False, True):
+            tm = TopicModel(
+                min_cluster=2,
+                max_cluster=8,
+                max_evals=2,
+                storage=None,
+                layout_in_background=layout_in_background,
+            )
+            tm.embeddings = make_embeddings()
+            tm.optimize_umap_hdbscan()
+            embeddings2d = tm._compute_2d_embeddings()
+
+            self.assertEqual(embeddings2d.shape, (300, 2))
+            self.assertIsNone(tm._layout_executor)
+
+    def test_topic_representations(self):
+        tm = TopicModel(min_cluster=2, max_cluster=8, storage=None)
+        tm.docs = ["cats purr", "cats sleep", "dogs bark", "dogs run"]
+        tm.labels = np.array([0, 0, 1, -1])
+        tm.best_model["cluster"] = object()
+
+        topics = tm.compute_topic_representations(top_n=2)
+        self.assertEqual([label for label, _ in topics], [0, 1])
+        self.assertTrue(topics[0][1].startswith("cats"))
+
+        topics = tm.update_topic_representations(["birds sing"], np.array([2]))
+        self.assertEqual(topics[-1], (2, "birds, sing"))
+
+    def test_memory_budget(self):
+        embeddings = make_embeddings()
+        docs = [f"{row} topic{row % 5}\nword" for row in range(len(embeddings))]
+        tm = TopicModel(
+            min_cluster=2,
+            max_cluster=8,
+            embedding_model=RowEncoder(embeddings),
+            max_evals=3,
+            storage=None,
+            memory_budget_mb=64,
+            spill_dir=self.tmpdir.name,
+        )
+        fitted = []
+        fit_models = tm._fit_models
+
+        def tracked_fit_models(params, X):
+            dim_reducer, cluster = fit_models(params, X)
+            fitted.append(weakref.ref(dim_reducer))
+            return dim_reducer, cluster
+
+        tm._fit_models = tracked_fit_models
+        tm.embed_docs(docs)
+
+        self.assertIsInstance(tm.embeddings, np.memmap)
+        np.testing.assert_array_equal(tm.embeddings, embeddings)
+        self.assertEqual(len(tm.docs), len(docs))
+        self.assertEqual(list(tm.docs), docs)
+
+        tm.optimize_umap_hdbscan()
+        # only the umap model of the best trial is still alive
+        alive = [ref() for ref in fitted if ref() is not None]
+        self.assertEqual(alive, [tm.best_model["umap"]])
+
+        self.assertEqual(tm._compute_2d_embeddings().shape, (300, 2))
+        topics = tm.compute_topic_representations(top_n=1)
+        self.assertEqual(
+            len(topics), len(np.unique(tm.get_labels()[tm.get_labels() >= 0]))
+        )
+        self.assertEqual(
+            set(tm.peak_rss_mb),
+            {"embed", "trial", "optimize", "layout", "topic_representations"},
+        )
+        self.assertTrue(all(peak > 0 for peak in tm.peak_rss_mb.values()))
+
+
+if __name__ == "__main__":
+    unittest.main()
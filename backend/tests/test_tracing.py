@@ -0,0 +1,112 @@
+import asyncio
+import threading
+import time
+import unittest
+from tracing import (
+    Registry,
+    SamplingProfiler,
+    begin_request,
+    server_timing,
+    span,
+    trace_methods,
+    traced,
+)
+import tracing
+
+
+class TestRegistry(unittest.TestCase):
+    def test_render(self):
+        registry = Registry(buckets=(0.1, 1))
+        registry.describe("test_seconds", "Test durations")
+        for seconds in [0.05, 0.1, 0.5, 2]:
+            registry.observe("test_seconds", (("span", 'a"b'),), seconds)
+        text = registry.render([("test_total", "counter", "Tests", 3)])
+        self.assertIn("# TYPE test_seconds histogram", text)
+        self.assertIn('test_seconds_bucket{span="a\\"b",le="0.1"} 2', text)
+        self.assertIn('test_seconds_bucket{span="a\\"b",le="1"} 3', text)
+        self.assertIn('test_seconds_bucket{span="a\\"b",le="+Inf"} 4', text)
+        self.assertIn('test_seconds_sum{span="a\\"b"} 2.65', text)
+        self.assertIn('test_seconds_count{span="a\\"b"} 4', text)
+        self.assertIn("# TYPE test_total counter\ntest_total 3\n", text)
+
+
+class TestSpans(unittest.TestCase):
+    def setUp(self):
+        tracing.REGISTRY.clear()
+
+    def count(self, name: str) -> int:
+        return sum(
+            tracing.REGISTRY.snapshot()[("easytopics_span_seconds", (("span", name),))][
+                0
+            ]
+        )
+
+    def test_request_timings(self):
+        timings = begin_request()
+        with span("db.outer"):
+            with span("db.inner"):
+                time.sleep(0.01)
+        with span("llm.chat"):
+            time.sleep(0.02)
+        # nested spans of a category are counted once in the timings
+        self.assertEqual(self.count("db.inner"), 1)
+        self.assertEqual(self.count("db.outer"), 1)
+        self.assertLess(timings["db"], 0.02)
+        self.assertGreaterEqual(timings["llm"], 0.02)
+        self.assertRegex(
+            server_timing(timings, 0.05),
+            r"^db;dur=[\d.]+, llm;dur=[\d.]+, total;dur=50.0$",
+        )
+
+    def test_trace_methods(self):
+        @trace_methods("test")
+        class Traced:
+            def method(self):
+                return 1
+
+            def _private(self):
+                return 2
+
+            def generator(self):
+                yield 3
+
+            @traced("test.coroutine")
+            async def coroutine(self):
+                return 4
+
+        traced_object = Traced()
+        self.assertEqual(traced_object.method(), 1)
+        self.assertEqual(traced_object._private(), 2)
+        self.assertEqual(list(traced_object.generator()), [3])
+        self.assertEqual(asyncio.run(traced_object.coroutine()), 4)
+        names = {labels[0][1] for _, labels in tracing.REGISTRY.snapshot()}
+        self.assertEqual(names, {"test.method", "test.coroutine"})
+
+
+class TestSamplingProfiler(unittest.TestCase):
+    def test_collapsed_stacks(self):
+        def busy_waiting(stop):
+            while not stop.is_set():
+                pass
+
+        stop = threading.Event()
+        worker = threading.Thread(target=busy_waiting, args=(stop,), name="worker")
+        worker.start()
+        profiler = SamplingProfiler(interval=0.001)
+        profiler.start()
+        time.sleep(0.1)
+        profiler.stop()
+        stop.set()
+        worker.join()
+        self.assertFalse(profiler.running)
+        self.assertGreater(profiler.samples, 0)
+        stacks = [line for line in profiler.collapsed().splitlines()]
+        self.assertTrue(
+            any(
+                line.startswith("worker;") and "busy_waiting" in line for line in stacks
+            )
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+import numpy as np
+from vectorindex import VectorIndex, from_blobs, from_rows, normalize, to_blob
+
+
+def make_vectors(n: int, dims: int = 16, clusters: int = 20, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dims))
+    labels = rng.integers(0, clusters, n)
+    vectors = centers[labels] + rng.normal(scale=0.3, size=(n, dims))
+    return vectors.astype(np.float32)
+
+
+class TestVectorIndex(unittest.TestCase):
+    def test_blobs(self):
+        vectors = make_vectors(5)
+        decoded = from_blobs([to_blob(vector) for vector in vectors])
+        np.testing.assert_array_equal(decoded, vectors)
+        ids, decoded = from_rows(
+            ({"id": i + 1, "vector": to_blob(v)} for i, v in enumerate(vectors)),
+            batch_size=2,
+        )
+        np.testing.assert_array_equal(ids, [1, 2, 3, 4, 5])
+        np.testing.assert_array_equal(decoded, vectors)
+
+    def test_exact_search(self):
+        vectors = make_vectors(500)
+        queries = normalize(make_vectors(3, seed=1))
+        index = VectorIndex(np.arange(500) + 100, vectors.copy())
+        self.assertTrue(index.is_exact)
+
+        ids, scores = index.search(queries, k=5)
+        expected = np.argsort(-(normalize(vectors) @ queries.T), axis=0)[:5].T + 100
+        np.testing.assert_array_equal(ids, expected)
+        self.assertTrue(np.all(np.diff(scores, axis=1) <= 0))
+
+        # a single vector is a single query, fewer vectors than k are padded
+        ids, scores = VectorIndex(np.array([7]), vectors[:1]).search(queries[0], k=3)
+        np.testing.assert_array_equal(ids, [[7, -1, -1]])
+        self.assertEqual(scores[0, 1], -np.inf)
+
+    def test_ivf_search(self):
+        vectors = make_vectors(5000)
+        index = VectorIndex(np.arange(5000), vectors.copy(), exact_max=1000, n_probe=4)
+        self.assertFalse(index.is_exact)
+        self.assertEqual(index.offsets[-1], 5000)
+
+        exact = VectorIndex(np.arange(5000), vectors.copy())
+        queries = make_vectors(20, seed=2)
+        ids, _ = index.search(queries, k=10)
+        expected, _ = exact.search(queries, k=10)
+        recall = np.mean([len(set(a) & set(b)) / 10 for a, b in zip(ids, expected)])
+        self.assertGreater(recall, 0.8)
+
+    def test_empty(self):
+        index = VectorIndex(np.empty(0), np.empty((0, 16)))
+        ids, _ = index.search(np.ones(16), k=2)
+        np.testing.assert_array_equal(ids, [[-1, -1]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+import threading
+from config import TEXT_COMPRESSION_LEVEL, TEXT_COMPRESSION_MIN_BYTES
+
+
+class UnknownDictionaryError(LookupError):
+    """Raised if a text was compressed with a dictionary the codec does not know"""
+
+
+def _zstd():
+    """Imports zstandard, which is only needed once texts are compressed"""
+    try:
+        import zstandard
+    except ImportError as error:
+        raise ImportError("Compressed texts require the zstandard package") from error
+    return zstandard
+
+
+def train_dictionary(
+    samples: list[str], dict_id: int, dict_size: int, level: int
+) -> bytes:
+    """Trains a zstd dictionary on sample texts
+
+    Args:
+        samples (list[str]): the sample texts
+        dict_id (int): the id written into the dictionary and every frame compressed with it
+        dict_size (int): maximum size of the dictionary in bytes
+        level (int): compression level the dictionary is tuned for
+
+    Raises:
+        ValueError: if the samples are too few or too small to train on
+
+    Returns:
+        bytes: the dictionary
+    """
+    zstd = _zstd()
+    try:
+        dictionary = zstd.train_dictionary(
+            dict_size,
+            [sample.encode("utf-8") for sample in samples],
+            dict_id=dict_id,
+            level=level,
+        )
+    except zstd.ZstdError as error:
+        raise ValueError(f"Cannot train a compression dictionary: {error}") from error
+    return dictionary.as_bytes()
+
+
+class TextCodec:
+    """Dictionary-based zstd compression of texts
+
+    Compressed texts are zstd frames, uncompressed texts stay strings, so a database
+    column can hold both and is decoded value by value. Every frame records the id of
+    its dictionary, so texts compressed with older dictionaries stay readable. Texts
+    of a scope are compressed with its active dictionary, or not at all if it has
+    none. Texts shorter than `min_bytes` or that do not shrink are not compressed.
+
+    zstd contexts are not thread safe, every thread gets its own.
+    """
+
+    def __init__(
+        self,
+        level: int = TEXT_COMPRESSION_LEVEL,
+        min_bytes: int = TEXT_COMPRESSION_MIN_BYTES,
+    ) -> None:
+        """Initializes the TextCodec class without dictionaries
+
+        Args:
+            level (int): zstd compression level
+            min_bytes (int): minimum size of a text in bytes to be compressed
+
+        Returns:
+            None
+        """
+        self.level = level
+        self.min_bytes = min_bytes
+        # dictionary id -> dictionary
+        self.dictionaries = {}
+        # scope -> id of the dictionary new texts are compressed with
+        self.active = {}
+        self._local = threading.local()
+
+    def add_dictionary(self, dict_id: int, dictionary: bytes) -> None:
+        """Makes a dictionary available for decompression"""
+        self.dictionaries[dict_id] = dictionary
+
+    def activate(self, scope: str, dict_id: int | None) -> None:
+        """Compresses new texts of a scope with a dictionary, or not at all if None"""
+        if dict_id is None:
+            self.active.pop(scope, None)
+        else:
+            assert dict_id in self.dictionaries, f"Unknown dictionary {dict_id}"
+            self.active[scope] = dict_id
+
+    def encode(self, scope: str, text: str) -> str | bytes:
+        """Compresses a text with the active dictionary of its scope
+
+        Args:
+            scope (str): the scope of the text, e.g. "documents"
+            text (str): the text
+
+        Returns:
+            str | bytes: the zstd frame, or the text itself if it is not compressed
+        """
+        dict_id = self.active.get(scope)
+        if dict_id is None:
+            return text
+        data = text.encode("utf-8")
+        if len(data) < self.min_bytes:
+            return text
+        frame = self._context("compressors", dict_id).compress(data)
+        return frame if len(frame) < len(data) else text
+
+    def decode(self, value):
+        """Decompresses a value written by `encode`, other values are returned as is
+
+        Raises:
+            UnknownDictionaryError: if the dictionary of the frame was not added
+        """
+        if not isinstance(value, bytes):
+            return value
+        dict_id = _zstd().get_frame_parameters(value).dict_id
+        if dict_id != 0 and dict_id not in self.dictionaries:
+            raise UnknownDictionaryError(f"Unknown compression dictionary {dict_id}")
+        return self._context("decompressors", dict_id).decompress(value).decode("utf-8")
+
+    def _context(self, kind: str, dict_id: int):
+        """Returns the compressor or decompressor of the calling thread for a dictionary"""
+        contexts = self._local.__dict__.setdefault(kind, {})
+        if dict_id not in contexts:
+            zstd = _zstd()
+            dictionary = None
+            if dict_id != 0:
+                dictionary = zstd.ZstdCompressionDict(self.dictionaries[dict_id])
+            if kind == "compressors":
+                # digests the dictionary once instead of on every call
+                dictionary.precompute_compress(level=self.level)
+                contexts[dict_id] = zstd.ZstdCompressor(
+                    level=self.level, dict_data=dictionary, write_checksum=False
+                )
+            else:
+                contexts[dict_id] = zstd.ZstdDecompressor(dict_data=dictionary)
+        return contexts[dict_id]
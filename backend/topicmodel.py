@@ -1,10 +1,106 @@
+import contextlib
+import functools
+import gc
+import hashlib
+import itertools
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
 import optuna
-from bertopic import BERTopic
+from sqlalchemy.engine import make_url
 from umap import UMAP
-from hdbscan import HDBSCAN
+from hdbscan import HDBSCAN, approximate_predict
 import numpy as np
+from sklearn.cluster import MiniBatchKMeans, kmeans_plusplus
+from sklearn.decomposition import PCA
 from sentence_transformers import SentenceTransformer
-from config import EMBEDDING_MODEL
+from ctfidf import ClassTfidf
+from tracing import peak_rss_mb, reset_peak_rss, rss_mb, span
+from config import (
+    EMBEDDING_MODEL,
+    OPTUNA_EARLY_STOPPING_TRIALS,
+    OPTUNA_WARM_START_SIZE_RATIO,
+    OPTUNA_WARM_START_TRIALS,
+    TOPICMODEL_MAX_MEMORY_MB,
+    TOPICMODEL_MEMORY_BUDGET_MB,
+    TOPICMODEL_SPILL_DIR,
+)
+
+# Bump SEARCH_SPACE_VERSION whenever SEARCH_SPACE or the cost function changes,
+# persisted studies of older versions are then neither resumed nor used for warm starts
+SEARCH_SPACE_VERSION = 1
+SEARCH_SPACE = {
+    "n_neighbors": (4, 12),
+    "n_components": (3, 12),
+    "min_cluster_size": (5, 15),
+    "min_samples": (2, 4),
+}
+STUDY_PREFIX = f"umap_hdbscan-v{SEARCH_SPACE_VERSION}"
+# user attributes every trial is stored with, see `TopicModel.trial_records`
+TRIAL_ATTRS = (
+    "ntopics",
+    "umap_fit_s",
+    "umap_transform_s",
+    "hdbscan_fit_s",
+    "peak_rss_mb",
+)
+
+LANDMARK_METHODS = ("kmeans++", "stratified")
+
+# rough upper bound of the working memory UMAP transform and HDBSCAN
+# approximate_predict need per row, as a multiple of the size of the raw embedding
+BATCH_MEMORY_FACTOR = 8
+
+# with a memory budget: documents embedded at once until the size of an embedding,
+# and so the batch size, is known, and spilled documents counted at once for the
+# topic representations
+SPILL_BATCH_DOCS = 10_000
+
+
+class SpilledDocs:
+    """Documents written to a file and read back on iteration, see `TopicModel.embed_docs`"""
+
+    def __init__(self, path: str, docs: list[str]) -> None:
+        """Writes the documents to `path`, one JSON string per line
+
+        Args:
+            path (str): file the documents are written to
+            docs (list[str]): list of documents
+
+        Returns:
+            None
+        """
+        self.path = path
+        with open(path, "w", encoding="utf-8") as f:
+            for doc in docs:
+                f.write(json.dumps(doc) + "\n")
+        self._len = len(docs)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self):
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+    def batches(self, size: int):
+        """Yields lists of up to `size` documents"""
+        docs = iter(self)
+        while batch := list(itertools.islice(docs, size)):
+            yield batch
+
+
+def topic_representations(ctfidf: ClassTfidf) -> list[tuple[int, str]]:
+    """Returns tuples (topic label, comma-separated keywords) of the topics of a fitted
+    ClassTfidf, without the outlier topic -1"""
+    return [
+        (label, ", ".join(word for word, _ in words))
+        for label, words in sorted(ctfidf.get_topic_words().items())
+        if label != -1
+    ]
 
 
 class UMAPWrapper:
@@ -59,6 +155,14 @@ class TopicModel:
         prob_threshold: float = 0.1,
         max_evals: int = 20,
         seed: int = 42423,
+        storage: str | None = None,
+        landmarks: int | None = None,
+        landmark_method: str = "stratified",
+        max_memory_mb: int = TOPICMODEL_MAX_MEMORY_MB,
+        layout_in_background: bool = False,
+        memory_budget_mb: int | None = TOPICMODEL_MEMORY_BUDGET_MB,
+        spill_dir: str | None = TOPICMODEL_SPILL_DIR,
+        early_stopping_trials: int | None = OPTUNA_EARLY_STOPPING_TRIALS,
     ) -> None:
         """Initializes the TopicModel class
 
@@ -68,6 +172,14 @@ class TopicModel:
           prob_threshold (float): the probability threshold for the cluster
           max_evals (int): the maximum number of evaluations for hyperparameter optimization
           seed (int): random seed
+          storage (str | None): optuna storage url (e.g. "sqlite:///optuna.sqlite3") to persist and resume studies, `None` keeps the study in memory
+          landmarks (int | None): if set, the optimization runs on this many representative documents only and all other documents are assigned through the fitted models
+          landmark_method (str): how landmarks are chosen, either "kmeans++" or "stratified"
+          max_memory_mb (int): memory budget for the batches in which documents are assigned to topics
+          layout_in_background (bool): if `True`, the 2d layout of each new best model is computed in a background thread while the search continues
+          memory_budget_mb (int | None): if set, documents and embeddings are spilled to memory-mapped files, models of trials that are not the best are freed right away and batch sizes shrink to the memory left under the budget
+          spill_dir (str | None): directory of the spilled files with a memory budget, `None` for the system temporary directory
+          early_stopping_trials (int | None): if set, the search stops once the cost has not improved for this many completed trials
 
         Returns:
           None
@@ -79,29 +191,116 @@ class TopicModel:
         ), "prob_threshold must be between 0.0 and 1.0"
         assert max_evals > 0, "max_evals must be greater than 0"
         assert seed > 0, "seed must be greater than 0"
+        assert landmarks is None or landmarks > 0, "landmarks must be greater than 0"
+        assert (
+            landmark_method in LANDMARK_METHODS
+        ), f"landmark_method must be one of {LANDMARK_METHODS}"
+        assert max_memory_mb > 0, "max_memory_mb must be greater than 0"
+        assert (
+            memory_budget_mb is None or memory_budget_mb > 0
+        ), "memory_budget_mb must be greater than 0"
+        assert (
+            early_stopping_trials is None or early_stopping_trials > 0
+        ), "early_stopping_trials must be greater than 0"
 
         self.docs = None
         self._embedding_model = embedding_model
         self.embeddings = None
         self.embeddings2d = None
+        self.umap2d = None
         self.best_model = {"cost": None, "ntopics": None, "umap": None, "cluster": None}
         self.min_cluster = min_cluster
         self.max_cluster = max_cluster
         self.prob_threshold = prob_threshold
         self.max_evals = max_evals
         self.seed = seed
+        self.storage = storage
+        self.landmarks = landmarks
+        self.landmark_method = landmark_method
+        self.max_memory_mb = max_memory_mb
+        self.landmark_idx = None
+        self.labels = None
+        self.probabilities = None
+        self.layout_in_background = layout_in_background
+        self._layout_executor = None
+        self._layout = None
+        self.ctfidf = None
+        self.memory_budget_mb = memory_budget_mb
+        self.spill_dir = spill_dir
+        self._spill = None
+        # stage -> peak resident set size of the process during the stage in MB,
+        # "trial" is the last trial of the search
+        self.peak_rss_mb = {}
+        # peaks so far of the stages being measured, outermost first
+        self._open_peaks = []
+        # durations of the steps of the last `_fit_models` call
+        self._fit_seconds = {}
+        self.early_stopping_trials = early_stopping_trials
+        self.study = None
+
+    @contextlib.contextmanager
+    def _measure_memory(self, stage: str):
+        """Records the peak resident set size during a stage in `peak_rss_mb`
+
+        Every stage resets the peak of the process, the peak of a stage includes
+        the peaks of the stages nested in it.
+        """
+        if self._open_peaks:
+            self._open_peaks[-1] = max(self._open_peaks[-1], peak_rss_mb())
+        reset_peak_rss()
+        self._open_peaks.append(0.0)
+        try:
+            yield
+        finally:
+            peak = max(self._open_peaks.pop(), peak_rss_mb())
+            if self._open_peaks:
+                self._open_peaks[-1] = max(self._open_peaks[-1], peak)
+            self.peak_rss_mb[stage] = peak
 
     def embed_docs(self, docs: list[str]) -> None:
         """Embeds the documents
 
+        With a memory budget the documents are spilled to a file and the embeddings,
+        computed in batches, to a memory-mapped file, so neither is kept in memory.
+
         Args:
             docs (list[str]): list of documents
 
         Returns:
             None
         """
-        self.docs = docs
-        self.embeddings = self._embedding_model.encode(docs)
+        with self._measure_memory("embed"):
+            if self.memory_budget_mb is None:
+                self.docs = docs
+                with span("embedding.encode"):
+                    self.embeddings = self._embedding_model.encode(docs)
+                return
+
+            # a new directory every time, the files of earlier embeddings may still be mapped
+            self._spill = tempfile.TemporaryDirectory(
+                prefix="topicmodel-", dir=self.spill_dir
+            )
+            self.docs = SpilledDocs(os.path.join(self._spill.name, "docs.jsonl"), docs)
+            path = os.path.join(self._spill.name, "embeddings.npy")
+            embeddings, start, batch_size = None, 0, SPILL_BATCH_DOCS
+            while start < len(docs):
+                with span("embedding.encode"):
+                    batch = np.asarray(
+                        self._embedding_model.encode(docs[start : start + batch_size])
+                    )
+                if embeddings is None:
+                    embeddings = np.lib.format.open_memmap(
+                        path,
+                        mode="w+",
+                        dtype=batch.dtype,
+                        shape=(len(docs), batch.shape[1]),
+                    )
+                    batch_size = self._batch_size(embeddings)
+                embeddings[start : start + len(batch)] = batch
+                start += len(batch)
+            embeddings.flush()
+            del embeddings
+            self.embeddings = np.load(path, mmap_mode="r")
 
     def _is_better_model(self, cost: float) -> bool:
         """Compare the cost of the model to the best model so far
@@ -166,9 +365,49 @@ class TopicModel:
 
         return label_count, cost
 
+    def _fit_models(self, params: dict, X: np.ndarray) -> tuple[UMAP, HDBSCAN]:
+        """Fits UMAP and HDBSCAN for a given set of parameters
+
+        Args:
+            params (dict): parameters from the search space, see `SEARCH_SPACE`
+            X (np.ndarray): raw embeddings
+
+        Returns:
+            tuple[UMAP, HDBSCAN]: the fitted umap and hdbscan models
+        """
+        dim_reducer = UMAP(
+            n_neighbors=params["n_neighbors"],
+            n_components=params["n_components"],
+            metric="cosine",
+            random_state=self.seed,
+        )
+        cluster = HDBSCAN(
+            min_cluster_size=params["min_cluster_size"],
+            min_samples=params["min_samples"],
+            # landmark mode assigns the remaining documents with approximate_predict
+            prediction_data=self.landmarks is not None,
+        )
+
+        with span("topicmodel.umap_fit") as umap_fit:
+            dim_reducer.fit(X)
+        with span("topicmodel.umap_transform") as umap_transform:
+            reduced_embeddings = dim_reducer.transform(X)
+        with span("topicmodel.hdbscan_fit") as hdbscan_fit:
+            cluster.fit_predict(reduced_embeddings)
+
+        self._fit_seconds = {
+            "umap_fit_s": umap_fit.seconds,
+            "umap_transform_s": umap_transform.seconds,
+            "hdbscan_fit_s": hdbscan_fit.seconds,
+        }
+        return dim_reducer, cluster
+
     def _objective(self, trial: optuna.trial.Trial, X: np.ndarray) -> float:
         """Compute
 
+        The number of topics, the durations of the fits and the peak memory are
+        stored with the trial, see `trial_records`.
+
         Args:
             trial (optuna.trial.Trial): optuna trial object
             X (np.ndarray): raw embeddings
@@ -177,39 +416,360 @@ class TopicModel:
             float: the cost of the model
         """
         # search space
-        n_neighbors = trial.suggest_int("n_neighbors", 4, 12)
-        n_components = trial.suggest_int("n_components", 3, 12)
-        min_cluster_size = trial.suggest_int("min_cluster_size", 5, 15)
-        min_samples = trial.suggest_int("min_samples", 2, 4)
+        params = {
+            name: trial.suggest_int(name, low, high)
+            for name, (low, high) in SEARCH_SPACE.items()
+        }
 
-        # setup models
-        dim_reducer = UMAP(
-            n_neighbors=n_neighbors,
-            n_components=n_components,
-            metric="cosine",
-            random_state=self.seed,
-        )
-        cluster = HDBSCAN(min_cluster_size=min_cluster_size, min_samples=min_samples)
+        with self._measure_memory("trial"):
+            dim_reducer, cluster = self._fit_models(params, X)
 
-        # fit model
-        dim_reducer.fit(X)
-        reduced_embeddings = dim_reducer.transform(X)
-        cluster.fit_predict(reduced_embeddings)
+            with span("topicmodel.cost"):
+                label_count, cost = self._compute_cost(cluster, 0.15)
 
-        label_count, cost = self._compute_cost(cluster, 0.15)
+        trial.set_user_attr("ntopics", label_count)
+        for name, seconds in self._fit_seconds.items():
+            trial.set_user_attr(name, seconds)
+        trial.set_user_attr("peak_rss_mb", self.peak_rss_mb["trial"])
 
         if self._is_better_model(cost):
             self._set_best_model(cost, label_count, dim_reducer, cluster)
+            if self.layout_in_background:
+                self._submit_layout(dim_reducer, X)
+
+        if self.memory_budget_mb is not None:
+            # frees the models of this trial, or the best model they replaced, now
+            # instead of at the next run of the garbage collector
+            del dim_reducer, cluster
+            gc.collect()
 
         return cost
 
-    def optimize_umap_hdbscan(self) -> dict:
+    def _study_name(self, embeddings: np.ndarray) -> str:
+        """Builds the study name from the search space version and a dataset fingerprint
+
+        The fingerprint covers the embeddings and the settings of the cost function,
+        so a study is only resumed if its costs are comparable.
+
+        Args:
+            embeddings (np.ndarray): raw embeddings
+
+        Returns:
+            str: the study name
+        """
+        fingerprint = hashlib.sha256()
+        fingerprint.update(str((embeddings.shape, embeddings.dtype.str)).encode())
+        fingerprint.update(
+            str((self.min_cluster, self.max_cluster, self.prob_threshold)).encode()
+        )
+        fingerprint.update(np.ascontiguousarray(embeddings).data)
+        return f"{STUDY_PREFIX}-{fingerprint.hexdigest()[:16]}"
+
+    def _enqueue_warm_start(self, study: optuna.study.Study, ndocs: int) -> None:
+        """Enqueues the best parameters of previous studies on similar-sized corpora
+
+        Args:
+            study (optuna.study.Study): the new, empty study
+            ndocs (int): number of documents in the current corpus
+
+        Returns:
+            None
+        """
+        candidates = []
+        for summary in optuna.get_all_study_summaries(
+            self.storage, include_best_trial=True
+        ):
+            if summary.study_name == study.study_name:
+                continue
+            if not summary.study_name.startswith(STUDY_PREFIX):
+                continue
+            if summary.best_trial is None or "ndocs" not in summary.user_attrs:
+                continue
+            ratio = summary.user_attrs["ndocs"] / ndocs
+            if (
+                1 / OPTUNA_WARM_START_SIZE_RATIO
+                <= ratio
+                <= OPTUNA_WARM_START_SIZE_RATIO
+            ):
+                candidates.append((abs(np.log(ratio)), summary.best_trial.params))
+
+        candidates.sort(key=lambda candidate: candidate[0])
+        for _, params in candidates[:OPTUNA_WARM_START_TRIALS]:
+            study.enqueue_trial(params, skip_if_exists=True)
+
+    def _load_study(self, embeddings: np.ndarray) -> optuna.study.Study:
+        """Creates a new study or loads an existing one for the same dataset
+
+        Args:
+            embeddings (np.ndarray): raw embeddings
+
+        Returns:
+            optuna.study.Study: the study
+        """
+        storage = self.storage
+        if storage is not None:
+            url = make_url(storage)
+            if url.get_backend_name() == "sqlite" and url.database:
+                # sqlite creates the database file but not its directory
+                os.makedirs(
+                    os.path.dirname(os.path.abspath(url.database)), exist_ok=True
+                )
+            # heartbeats mark trials of crashed runs as failed when resuming
+            storage = optuna.storages.RDBStorage(
+                storage, heartbeat_interval=60, grace_period=120
+            )
+
+        study = optuna.create_study(
+            study_name=self._study_name(embeddings),
+            storage=storage,
+            load_if_exists=True,
+            direction="minimize",
+            sampler=optuna.samplers.TPESampler(seed=self.seed),
+        )
+        if storage is not None and len(study.trials) == 0:
+            study.set_user_attr("ndocs", len(embeddings))
+            study.set_user_attr("search_space_version", SEARCH_SPACE_VERSION)
+            self._enqueue_warm_start(study, len(embeddings))
+        return study
+
+    def _converged(self, study: optuna.study.Study) -> bool:
+        """Checks the early stopping rule
+
+        Args:
+            study (optuna.study.Study): the study
+
+        Returns:
+            bool: `True` if the cost has not improved for `early_stopping_trials` completed trials
+        """
+        if self.early_stopping_trials is None:
+            return False
+        costs = [
+            trial.value
+            for trial in study.get_trials(
+                deepcopy=False, states=(optuna.trial.TrialState.COMPLETE,)
+            )
+        ]
+        if not costs:
+            return False
+        return len(costs) - 1 - int(np.argmin(costs)) >= self.early_stopping_trials
+
+    def _on_trial_finished(
+        self,
+        study: optuna.study.Study,
+        trial: optuna.trial.FrozenTrial,
+        callbacks: list[Callable[[dict], None]],
+    ) -> None:
+        """Optuna callback, streams the record of a finished trial and stops the
+        study once it has converged
+
+        Args:
+            study (optuna.study.Study): the study
+            trial (optuna.trial.FrozenTrial): the finished trial
+            callbacks (list[Callable[[dict], None]]): progress callbacks, see `optimize_umap_hdbscan`
+
+        Returns:
+            None
+        """
+        if callbacks:
+            record = self._trial_record(trial)
+            completed = study.get_trials(
+                deepcopy=False, states=(optuna.trial.TrialState.COMPLETE,)
+            )
+            record["best_cost"] = min(t.value for t in completed) if completed else None
+            for callback in callbacks:
+                callback(record)
+        if self._converged(study):
+            study.stop()
+
+    @staticmethod
+    def _trial_record(trial: optuna.trial.FrozenTrial) -> dict:
+        """Flattens a trial and its user attributes, see `trial_records`"""
+        return {
+            "number": trial.number,
+            "state": trial.state.name,
+            "params": trial.params,
+            "cost": trial.value,
+            **{name: trial.user_attrs.get(name) for name in TRIAL_ATTRS},
+            "duration_s": (
+                trial.duration.total_seconds() if trial.duration is not None else None
+            ),
+        }
+
+    def trial_records(self) -> list[dict]:
+        """Returns a record of every trial of the last search, including the trials
+        of earlier runs if the study was resumed
+
+        Records are stored with the study, so with `storage` set they persist
+        alongside the fingerprint of the dataset, see `_study_name`.
+
+        Raises:
+            ValueError: If no search has run. You must first call optimize_umap_hdbscan method.
+
+        Returns:
+            list[dict]: one dict per trial with the keys number, state (e.g. "COMPLETE"),
+                params, cost, ntopics, umap_fit_s, umap_transform_s, hdbscan_fit_s,
+                peak_rss_mb, duration_s and best_cost, the lowest cost up to the trial.
+                Values that are not known, e.g. of failed trials, are `None`.
+        """
+        if self.study is None:
+            raise ValueError(
+                "Study not found, you must first call optimize_umap_hdbscan method."
+            )
+        records, best_cost = [], None
+        for trial in self.study.get_trials(deepcopy=False):
+            record = self._trial_record(trial)
+            if record["state"] == "COMPLETE" and (
+                best_cost is None or record["cost"] < best_cost
+            ):
+                best_cost = record["cost"]
+            record["best_cost"] = best_cost
+            records.append(record)
+        return records
+
+    def _batch_size(self, X: np.ndarray) -> int:
+        """Number of rows of `X` that can be processed at once within `max_memory_mb`
+
+        With a memory budget, also within the memory left under the budget, but at
+        least a sixteenth of it.
+
+        Args:
+            X (np.ndarray): raw embeddings
+
+        Returns:
+            int: the batch size
+        """
+        row_bytes = X.shape[1] * X.itemsize * BATCH_MEMORY_FACTOR
+        memory_mb = self.max_memory_mb
+        if self.memory_budget_mb is not None:
+            left_mb = self.memory_budget_mb - rss_mb()
+            memory_mb = min(memory_mb, max(left_mb, self.memory_budget_mb / 16))
+        return max(1, int(memory_mb * 2**20) // row_bytes)
+
+    def _select_landmarks(self, X: np.ndarray) -> np.ndarray:
+        """Selects the representative subsample the optimization is run on
+
+        "kmeans++" runs k-means++ seeding on a random candidate pool, which spreads
+        the landmarks over the embedding space. "stratified" partitions the
+        embeddings with mini-batch k-means and samples from each partition in
+        proportion to its size, which is cheaper on very large corpora.
+
+        Args:
+            X (np.ndarray): raw embeddings
+
+        Returns:
+            np.ndarray: sorted indices of the landmarks
+        """
+        n_docs = len(X)
+        if self.landmarks >= n_docs:
+            return np.arange(n_docs)
+
+        rng = np.random.default_rng(self.seed)
+
+        if self.landmark_method == "kmeans++":
+            pool_size = min(n_docs, 3 * self.landmarks)
+            pool = np.sort(rng.choice(n_docs, size=pool_size, replace=False))
+            _, indices = kmeans_plusplus(
+                np.asarray(X[pool]),
+                n_clusters=self.landmarks,
+                random_state=self.seed,
+                n_local_trials=1,
+            )
+            return np.sort(pool[indices])
+
+        batch_size = self._batch_size(X)
+        n_strata = max(2, min(100, self.landmarks // 10))
+        kmeans = MiniBatchKMeans(n_clusters=n_strata, random_state=self.seed, n_init=3)
+        sample = np.sort(
+            rng.choice(n_docs, size=min(n_docs, 100 * n_strata), replace=False)
+        )
+        kmeans.fit(np.asarray(X[sample]))
+        strata = np.concatenate(
+            [
+                kmeans.predict(np.asarray(X[start : start + batch_size]))
+                for start in range(0, n_docs, batch_size)
+            ]
+        )
+
+        quota = self._landmark_quotas(
+            np.bincount(strata, minlength=n_strata), self.landmarks
+        )
+        indices = [
+            rng.choice(np.flatnonzero(strata == stratum), size=count, replace=False)
+            for stratum, count in enumerate(quota)
+            if count > 0
+        ]
+        return np.sort(np.concatenate(indices))
+
+    @staticmethod
+    def _landmark_quotas(sizes: np.ndarray, landmarks: int) -> np.ndarray:
+        """Allocates landmarks to strata in proportion to their sizes
+
+        Largest remainders round the shares, and every non-empty stratum gets at
+        least one landmark as long as there are enough. The largest strata give
+        landmarks back, so the quotas always add up to `landmarks`.
+
+        Args:
+            sizes (np.ndarray): number of documents per stratum, at least `landmarks` in total
+            landmarks (int): number of landmarks
+
+        Returns:
+            np.ndarray: number of landmarks per stratum
+        """
+        exact = sizes / sizes.sum() * landmarks
+        quota = np.maximum(np.floor(exact), sizes > 0).astype(int)
+        missing = landmarks - quota.sum()
+        if missing > 0:
+            quota[np.argsort(quota - exact)[:missing]] += 1
+        for _ in range(-missing):
+            quota[np.argmax(quota)] -= 1
+        return quota
+
+    def _assign_batches(self, X: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Assigns all documents to the topics of the best model in bounded-memory batches
+
+        Landmarks keep the labels of the fit, all other documents are reduced with
+        the best UMAP model and assigned with `hdbscan.approximate_predict`.
+
+        Args:
+            X (np.ndarray): raw embeddings of all documents
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: labels and probabilities for all documents
+        """
+        dim_reducer, cluster = self.best_model["umap"], self.best_model["cluster"]
+        labels = np.empty(len(X), dtype=cluster.labels_.dtype)
+        probabilities = np.empty(len(X), dtype=cluster.probabilities_.dtype)
+        labels[self.landmark_idx] = cluster.labels_
+        probabilities[self.landmark_idx] = cluster.probabilities_
+
+        remaining = np.setdiff1d(np.arange(len(X)), self.landmark_idx)
+        batch_size = self._batch_size(X)
+        for start in range(0, len(remaining), batch_size):
+            batch = remaining[start : start + batch_size]
+            reduced_embeddings = dim_reducer.transform(np.asarray(X[batch]))
+            labels[batch], probabilities[batch] = approximate_predict(
+                cluster, reduced_embeddings
+            )
+
+        return labels, probabilities
+
+    def optimize_umap_hdbscan(
+        self, callbacks: list[Callable[[dict], None]] | None = None
+    ) -> dict:
         """
         Optimizes the UMAP and HDBSCAN parameters using Optuna library.
 
         UMAP: n_neighbors, n_components
         HDBSCAN: min_cluster_size, min_samples
 
+        If `storage` is set, the study is persisted and an interrupted search
+        resumes with the remaining trials. New studies are seeded with the best
+        parameters of studies on similar-sized corpora. With `early_stopping_trials`
+        the search ends once the cost has stopped improving, also when resuming.
+
+        Args:
+            callbacks (list[Callable[[dict], None]], optional): called with the record of every finished trial, see `trial_records`
+
         Raises:
             ValueError: If embeddings are not found. You must first call embed_docs method.
 
@@ -221,50 +781,227 @@ class TopicModel:
                 - min_cluster_size: int
                 - min_samples: int
         """
-        if not self.embeddings:
+        if self.embeddings is None:
             raise ValueError(
                 "Embeddings not found, you must first call embed_docs method."
             )
 
-        study = optuna.create_study(
-            direction="minimize", sampler=optuna.samplers.TPESampler(seed=self.seed)
-        )
-        study.optimize(
-            lambda trial: self._objective(trial, self.embeddings),
-            n_trials=self.max_evals,
-        )
+        with self._measure_memory("optimize"):
+            if self.landmarks is not None:
+                self.landmark_idx = self._select_landmarks(self.embeddings)
+                X = np.asarray(self.embeddings[self.landmark_idx])
+            else:
+                X = self.embeddings
+
+            study = self._load_study(X)
+            self.study = study
+            completed = study.get_trials(
+                deepcopy=False, states=(optuna.trial.TrialState.COMPLETE,)
+            )
+            remaining = self.max_evals - len(completed)
+            if remaining > 0 and not self._converged(study):
+                study.optimize(
+                    lambda trial: self._objective(trial, X),
+                    n_trials=remaining,
+                    callbacks=[
+                        functools.partial(
+                            self._on_trial_finished, callbacks=callbacks or []
+                        )
+                    ],
+                )
+
+            # the best trial may stem from an earlier run, refit it in that case
+            if self._is_better_model(study.best_value):
+                dim_reducer, cluster = self._fit_models(study.best_params, X)
+                label_count, cost = self._compute_cost(cluster, 0.15)
+                self._set_best_model(cost, label_count, dim_reducer, cluster)
+
+        if self.landmarks is not None:
+            with self._measure_memory("assign"):
+                self.labels, self.probabilities = self._assign_batches(self.embeddings)
+        else:
+            self.labels = self.best_model["cluster"].labels_
+            self.probabilities = self.best_model["cluster"].probabilities_
+
         return study.best_params
 
-    def _compute_2d_embeddings(self, embeddings: np.ndarray) -> np.ndarray:
-        """Computes the 2d embeddings for visualization
+    def _layout_2d(self, dim_reducer: UMAP, X: np.ndarray) -> UMAP:
+        """Fits the 2d UMAP for visualization on top of a fitted UMAP model
+
+        The nearest neighbours of `dim_reducer` are reused instead of being searched
+        again and the layout is initialised with the first two principal components
+        of its reduced embeddings, so the optimization starts close to its result.
 
         Args:
-            embeddings (np.ndarray): raw embeddings
+            dim_reducer (UMAP): fitted umap model
+            X (np.ndarray): raw embeddings `dim_reducer` was fitted on
 
         Returns:
-            np.ndarray: 2d embeddings
+            UMAP: the fitted 2d umap model
         """
-        if not self.best_model["umap"]:
-            raise ValueError("UMAP model not found, you must first call optim method.")
-        n_neighbors = self.best_model["umap"].n_neighbors
+        knn_search_index = getattr(dim_reducer, "_knn_search_index", None)
+        if knn_search_index is not None:
+            precomputed_knn = (
+                dim_reducer._knn_indices,
+                dim_reducer._knn_dists,
+                knn_search_index,
+            )
+        else:
+            # small datasets use exact distances and have no knn search index
+            precomputed_knn = (None, None, None)
+
+        init = PCA(n_components=2, random_state=self.seed).fit_transform(
+            dim_reducer.embedding_
+        )
         umap2d = UMAP(
-            n_neighbors=n_neighbors,
+            n_neighbors=dim_reducer.n_neighbors,
             n_components=2,
             metric="cosine",
             random_state=self.seed,
+            init=init,
+            precomputed_knn=precomputed_knn,
+        )
+        umap2d.fit(X)
+        return umap2d
+
+    def _submit_layout(self, dim_reducer: UMAP, X: np.ndarray) -> None:
+        """Computes the 2d layout for a new best model in a background thread
+
+        A layout that was submitted for a previous best model and has not started
+        yet is cancelled.
+
+        Args:
+            dim_reducer (UMAP): fitted umap model of the new best model
+            X (np.ndarray): raw embeddings `dim_reducer` was fitted on
+
+        Returns:
+            None
+        """
+        if self._layout_executor is None:
+            self._layout_executor = ThreadPoolExecutor(max_workers=1)
+        if self._layout is not None:
+            self._layout[1].cancel()
+        self._layout = (
+            dim_reducer,
+            self._layout_executor.submit(self._layout_2d, dim_reducer, X),
         )
-        umap2d.fit(embeddings)
-        self.embeddings2d = umap2d.transform(embeddings)
+
+    def _compute_2d_embeddings(self) -> np.ndarray:
+        """Computes the 2d embeddings of the embedded documents for visualization
+
+        Uses the layout computed in the background during the search if it belongs
+        to the best model. In landmark mode the layout is fitted on the landmarks
+        and all other documents are transformed in batches. The layout reuses the
+        neighbour graph of the best UMAP model, so it can only be computed for the
+        embeddings the model was fitted on, other embeddings are placed with
+        `umap2d.transform`.
+
+        Returns:
+            np.ndarray: 2d embeddings
+        """
+        if not self.best_model["umap"]:
+            raise ValueError("UMAP model not found, you must first call optim method.")
+        with self._measure_memory("layout"):
+            embeddings = self.embeddings
+            if self.landmark_idx is not None:
+                X = np.asarray(embeddings[self.landmark_idx])
+            else:
+                X = embeddings
+
+            umap2d = None
+            if self._layout is not None and self._layout[0] is self.best_model["umap"]:
+                umap2d = self._layout[1].result()
+            if self._layout_executor is not None:
+                self._layout_executor.shutdown(wait=False, cancel_futures=True)
+                self._layout_executor, self._layout = None, None
+            if umap2d is None:
+                umap2d = self._layout_2d(self.best_model["umap"], X)
+            # transforms documents added later onto the layout
+            self.umap2d = umap2d
+
+            if self.landmark_idx is None:
+                self.embeddings2d = umap2d.embedding_
+                return self.embeddings2d
+
+            self.embeddings2d = np.empty((len(embeddings), 2), dtype=np.float32)
+            self.embeddings2d[self.landmark_idx] = umap2d.embedding_
+            remaining = np.setdiff1d(np.arange(len(embeddings)), self.landmark_idx)
+            batch_size = self._batch_size(embeddings)
+            for start in range(0, len(remaining), batch_size):
+                batch = remaining[start : start + batch_size]
+                self.embeddings2d[batch] = umap2d.transform(
+                    np.asarray(embeddings[batch])
+                )
+            return self.embeddings2d
+
+    def compute_topic_representations(self, top_n: int = 10) -> list[tuple[int, str]]:
+        """Computes the keywords of each topic with c-TF-IDF over the labels of the best model
+
+        Args:
+            top_n (int, optional): number of keywords per topic. Defaults to 10.
+
+        Returns:
+            list[tuple[int, str]]: tuples (topic label, comma-separated keywords) without the outlier topic -1
+        """
+        if self.docs is None:
+            raise ValueError(
+                "Documents not found, you must first call embed_docs method."
+            )
+        labels = self.get_labels()
+        with self._measure_memory("topic_representations"):
+            if isinstance(self.docs, SpilledDocs):
+                # counted in batches, so the spilled documents are never all in memory
+                self.ctfidf = ClassTfidf(top_n=top_n)
+                start = 0
+                for batch in self.docs.batches(SPILL_BATCH_DOCS):
+                    self.ctfidf.partial_fit(batch, labels[start : start + len(batch)])
+                    start += len(batch)
+            else:
+                self.ctfidf = ClassTfidf(top_n=top_n).fit(self.docs, labels)
+        return self.get_topic_representations()
+
+    def update_topic_representations(
+        self, docs: list[str], labels: np.ndarray
+    ) -> list[tuple[int, str]]:
+        """Adds new documents to the c-TF-IDF counts without refitting
+
+        Args:
+            docs (list[str]): new documents
+            labels (np.ndarray): topic labels of the new documents
+
+        Returns:
+            list[tuple[int, str]]: the updated topic representations, see `compute_topic_representations`
+        """
+        if self.ctfidf is None:
+            raise ValueError(
+                "Topic representations not found, you must first call compute_topic_representations method."
+            )
+        self.ctfidf.partial_fit(docs, labels)
+        return self.get_topic_representations()
+
+    def get_topic_representations(self) -> list[tuple[int, str]]:
+        """Returns the keywords of each topic, see `compute_topic_representations`
+
+        Returns:
+            list[tuple[int, str]]: tuples (topic label, comma-separated keywords)
+        """
+        if self.ctfidf is None:
+            raise ValueError(
+                "Topic representations not found, you must first call compute_topic_representations method."
+            )
+        return topic_representations(self.ctfidf)
 
     def get_labels(self) -> np.ndarray:
         """Returns the labels for the best model
 
+        In landmark mode these are the labels of all documents, not only of the landmarks.
+
         Returns:
           labels (np.ndarray): the labels for the best model
         """
         if not self.best_model["cluster"]:
             raise ValueError("Best model not found, you must first call optim method.")
-        return self.best_model["cluster"].labels_
+        return self.labels
 
 
 if __name__ == "__main__":
@@ -0,0 +1,428 @@
+import bisect
+import collections
+import contextvars
+import functools
+import inspect
+import os
+import resource
+import sys
+import threading
+import time
+from config import PROFILER_INTERVAL, PROFILER_MAX_DEPTH, TRACING_BUCKETS
+
+# Time spent per span category in the current request, see `begin_request`
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+# Span categories open in the current context, nested spans of an open category are
+# not added to the request timings again
+_open_categories = contextvars.ContextVar("open_categories", default=frozenset())
+
+
+class Histogram:
+    """Counts of durations in buckets, safe to observe from any thread"""
+
+    __slots__ = ("buckets", "counts", "total", "_lock")
+
+    def __init__(self, buckets: tuple) -> None:
+        self.buckets = buckets
+        # one count per bucket and one for +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        """Counts a duration in the bucket of the smallest upper bound it does not exceed"""
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.total += seconds
+
+    def snapshot(self) -> tuple[list[int], float]:
+        """Returns a copy of the counts per bucket and the sum of the durations"""
+        with self._lock:
+            return list(self.counts), self.total
+
+    def clear(self) -> None:
+        with self._lock:
+            self.counts = [0] * len(self.counts)
+            self.total = 0.0
+
+
+class Registry:
+    """Histograms of durations in the Prometheus text exposition format
+
+    Every histogram is identified by a metric name and its labels. The registry is
+    shared by all threads. Histograms are created on their first observation and
+    never removed, so callers may keep the histogram of a span, see `traced`.
+    """
+
+    def __init__(self, buckets: tuple = TRACING_BUCKETS) -> None:
+        """Initializes the Registry class without histograms
+
+        Args:
+            buckets (tuple): ascending upper bounds of the buckets in seconds
+
+        Returns:
+            None
+        """
+        self.buckets = tuple(buckets)
+        self._help = {}
+        # (metric, labels) -> Histogram
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def describe(self, metric: str, help_text: str) -> None:
+        """Sets the HELP text of a metric"""
+        self._help[metric] = help_text
+
+    def histogram(self, metric: str, labels: tuple) -> Histogram:
+        """Returns the histogram of a metric and labels, created if it does not exist
+
+        Args:
+            metric (str): name of the histogram, e.g. "easytopics_span_seconds"
+            labels (tuple): (name, value) pairs of the labels
+
+        Returns:
+            Histogram: the histogram
+        """
+        histogram = self._histograms.get((metric, labels))
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(
+                    (metric, labels), Histogram(self.buckets)
+                )
+        return histogram
+
+    def observe(self, metric: str, labels: tuple, seconds: float) -> None:
+        """Counts a duration in the histogram of a metric and labels"""
+        self.histogram(metric, labels).observe(seconds)
+
+    def snapshot(self) -> dict:
+        """Returns the counts per bucket and the sum of every histogram with observations
+
+        Returns:
+            dict: (metric, labels) -> (counts, sum)
+        """
+        with self._lock:
+            histograms = list(self._histograms.items())
+        snapshot = {}
+        for key, histogram in histograms:
+            counts, total = histogram.snapshot()
+            if any(counts):
+                snapshot[key] = (counts, total)
+        return snapshot
+
+    def render(self, extra: list[tuple] = ()) -> str:
+        """Renders all histograms and extra samples for GET /metrics
+
+        Args:
+            extra (list[tuple]): (metric, type, help, value) of further samples, e.g.
+                ("easytopics_response_cache_bytes", "gauge", "...", 1024)
+
+        Returns:
+            str: the metrics in the Prometheus text exposition format 0.0.4
+        """
+        lines, described = [], set()
+        bounds = [_format_value(bound) for bound in self.buckets] + ["+Inf"]
+        for (metric, labels), (counts, total) in sorted(self.snapshot().items()):
+            if metric not in described:
+                described.add(metric)
+                lines.append(f"# HELP {metric} {self._help.get(metric, metric)}")
+                lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                bucket_labels = _format_labels(labels + (("le", bound),))
+                lines.append(f"{metric}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {cumulative}")
+        for metric, metric_type, help_text, value in extra:
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} {metric_type}")
+            lines.append(f"{metric} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def clear(self) -> None:
+        """Resets all histograms to no observations"""
+        with self._lock:
+            histograms = list(self._histograms.values())
+        for histogram in histograms:
+            histogram.clear()
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+REGISTRY = Registry()
+REGISTRY.describe("easytopics_span_seconds", "Duration of traced spans in seconds")
+REGISTRY.describe(
+    "easytopics_request_seconds", "Duration of HTTP requests until the response is sent"
+)
+
+
+class span:
+    """Times a block of code as a span, used as a context manager
+
+    The duration is counted in the histogram of the span. The part of the name
+    before the first dot is the category of the span, e.g. "db" for
+    "db.get_document", and the durations of the outermost spans of a category are
+    added to the timings of the current request, see `begin_request`. After the
+    block, `seconds` is its duration.
+
+    Args:
+        name (str): the name of the span, "<category>.<operation>"
+    """
+
+    __slots__ = ("name", "category", "histogram", "seconds", "_start", "_token")
+
+    def __init__(self, name: str, histogram: Histogram | None = None) -> None:
+        self.name = name
+        self.category = name.split(".", 1)[0]
+        self.histogram = histogram or REGISTRY.histogram(
+            "easytopics_span_seconds", (("span", name),)
+        )
+
+    def __enter__(self) -> "span":
+        categories = _open_categories.get()
+        if self.category in categories:
+            self._token = None
+        else:
+            self._token = _open_categories.set(categories | {self.category})
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.seconds = seconds = time.perf_counter() - self._start
+        self.histogram.observe(seconds)
+        if self._token is not None:
+            _open_categories.reset(self._token)
+            timings = _request_timings.get()
+            if timings is not None:
+                timings[self.category] += seconds
+
+
+def traced(name: str):
+    """Decorator that runs every call of a function or coroutine function in a span"""
+
+    def decorator(func):
+        histogram = REGISTRY.histogram("easytopics_span_seconds", (("span", name),))
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name, histogram):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, histogram):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def trace_methods(category: str):
+    """Class decorator that runs the public methods of a class in spans
+
+    Every call of a method `name` is a span "<category>.<name>". Generator methods
+    are left alone, their duration is not the duration of the call.
+    """
+
+    def decorator(cls):
+        for name, member in list(vars(cls).items()):
+            if (
+                name.startswith("_")
+                or not inspect.isfunction(member)
+                or inspect.isgeneratorfunction(member)
+            ):
+                continue
+            setattr(cls, name, traced(f"{category}.{name}")(member))
+        return cls
+
+    return decorator
+
+
+def begin_request() -> dict:
+    """Starts collecting the time spent per span category for the current request
+
+    Returns:
+        dict: category -> seconds, filled by the spans of the request
+    """
+    timings = collections.defaultdict(float)
+    _request_timings.set(timings)
+    _open_categories.set(frozenset())
+    return timings
+
+
+def server_timing(timings: dict, total: float) -> str:
+    """Formats request timings as the value of a Server-Timing header, in milliseconds
+
+    The durations of concurrent spans of a category add up, so a category may take
+    longer than the request, e.g. llm if the LLM is asked about several texts at once.
+    """
+    metrics = [
+        f"{category};dur={seconds * 1000:.1f}" for category, seconds in timings.items()
+    ]
+    return ", ".join(metrics + [f"total;dur={total * 1000:.1f}"])
+
+
+def observe_request(method: str, route: str, status: int, seconds: float) -> None:
+    """Counts the duration of a request in the histogram of its route"""
+    labels = (("method", method), ("route", route), ("status", str(status)))
+    REGISTRY.observe("easytopics_request_seconds", labels, seconds)
+
+
+class SamplingProfiler:
+    """Statistical profiler that samples the stacks of all threads
+
+    A background thread records the stack of every other thread every `interval`
+    seconds, so the overhead does not depend on the profiled code and the profiler
+    can be turned on in production. Samples are aggregated in the collapsed stack
+    format of flamegraph.pl and speedscope.
+    """
+
+    def __init__(
+        self, interval: float = PROFILER_INTERVAL, max_depth: int = PROFILER_MAX_DEPTH
+    ) -> None:
+        """Initializes the SamplingProfiler class, stopped
+
+        Args:
+            interval (float): seconds between two samples
+            max_depth (int): frames recorded per stack, innermost first
+
+        Returns:
+            None
+        """
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = 0
+        self._stacks = collections.Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> None:
+        """Starts sampling, samples of earlier runs are kept"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="sampling-profiler", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stops sampling"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+
+    def reset(self) -> None:
+        """Removes all samples"""
+        with self._lock:
+            self._stacks.clear()
+            self.samples = 0
+
+    def collapsed(self) -> str:
+        """Returns the samples as "thread;outer frame;...;inner frame count" lines"""
+        with self._lock:
+            stacks = self._stacks.most_common()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                frames = []
+                while frame is not None and len(frames) < self.max_depth:
+                    code = frame.f_code
+                    frames.append(
+                        f"{code.co_name} ({os.path.basename(code.co_filename)}:"
+                        f"{code.co_firstlineno})"
+                    )
+                    frame = frame.f_back
+                thread_name = names.get(thread_id, str(thread_id))
+                stacks.append(";".join([thread_name, *reversed(frames)]))
+            with self._lock:
+                self._stacks.update(stacks)
+                self.samples += 1
+
+
+PROFILER = SamplingProfiler()
+
+
+def _proc_status_mb(field: str) -> float | None:
+    """Reads a memory field of /proc/self/status, e.g. "VmRSS", in MB, on Linux only"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    # the value is in kB
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def rss_mb() -> float:
+    """Returns the resident set size of the process in MB, 0 if it is unknown"""
+    return _proc_status_mb("VmRSS") or 0.0
+
+
+def peak_rss_mb() -> float:
+    """Returns the peak resident set size of the process in MB
+
+    On Linux this is the peak since the last `reset_peak_rss`, elsewhere the peak
+    since the process started.
+    """
+    peak = _proc_status_mb("VmHWM")
+    if peak is not None:
+        return peak
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KiB elsewhere
+    return maxrss / 2**20 if sys.platform == "darwin" else maxrss / 1024
+
+
+def reset_peak_rss() -> bool:
+    """Resets the peak resident set size to the current one, so the peak of a stage
+    can be measured
+
+    The peak is shared by all threads of the process. Only supported on Linux.
+
+    Returns:
+        bool: `True` if the peak was reset
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return True
@@ -0,0 +1,210 @@
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+from config import VECTOR_INDEX_EXACT_MAX, VECTOR_INDEX_N_PROBE
+
+# Number of vectors scored per matrix product in exact search and list assignment
+BLOCK_SIZE = 65_536
+
+
+def to_blob(vector: np.ndarray) -> bytes:
+    """Encodes a vector as little-endian float32 bytes for the Embeddings table"""
+    return np.asarray(vector, dtype="<f4").tobytes()
+
+
+def from_blobs(blobs: list[bytes]) -> np.ndarray:
+    """Decodes vectors stored with `to_blob` into a matrix of shape (len(blobs), dim)"""
+    if len(blobs) == 0:
+        return np.empty((0, 0), dtype=np.float32)
+    matrix = np.frombuffer(b"".join(blobs), dtype="<f4").reshape(len(blobs), -1)
+    return matrix.astype(np.float32)
+
+
+def from_rows(rows, batch_size: int = 10_000) -> tuple[np.ndarray, np.ndarray]:
+    """Decodes embeddings rows, e.g. of `TextDB.iter_embeddings`, batch by batch
+
+    Args:
+        rows: iterable of dicts with "id" and the encoded "vector"
+        batch_size (int): number of rows decoded at once, bounds the extra memory
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: ids of shape (n,) and vectors of shape (n, dim)
+    """
+    ids, chunks, batch = [], [], []
+    for row in rows:
+        ids.append(row["id"])
+        batch.append(row["vector"])
+        if len(batch) == batch_size:
+            chunks.append(from_blobs(batch))
+            batch = []
+    if batch:
+        chunks.append(from_blobs(batch))
+    if not chunks:
+        return np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32)
+    return np.array(ids, dtype=np.int64), np.concatenate(chunks)
+
+
+def normalize(vectors: np.ndarray, copy: bool = True) -> np.ndarray:
+    """Scales vectors to unit length, zero vectors stay zero
+
+    Args:
+        vectors (np.ndarray): vectors of shape (..., dim)
+        copy (bool): if False, float32 vectors are normalized in place
+
+    Returns:
+        np.ndarray: the normalized float32 vectors
+    """
+    if copy:
+        vectors = np.array(vectors, dtype=np.float32)
+    else:
+        vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return np.divide(vectors, np.maximum(norms, 1e-12), out=vectors)
+
+
+class VectorIndex:
+    """Nearest-neighbour index for cosine similarity over embeddings
+
+    Up to `exact_max` vectors are searched exactly with blocked matrix products.
+    Larger collections use an inverted file (IVF) index: the vectors are clustered
+    into `n_lists` lists by k-means on a sample and stored sorted by list, so a
+    list is a contiguous slice. A query scores the centroids, then only the
+    vectors of the `n_probe` closest lists, which makes search approximate.
+    """
+
+    def __init__(
+        self,
+        ids: np.ndarray,
+        vectors: np.ndarray,
+        exact_max: int = VECTOR_INDEX_EXACT_MAX,
+        n_lists: int | None = None,
+        n_probe: int = VECTOR_INDEX_N_PROBE,
+        seed: int = 42423,
+    ) -> None:
+        """Builds the index
+
+        Args:
+            ids (np.ndarray): ids of the vectors of shape (n,)
+            vectors (np.ndarray): vectors of shape (n, dim), float32 vectors are
+                normalized in place to avoid a copy
+            exact_max (int): maximum number of vectors searched exactly
+            n_lists (int, optional): number of IVF lists. Defaults to sqrt(n).
+            n_probe (int): number of IVF lists scored per query
+            seed (int): random seed for the k-means clustering
+
+        Returns:
+            None
+        """
+        assert n_probe > 0, "n_probe must be greater than 0"
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.vectors = normalize(vectors, copy=False)
+        assert self.vectors.ndim == 2 and len(self.vectors) == len(
+            self.ids
+        ), "vectors must have shape (len(ids), dim)"
+        self.n_probe = n_probe
+        self.centroids = None
+        self.offsets = None
+
+        if len(self.ids) > exact_max:
+            if n_lists is None:
+                n_lists = int(np.sqrt(len(self.ids)))
+            self._build_lists(min(n_lists, len(self.ids)), seed)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def is_exact(self) -> bool:
+        return self.centroids is None
+
+    def _build_lists(self, n_lists: int, seed: int) -> None:
+        """Clusters the vectors into IVF lists and sorts them by list"""
+        rng = np.random.default_rng(seed)
+        sample_size = min(len(self.ids), 64 * n_lists)
+        sample = self.vectors[rng.choice(len(self.ids), sample_size, replace=False)]
+        kmeans = MiniBatchKMeans(
+            n_clusters=n_lists,
+            batch_size=max(1024, 4 * n_lists),
+            n_init=1,
+            random_state=seed,
+        ).fit(sample)
+        self.centroids = normalize(kmeans.cluster_centers_)
+
+        lists = np.concatenate(
+            [
+                np.argmax(
+                    self.vectors[start : start + BLOCK_SIZE] @ self.centroids.T, axis=1
+                )
+                for start in range(0, len(self.ids), BLOCK_SIZE)
+            ]
+        )
+        order = np.argsort(lists, kind="stable")
+        self.ids = self.ids[order]
+        self.vectors = np.ascontiguousarray(self.vectors[order])
+        self.offsets = np.searchsorted(lists[order], np.arange(n_lists + 1))
+
+    def search(self, queries: np.ndarray, k: int = 10) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the `k` most similar vectors of each query
+
+        Args:
+            queries (np.ndarray): query vectors of shape (q, dim) or (dim,)
+            k (int): number of neighbours per query
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: ids and cosine similarities of shape (q, k),
+                best first. Rows are padded with id -1 and similarity -inf if fewer
+                than `k` vectors are found.
+        """
+        queries = normalize(np.atleast_2d(queries))
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        if len(self) == 0 or k <= 0:
+            return ids, scores
+
+        if self.is_exact:
+            positions, top_scores = self._search_exact(queries, k)
+            ids[:, : positions.shape[1]] = self.ids[positions]
+            scores[:, : positions.shape[1]] = top_scores
+            return ids, scores
+
+        n_probe = min(self.n_probe, len(self.centroids))
+        probes = _top_k(queries @ self.centroids.T, n_probe)[0]
+        for i, lists in enumerate(probes):
+            # lists are contiguous slices, scoring them one by one avoids a gather
+            slices = [slice(self.offsets[j], self.offsets[j + 1]) for j in lists]
+            candidates = np.concatenate([np.arange(s.start, s.stop) for s in slices])
+            candidate_scores = np.concatenate(
+                [self.vectors[s] @ queries[i] for s in slices]
+            )
+            positions, top_scores = _top_k(candidate_scores[np.newaxis], k)
+            ids[i, : positions.shape[1]] = self.ids[candidates[positions[0]]]
+            scores[i, : positions.shape[1]] = top_scores[0]
+        return ids, scores
+
+    def _search_exact(
+        self, queries: np.ndarray, k: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Scores all vectors block by block, keeping the running top k per query"""
+        best_positions = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        for start in range(0, len(self), BLOCK_SIZE):
+            block_scores = queries @ self.vectors[start : start + BLOCK_SIZE].T
+            positions, block_scores = _top_k(block_scores, k)
+            best_positions = np.concatenate([best_positions, positions + start], axis=1)
+            best_scores = np.concatenate([best_scores, block_scores], axis=1)
+            top, best_scores = _top_k(best_scores, k)
+            best_positions = np.take_along_axis(best_positions, top, axis=1)
+        return best_positions, best_scores
+
+
+def _top_k(scores: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """Returns the column indices and values of the k largest scores per row, best first"""
+    k = min(k, scores.shape[1])
+    if k < scores.shape[1]:
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        top = np.tile(np.arange(scores.shape[1]), (len(scores), 1))
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind="stable")
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(
+        top_scores, order, axis=1
+    )